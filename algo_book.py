@@ -48,28 +48,96 @@ Code Author: Brendan Torok
 
 Running Time Analysis of get_org_budget
 --------------------
-This code runs in O(n) time. When invoking the get_org_budget method, the organization is created through the
-build_organization method. This method first loops through each employee and creates a node for each instance. This
-takes O(n) time. The build_organization method then loops through each employee node by employee_id and updates the
-reports, and is_manager flag. Both of these updates take O(1) time, and since the method iterates through all employees,
-it takes O(n) time. Once the tree is constructed, the current employee id is found from the organization and assigned to
-the node variable which takes O(1) time. The function then moves to check if the current node is None. This takes O(1)
-time. There is then two if statements in the get_org_budget method. Inside this for loop there is a call to
-get_subordinate_budget recursive helper method. The recursive helper method sets the current node value which takes O(1)
-time. It then goes through all reports of the current employee. This takes O(n) time, where n is the number of reports
-to the manager. The current budget is added to the return value of the recursive helper. The addition takes O(1) time.
-The second if statement has another call to the same recursive helper method which takes O(n) time.
-
-Therefore, the final runtime is O(n + n + n) which simplifies to O(n)
+get_org_budget runs in O(1) time once the organization is built. The constructor calls build_organization_tree, which
+creates the node of every employee and links it to its manager in O(1) time per employee, so the tree is built in O(n)
+time. build_organization_tree then calls build_org_budget_index, a post-order traversal that pushes and pops every node
+once on its explicit stack and sums the totals of the reports of each node into its org_budget. Every node is the
+report of at most one manager, so the index takes O(n) time, O(n) space and O(d) extra stack space where d is the depth
+of the tree. Both traversals in the class use an explicit stack, so deep chains of managers are not limited by the
+recursion limit.
+
+A query finds the node in the organization dictionary in O(1) time, checks the is_manager flag in O(1) time to
+redirect an IC to its manager, and reads the precomputed org_budget of that node in O(1) time. The tree is therefore
+built once in O(n) time and every query after that is O(1). get_subordinate_budgets still walks the subtree in O(s)
+time, where s is the size of the organization, and the tests use it to check the index.
+
+The update methods keep the index correct without rebuilding it. update_budget, add_employee and remove_employee only
+change the totals on the path from the employee to its root, which takes O(d) time where d is the depth of the employee.
+move_employee walks the ancestors of the new manager to reject cycles and updates the old and new ancestor paths, which
+is also O(d). Removing a node from its manager's list of reports takes O(r) time where r is the number of direct reports
+of that manager, and remove_employee also relinks the r reports of the removed employee.
+
+Running Time Analysis of manager queries
+--------------------
+The first manager query builds an OrgAncestorIndex in O(n log d) time and space, where d is the depth of the tree. It
+numbers the nodes in pre-order, records their depths and builds a binary lifting table whose level j holds the 2^j-th
+manager of every node, each level computed from the previous one in O(n) time. get_kth_manager decomposes k into powers
+of two and takes at most log d jumps, so it runs in O(log d) time. get_lowest_common_manager lifts the deeper employee
+to the depth of the other and then lifts both while their ancestors differ, also in O(log d) time. The combined budget
+queries add the O(1) indexed get_org_budget. add_employee, remove_employee and move_employee drop the index, and it is
+rebuilt on the next manager query.
+
+Running Time Analysis of org aggregates
+--------------------
+compute_org_aggregates computes every registered aggregate (sum, count, max or per category sums) for every subtree in
+a single post-order pass, combining the finished totals of the reports into each node. For a aggregates this takes
+O(a * n) time, plus the size of the per category dictionaries merged for category sums. The totals are cached on the
+nodes, so get_org_aggregates reads any number of metrics of an organization in O(a) time. Budget updates and changes
+to the tree mark the cache stale and the next query recomputes it.
+
+Running Time Analysis of loading the organization
+--------------------
+add_employees creates the node of every employee and links it to its manager as it arrives, which takes O(1) time per
+employee. Reports that arrive before their manager wait in the pending_reports dictionary and are linked in O(1) time
+each when the manager arrives, so an employee list or a file streamed in chunks is linked in O(n) time regardless of
+the order of the records. finalize_organization_tree checks that no manager is missing and builds the org budget index
+in one O(n) pass. from_file only holds one chunk of records in memory at a time next to the nodes of the tree.
+
+Running Time Analysis of AlgoBookFlatOrganization
+--------------------
+The flat organization stores the tree as typed arrays in pre-order (Euler tour entry) order instead of node objects.
+Building it lays out the reports of every manager contiguously in O(n) time, walks the tree in pre-order with an
+explicit stack in O(n) time, accumulates subtree sizes from the back of the pre-order in O(n) time and builds the
+Fenwick tree over the budgets in O(n) time. Every subtree is the contiguous range [entry, exit) of the pre-order, so
+get_org_budget looks up the position in O(1) time and computes a range sum with two Fenwick prefix sums in
+O(log n) time. update_budget changes a single budget in O(log n) time.
+
+get_org_budgets answers a batch of m employees. When m log n is smaller than n the batch uses the Fenwick tree in
+O(m log n) time, otherwise it takes one O(n) pass to build plain prefix sums and answers every employee in O(1), for
+O(n + m) in total. Asking for every employee of the company is therefore O(n) instead of O(n^2).
+
+Running Time Analysis of snapshots
+--------------------
+save_snapshot sorts the employee ids in O(n log n) time and writes the pre-order arrays and the budget prefix sums in
+O(n) time. AlgoBookSnapshotOrganization.load memory maps the file and creates views over its sections in O(1) time,
+without reading or parsing any employee. get_org_budget binary searches the sorted ids in O(log n) time and subtracts
+two prefix sums in O(1) time, so a restarted process answers queries as soon as the file is mapped.
+
+share_snapshot writes the same layout into a multiprocessing shared memory block in O(n log n) time. Worker processes
+attach to the block by name in O(1) time and answer queries from a read only view of it, so every worker shares a single
+copy of the tree instead of holding its own organization dictionary.
 
 """
+import bisect
+import csv
+import json
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+from array import array
+from multiprocessing import resource_tracker, shared_memory
 
 
 class Employee:
-    def __init__(self, employee_id, manager_id, budget):
+    def __init__(self, employee_id, manager_id, budget, attributes=None):
         self.employee_id = employee_id
         self.manager_id = manager_id
         self.budget = budget
+        # optional extra fields such as a cost center or currency, used by the org aggregates
+        self.attributes = attributes
 
 
 class EmployeeTreeNode:
@@ -77,57 +145,791 @@ class EmployeeTreeNode:
         self.id = employee.employee_id
         self.budget = employee.budget
         self.manager_id = employee.manager_id
+        self.attributes = employee.attributes
         # The below fields need to be set after instantiation
         self.reports = []
         self.manager_node = None
         self.is_manager = False
+        # aggregated budget of the subtree rooted at this node, filled in by build_org_budget_index
+        self.org_budget = 0
+        # aggregates of the subtree rooted at this node by name, filled in by compute_org_aggregates
+        self.aggregates = None
+
+
+def parse_employee_field(value):
+    # CSV fields are strings, an empty field is a missing manager and numbers are converted back to numbers
+    if value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def read_employee_chunks(path, chunk_size=100_000):
+    # yield lists of at most chunk_size Employee objects from a .jsonl file (one object per line) or a .csv file
+    # with an employee_id,manager_id,budget header. Extra fields or columns become employee attributes
+    with open(path, newline="") as file:
+        if path.endswith(".jsonl"):
+            records = (json.loads(line) for line in file if line.strip())
+        else:
+            records = ({field: parse_employee_field(value) for field, value in row.items()}
+                       for row in csv.DictReader(file))
+
+        chunk = []
+        for record in records:
+            # any field besides the three employee fields is kept as an attribute of the employee
+            employee_id = record.pop("employee_id")
+            manager_id = record.pop("manager_id", None)
+            budget = record.pop("budget")
+            chunk.append(Employee(employee_id, manager_id, budget, record or None))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+# snapshot files start with this header: magic, format version, byte order ("l" or "b"), budget typecode ("q" or
+# "d") and the number of employees, followed by five 8-byte aligned sections (see AlgoBookSnapshotOrganization)
+SNAPSHOT_HEADER = struct.Struct("<8sIcc2xQ")
+SNAPSHOT_MAGIC = b"ALGOBOOK"
+SNAPSHOT_VERSION = 1
+# names of the shared memory blocks created by share_snapshot in this process (and inherited by forked workers). Their
+# resource tracker registration belongs to the creator and is kept when they are attached
+shared_snapshot_names = set()
+
+
+class InvalidReorgError(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def get_node_value(node, field):
+    # the budget is a node field, everything else comes from the optional employee attributes
+    if field == "budget":
+        return node.budget
+    if node.attributes is None:
+        return None
+    return node.attributes.get(field)
+
+
+class SumAggregate:
+    def __init__(self, field="budget"):
+        self.field = field
+
+    def empty(self):
+        return 0
+
+    def node_value(self, node):
+        value = get_node_value(node, self.field)
+        return 0 if value is None else value
+
+    def combine(self, total, report_total):
+        return total + report_total
+
+
+class CountAggregate:
+    def empty(self):
+        return 0
+
+    def node_value(self, node):
+        return 1
+
+    def combine(self, total, report_total):
+        return total + report_total
+
+
+class MaxAggregate:
+    def __init__(self, field="budget"):
+        self.field = field
+
+    def empty(self):
+        return None
+
+    def node_value(self, node):
+        return get_node_value(node, self.field)
+
+    def combine(self, total, report_total):
+        # employees without the field are skipped
+        if total is None:
+            return report_total
+        if report_total is None:
+            return total
+        return max(total, report_total)
+
+
+class CategorySumAggregate:
+    def __init__(self, category, field="budget"):
+        # sums of the field split by the value of the category attribute, e.g. budget per cost center
+        self.category = category
+        self.field = field
+
+    def empty(self):
+        return {}
+
+    def node_value(self, node):
+        # always a new dictionary, combine adds the totals of the reports into it
+        value = get_node_value(node, self.field)
+        category = get_node_value(node, self.category)
+        if value is None or category is None:
+            return {}
+        return {category: value}
+
+    def combine(self, total, report_total):
+        for category, value in report_total.items():
+            total[category] = total.get(category, 0) + value
+        return total
+
+
+class OrgAncestorIndex:
+    def __init__(self, roots, iter_subtree):
+        # number the nodes in pre-order from every root, positions index the typed arrays below
+        self.nodes = [node for root in roots for node in iter_subtree(root)]
+        self.positions = {node.id: position for position, node in enumerate(self.nodes)}
+        size = len(self.nodes)
+
+        # depth of every node and the position of its manager (-1 for a root). Managers come before their reports
+        # in pre-order, so the depth of the manager is always known when a report is reached
+        self.depths = array("q", bytes(8 * size))
+        managers = array("q", [-1]) * size
+        for position, node in enumerate(self.nodes):
+            if node.manager_node is not None:
+                manager_position = self.positions[node.manager_node.id]
+                managers[position] = manager_position
+                self.depths[position] = self.depths[manager_position] + 1
+
+        # binary lifting table, jumps[j][position] is the position of the 2^j-th manager above the node or -1 when
+        # the node is less than 2^j levels deep. Each level is built from the previous one by jumping twice
+        self.jumps = [managers]
+        for level in range(1, max(self.depths, default=0).bit_length()):
+            previous = self.jumps[-1]
+            self.jumps.append(array("q", (-1 if manager < 0 else previous[manager] for manager in previous)))
+
+    def kth_ancestor(self, position, k):
+        # decompose k into powers of two and take the matching jumps, O(log n)
+        if k > self.depths[position]:
+            return -1
+        level = 0
+        while k and position >= 0:
+            if k & 1:
+                position = self.jumps[level][position]
+            k >>= 1
+            level += 1
+        return position
+
+    def lowest_common_ancestor(self, first, second):
+        # lift the deeper node to the depth of the other, then lift both together while their ancestors differ
+        if self.depths[first] < self.depths[second]:
+            first, second = second, first
+        first = self.kth_ancestor(first, self.depths[first] - self.depths[second])
+        if first == second:
+            return first
+        for level in range(len(self.jumps) - 1, -1, -1):
+            jump = self.jumps[level]
+            if jump[first] != jump[second]:
+                first, second = jump[first], jump[second]
+        # both nodes are now reports of the same manager, or roots of different trees (-1)
+        return self.jumps[0][first]
 
 
 class AlgoBookOrganization:
     def __init__(self, employees):
         # create organization tree using dictionary
         self.organization = {}
+        self.pending_reports = {}
+        # binary lifting index for manager queries, built on first use and dropped whenever the tree changes shape
+        self.ancestor_index = None
+        # the aggregates cached on every node by compute_org_aggregates, recomputed on the next query after the tree
+        # or a budget changes
+        self.aggregates = {}
+        self.aggregates_stale = True
         self.build_organization_tree(employees)
 
+    @classmethod
+    def from_file(cls, path, chunk_size=100_000):
+        # stream the employees of a CSV or JSONL export into the tree one chunk at a time, so only the nodes and a
+        # single chunk of records are held in memory
+        organization = cls([])
+        for employees in read_employee_chunks(path, chunk_size):
+            organization.add_employees(employees)
+        organization.finalize_organization_tree()
+        return organization
+
     def build_organization_tree(self, employees):
-        # iterate through every employee instance to create node for each and add it to the organization dictionary
+        # link every employee as it arrives and then total the subtrees once
+        self.add_employees(employees)
+        self.finalize_organization_tree()
+
+    def add_employees(self, employees):
+        # reports whose manager has not been seen yet wait here, keyed by the missing manager id, so employees can
+        # arrive in any order (for example in chunks of a file that lists reports before their managers)
         for employee in employees:
-            self.organization[employee.employee_id] = EmployeeTreeNode(employee)
+            node = EmployeeTreeNode(employee)
+            previous_node = self.organization.get(node.id)
+            if previous_node is not None:
+                self.replace_node(previous_node, node)
+            self.organization[node.id] = node
 
-        # iterate through the employees to populate reports and is_manager flag
-        for employee_id, node in self.organization.items():
-            # if there is a manager id, then add the current node to the manager id's list of reports
+            # attach the reports that were waiting for this employee
+            for report in self.pending_reports.pop(node.id, []):
+                self.attach_to_manager(report, node)
+
+            # if there is a manager id, then add the current node to the manager id's list of reports, or wait for the
+            # manager to arrive
             if node.manager_id is not None:
-                manager_node = self.organization[node.manager_id]
-                manager_node.reports.append(node)
-                # set the is manager flag to true for the manager nodes
-                manager_node.is_manager = True
+                manager_node = self.organization.get(node.manager_id)
+                if manager_node is None:
+                    self.pending_reports.setdefault(node.manager_id, []).append(node)
+                else:
+                    self.attach_to_manager(node, manager_node)
+
+    def replace_node(self, previous_node, node):
+        # a repeated employee id replaces the earlier record, the same as assigning it into the dictionary again
+        if previous_node.manager_node is None and previous_node.manager_id is not None:
+            # the earlier record no longer waits for its manager, and a manager nobody waits for is not missing
+            waiting_reports = self.pending_reports[previous_node.manager_id]
+            waiting_reports.remove(previous_node)
+            if not waiting_reports:
+                del self.pending_reports[previous_node.manager_id]
+        self.detach_from_manager(previous_node)
+        for report in previous_node.reports:
+            self.attach_to_manager(report, node)
+        previous_node.reports = []
+
+    def finalize_organization_tree(self):
+        # every manager must have arrived by now, report the first one that never did
+        for manager_id in self.pending_reports:
+            raise KeyError(manager_id)
+
+        # precompute the subtree budget of every node so get_org_budget is a single lookup
+        self.build_org_budget_index()
+
+    def get_roots(self):
+        # roots are the employees without a manager, normally only the CEO
+        return [node for node in self.organization.values() if node.manager_node is None]
+
+    def iter_subtree(self, node):
+        # pre-order traversal with an explicit stack instead of recursion, so the depth of the tree is only limited
+        # by memory. Reports are followed through the node references, so there is no dictionary lookup per node
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(node.reports)
+
+    def iter_post_order(self, roots):
+        # post-order traversal with an explicit stack of (node, iterator over its reports). A node is yielded once
+        # its iterator is exhausted, which guarantees every report is yielded before its manager
+        for root in roots:
+            stack = [(root, iter(root.reports))]
+            while stack:
+                node, reports = stack[-1]
+                report = next(reports, None)
+                if report is None:
+                    stack.pop()
+                    yield node
+                else:
+                    stack.append((report, iter(report.reports)))
+
+    def build_org_budget_index(self):
+        # every report is totalled before its manager in post-order, so each manager is its own budget plus the
+        # finished totals of its reports
+        for node in self.iter_post_order(self.get_roots()):
+            node.org_budget = node.budget + sum(report.org_budget for report in node.reports)
+
+    def add_to_ancestor_budgets(self, node, delta):
+        # walk the manager_node pointers from the node up to its root, only the organizations on this path contain
+        # the node so they are the only totals that change
+        while node is not None:
+            node.org_budget += delta
+            node = node.manager_node
+
+    def attach_to_manager(self, node, manager_node):
+        # link the node under its new manager (or make it a root) and keep the manager_id field in sync
+        node.manager_node = manager_node
+        node.manager_id = None if manager_node is None else manager_node.id
+        self.ancestor_index = None
+        self.aggregates_stale = True
+        if manager_node is not None:
+            manager_node.reports.append(node)
+            manager_node.is_manager = True
+
+    def detach_from_manager(self, node):
+        # unlink the node from its current manager, a manager left without reports becomes an IC again
+        manager_node = node.manager_node
+        if manager_node is not None:
+            manager_node.reports.remove(node)
+            manager_node.is_manager = len(manager_node.reports) > 0
+        node.manager_node = None
+        self.ancestor_index = None
+        self.aggregates_stale = True
+
+    def update_budget(self, employee_id, budget):
+        node = self.organization.get(employee_id)
+        if node is None:
+            raise InvalidReorgError(f"Employee {employee_id} does not exist")
+
+        # the node's own organization and every organization above it change by the same amount
+        delta = budget - node.budget
+        node.budget = budget
+        self.add_to_ancestor_budgets(node, delta)
+        self.aggregates_stale = True
+
+    def add_employee(self, employee: Employee):
+        if employee.employee_id in self.organization:
+            raise InvalidReorgError(f"Employee {employee.employee_id} already exists")
+        manager_node = None
+        if employee.manager_id is not None:
+            manager_node = self.organization.get(employee.manager_id)
+            if manager_node is None:
+                raise InvalidReorgError(f"Manager {employee.manager_id} does not exist")
+
+        # a new hire has no reports, so its organization budget is only its own budget
+        node = EmployeeTreeNode(employee)
+        node.org_budget = node.budget
+        self.organization[node.id] = node
+        self.attach_to_manager(node, manager_node)
+        self.add_to_ancestor_budgets(manager_node, node.budget)
+
+    def remove_employee(self, employee_id):
+        node = self.organization.get(employee_id)
+        if node is None:
+            raise InvalidReorgError(f"Employee {employee_id} does not exist")
+        manager_node = node.manager_node
+        if manager_node is None and node.reports:
+            raise InvalidReorgError(f"Employee {employee_id} is a root with reports and cannot be removed")
+
+        # the reports of the removed employee move up to its manager. Their subtrees stay the same, so only the
+        # removed employee's own budget leaves the organizations above it
+        self.add_to_ancestor_budgets(manager_node, -node.budget)
+        self.detach_from_manager(node)
+        for report in node.reports:
+            self.attach_to_manager(report, manager_node)
+        node.reports = []
+        del self.organization[employee_id]
+
+    def move_employee(self, employee_id, new_manager_id):
+        node = self.organization.get(employee_id)
+        if node is None:
+            raise InvalidReorgError(f"Employee {employee_id} does not exist")
+        new_manager_node = self.organization.get(new_manager_id)
+        if new_manager_node is None:
+            raise InvalidReorgError(f"Manager {new_manager_id} does not exist")
+
+        # walk up from the new manager, if the moved employee is found then the move would create a cycle
+        ancestor = new_manager_node
+        while ancestor is not None:
+            if ancestor is node:
+                raise InvalidReorgError(f"Employee {employee_id} cannot report to {new_manager_id} inside its own org")
+            ancestor = ancestor.manager_node
+
+        # the whole subtree budget leaves the old ancestor path and joins the new one
+        self.add_to_ancestor_budgets(node.manager_node, -node.org_budget)
+        self.detach_from_manager(node)
+        self.attach_to_manager(node, new_manager_node)
+        self.add_to_ancestor_budgets(new_manager_node, node.org_budget)
 
     def get_subordinate_budgets(self, employee_id):
         # set node to be the current node from employee id
         node = self.organization.get(employee_id)
-        # instantiate the budget to be the current nodes budget
-        budget = node.budget
-        # iterate through all reports for the manager node and add the budget of each subordinate node to the current
-        # manager node. Recursively call get_subordinate_budgets function to add budgets of all subordinate reports
-        for employee in node.reports:
-            budget += self.get_subordinate_budgets(employee.id)
-        return budget
+        # add the budget of the node and of every subordinate node below it, using the iterative traversal so deep
+        # chains of managers do not hit the recursion limit
+        return sum(subordinate.budget for subordinate in self.iter_subtree(node))
 
-    def get_org_budget(self, employee_id):
-        # set the current node from given employee id
+    def get_org_node(self, employee_id):
+        # set the current node from given employee id, None if the employee id does not exist in tree
         node = self.organization.get(employee_id)
+        if node is None:
+            return None
+
+        # if the current node is not a manager, then the organization is the one of its superior. A root without any
+        # reports has no superior, so its organization is just itself
+        if node.is_manager is False and node.manager_node is not None:
+            return node.manager_node
+
+        # if the current node is a manager node, then the organization is its own subtree
+        return node
+
+    def get_org_budget(self, employee_id):
+        node = self.get_org_node(employee_id)
         # if the employee id does not exist in tree, return a budget of 0
         if node is None:
             return 0
+        # the organization budget was already totalled by the index
+        return node.org_budget
+
+    def set_org_aggregates(self, aggregates):
+        # aggregates maps a name to an aggregate (SumAggregate, CountAggregate, MaxAggregate, CategorySumAggregate or
+        # any object with the same empty, node_value and combine methods)
+        self.aggregates = dict(aggregates)
+        self.aggregates_stale = True
+
+    def compute_org_aggregates(self):
+        # one post-order pass computes every aggregate of every subtree, since the reports of a node are always
+        # finished before the node itself
+        for node in self.iter_post_order(self.get_roots()):
+            totals = {}
+            for name, aggregate in self.aggregates.items():
+                total = aggregate.node_value(node)
+                for report in node.reports:
+                    total = aggregate.combine(total, report.aggregates[name])
+                totals[name] = total
+            node.aggregates = totals
+        self.aggregates_stale = False
+
+    def get_org_aggregates(self, employee_id, names=None):
+        # the aggregates of the employee's organization (with the same IC redirect as get_org_budget), all of them
+        # or only the given names. Several metrics of an org are read from the cache without another traversal
+        if self.aggregates_stale:
+            self.compute_org_aggregates()
+        names = self.aggregates.keys() if names is None else names
+        node = self.get_org_node(employee_id)
+        if node is None:
+            return {name: self.aggregates[name].empty() for name in names}
+        return {name: node.aggregates[name] for name in names}
+
+    def get_ancestor_index(self):
+        if self.ancestor_index is None:
+            self.ancestor_index = OrgAncestorIndex(self.get_roots(), self.iter_subtree)
+        return self.ancestor_index
+
+    def get_kth_manager(self, employee_id, k):
+        # the manager k levels above the employee (k = 0 is the employee itself), or None if there is no such manager
+        index = self.get_ancestor_index()
+        position = index.positions.get(employee_id)
+        if position is None or k < 0:
+            return None
+        position = index.kth_ancestor(position, k)
+        return None if position < 0 else index.nodes[position].id
+
+    def get_lowest_common_manager(self, first_id, second_id):
+        # the nearest employee whose organization contains both employees (one of them if it manages the other),
+        # or None if either employee is unknown or they belong to different roots
+        index = self.get_ancestor_index()
+        first = index.positions.get(first_id)
+        second = index.positions.get(second_id)
+        if first is None or second is None:
+            return None
+        position = index.lowest_common_ancestor(first, second)
+        return None if position < 0 else index.nodes[position].id
+
+    def get_kth_manager_org_budget(self, employee_id, k):
+        # budget of the organization of the manager k levels above the employee, 0 if there is no such manager
+        return self.get_org_budget(self.get_kth_manager(employee_id, k))
+
+    def get_common_manager_org_budget(self, first_id, second_id):
+        # budget of the organization of the lowest common manager, 0 if the employees have none
+        return self.get_org_budget(self.get_lowest_common_manager(first_id, second_id))
+
+    def get_org_budgets(self, employee_ids):
+        # every subtree total was accumulated in one bottom-up pass by build_org_budget_index, so the batch only
+        # resolves the IC redirect and reads the totals
+        return [self.get_org_budget(employee_id) for employee_id in employee_ids]
+
+    def to_flat_organization(self):
+        # snapshots use the flat pre-order layout, so lay the nodes out as a flat organization first
+        employees = (Employee(node.id, node.manager_id, node.budget) for node in self.organization.values())
+        return AlgoBookFlatOrganization(employees)
+
+    def save_snapshot(self, path):
+        self.to_flat_organization().save_snapshot(path)
+
+    def share_snapshot(self):
+        return self.to_flat_organization().share_snapshot()
+
+    def memory_footprint(self):
+        # bytes held by the organization dictionary and by every node object, its attribute dictionary and its list
+        # of reports. The employee ids and budgets themselves are shared with the Employee objects and not counted
+        size = sys.getsizeof(self.organization)
+        for node in self.organization.values():
+            size += sys.getsizeof(node) + sys.getsizeof(node.__dict__) + sys.getsizeof(node.reports)
+        return size
+
+
+class AlgoBookFlatOrganization:
+    def __init__(self, employees):
+        # map of employee id to the position of the employee in the pre-order (Euler tour entry index)
+        self.positions = {}
+        # the fields below are typed arrays indexed by pre-order position:
+        # - employee_ids: the employee at each position
+        # - exits: one past the last position of the employee's subtree, so the subtree is positions [pos, exit)
+        # - managers: the position of the employee's manager, or -1 for a root
+        # - budgets: the budget of the employee
+        # - fenwick: a Fenwick tree (1-indexed) over budgets, so a subtree budget is a sum over a contiguous range
+        self.employee_ids = array("q")
+        self.exits = array("q")
+        self.managers = array("q")
+        self.budgets = array("q")
+        self.fenwick = array("q")
+        self.build_flat_tree(employees)
+
+    def build_flat_tree(self, employees):
+        # keep the last employee for every id, the same as the node organization dictionary
+        employees = list({employee.employee_id: employee for employee in employees}.values())
+        size = len(employees)
+        index_of = {employee.employee_id: index for index, employee in enumerate(employees)}
+
+        # count the reports of every manager and lay them out contiguously (compressed sparse rows), so the tree can
+        # be walked without creating a list of reports per employee
+        report_counts = array("q", bytes(8 * (size + 1)))
+        manager_indexes = array("q", bytes(8 * size))
+        roots = []
+        for index, employee in enumerate(employees):
+            if employee.manager_id is None:
+                manager_indexes[index] = -1
+                roots.append(index)
+            else:
+                manager_index = index_of[employee.manager_id]
+                manager_indexes[index] = manager_index
+                report_counts[manager_index + 1] += 1
+        for index in range(size):
+            report_counts[index + 1] += report_counts[index]
+        report_slots = array("q", report_counts)
+        reports = array("q", bytes(8 * size))
+        for index in range(size):
+            manager_index = manager_indexes[index]
+            if manager_index >= 0:
+                reports[report_slots[manager_index]] = index
+                report_slots[manager_index] += 1
+        del report_slots
+
+        # pre-order walk with an explicit stack. Reports are pushed in reverse so they are visited in input order
+        order = array("q")
+        stack = roots[::-1]
+        while stack:
+            index = stack.pop()
+            order.append(index)
+            stack.extend(reversed(reports[report_counts[index]:report_counts[index + 1]]))
+        if len(order) != size:
+            raise ValueError("The employees contain a cycle of managers that is not connected to any root")
+        del reports, report_counts
+
+        # translate input indexes to pre-order positions
+        position_of = array("q", bytes(8 * size))
+        for position, index in enumerate(order):
+            position_of[index] = position
 
-        # if the current node is not a manager, then get the subordinate budgets of its superior
-        if node.is_manager is False:
-            return self.get_subordinate_budgets(node.manager_id)
+        # integer budgets are stored exactly, anything else falls back to floating point
+        typecode = "q" if all(isinstance(employee.budget, int) for employee in employees) else "d"
+        self.budgets = array(typecode, (employees[index].budget for index in order))
+        self.employee_ids = array("q") if all(isinstance(employee.employee_id, int) for employee in employees) else []
+        self.employee_ids.extend(employees[index].employee_id for index in order)
+        self.managers = array("q", (-1 if manager_indexes[index] < 0 else position_of[manager_indexes[index]]
+                                    for index in order))
+        self.positions = {employee_id: position for position, employee_id in enumerate(self.employee_ids)}
 
-        # if the current node is a manager node, then get the budgets of managers reports
-        if node.is_manager:
-            return self.get_subordinate_budgets(employee_id)
+        # subtree sizes accumulate from the end of the pre-order back to the front, since every report comes after
+        # its manager. The exit index of a subtree is its entry position plus its size
+        self.exits = array("q", [1]) * size
+        for position in range(size - 1, 0, -1):
+            manager_position = self.managers[position]
+            if manager_position >= 0:
+                self.exits[manager_position] += self.exits[position]
+        for position in range(size):
+            self.exits[position] += position
+
+        self.build_fenwick_tree()
+
+    def build_fenwick_tree(self):
+        # linear time Fenwick construction, each slot pushes its partial sum to the next slot that covers it
+        size = len(self.budgets)
+        self.fenwick = array(self.budgets.typecode, [0]) + self.budgets
+        for index in range(1, size + 1):
+            parent = index + (index & -index)
+            if parent <= size:
+                self.fenwick[parent] += self.fenwick[index]
+
+    def prefix_budget(self, end):
+        # sum of the budgets in positions [0, end)
+        total = 0
+        while end > 0:
+            total += self.fenwick[end]
+            end -= end & -end
+        return total
+
+    def range_budget(self, start, end):
+        # sum of the budgets in positions [start, end), a subtree is always one such contiguous range
+        return self.prefix_budget(end) - self.prefix_budget(start)
+
+    def build_prefix_budgets(self):
+        # plain prefix sums, prefix[i] is the sum of the budgets in positions [0, i)
+        prefix = array(self.budgets.typecode, [0])
+        total = 0
+        for budget in self.budgets:
+            total += budget
+            prefix.append(total)
+        return prefix
+
+    def update_budget(self, employee_id, budget):
+        position = self.positions[employee_id]
+        delta = budget - self.budgets[position]
+        self.budgets[position] = budget
+        index = position + 1
+        while index < len(self.fenwick):
+            self.fenwick[index] += delta
+            index += index & -index
+
+    def get_org_position(self, employee_id):
+        # return the pre-order position of the root of the employee's organization, or None for unknown employees
+        position = self.positions.get(employee_id)
+        if position is None:
+            return None
+        # an IC (a subtree of size one) belongs to its manager's organization, unless it is a root on its own
+        if self.exits[position] - position == 1 and self.managers[position] >= 0:
+            return self.managers[position]
+        return position
+
+    def get_org_budget(self, employee_id):
+        position = self.get_org_position(employee_id)
+        # if the employee id does not exist in tree, return a budget of 0
+        if position is None:
+            return 0
+        return self.range_budget(position, self.exits[position])
+
+    def get_org_budgets(self, employee_ids):
+        employee_ids = list(employee_ids)
+        # a handful of queries is cheaper through the Fenwick tree, O(log n) each
+        if len(employee_ids) * len(self.budgets).bit_length() < len(self.budgets):
+            return [self.get_org_budget(employee_id) for employee_id in employee_ids]
+
+        # for large batches take one pass over the budgets to build plain prefix sums, after which every
+        # organization budget is the difference of two prefix sums in O(1)
+        prefix = self.build_prefix_budgets()
+        budgets = []
+        for employee_id in employee_ids:
+            position = self.get_org_position(employee_id)
+            budgets.append(0 if position is None else prefix[self.exits[position]] - prefix[position])
+        return budgets
+
+    def snapshot_sections(self):
+        if not isinstance(self.employee_ids, array):
+            raise ValueError("Snapshots can only store integer employee ids")
+
+        # the ids are stored sorted next to their positions so a snapshot can binary search them in place instead of
+        # rebuilding the positions dictionary, and the budgets are stored as prefix sums so it never needs a Fenwick
+        # tree either
+        size = len(self.employee_ids)
+        sorted_positions = array("q", sorted(range(size), key=self.employee_ids.__getitem__))
+        sorted_ids = array("q", (self.employee_ids[position] for position in sorted_positions))
+        header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, sys.byteorder[0].encode(),
+                                      self.budgets.typecode.encode(), size)
+        return header, [sorted_ids, sorted_positions, self.exits, self.managers, self.build_prefix_budgets()]
+
+    def save_snapshot(self, path):
+        header, sections = self.snapshot_sections()
+        # write next to the destination and rename, so a reader never maps a half written snapshot
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(header)
+            for section in sections:
+                section.tofile(file)
+        os.replace(temporary_path, path)
+
+    def share_snapshot(self):
+        # copy the snapshot layout into a new shared memory block that worker processes can attach to by name with
+        # AlgoBookSnapshotOrganization.attach. The caller owns the block and must close and unlink it
+        header, sections = self.snapshot_sections()
+        size = len(header) + sum(len(section) * section.itemsize for section in sections)
+        block = shared_memory.SharedMemory(create=True, size=size)
+        shared_snapshot_names.add(block.name)
+        block.buf[:len(header)] = header
+        offset = len(header)
+        for section in sections:
+            section_bytes = memoryview(section).cast("B")
+            block.buf[offset:offset + len(section_bytes)] = section_bytes
+            offset += len(section_bytes)
+        return block
+
+    def memory_footprint(self):
+        # bytes held by the typed arrays and the id to position dictionary
+        size = sys.getsizeof(self.positions) + sys.getsizeof(self.employee_ids)
+        for field in [self.exits, self.managers, self.budgets, self.fenwick]:
+            size += sys.getsizeof(field)
+        return size
+
+
+class AlgoBookSnapshotOrganization:
+    def __init__(self, buffer, source=None):
+        # answer queries straight from a snapshot buffer (a memory map of a snapshot file, a shared memory block, or
+        # any other buffer with the same bytes) without copying or parsing the employees. The source is the object
+        # that owns the buffer and is closed together with the snapshot
+        magic, version, byteorder, typecode, size = SNAPSHOT_HEADER.unpack_from(buffer)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("Not an AlgoBook organization snapshot")
+        if byteorder.decode() != sys.byteorder[0]:
+            raise ValueError("The snapshot was written on a machine with a different byte order")
+
+        self.source = source
+        self.size = size
+        # a read only view, so a worker attached to a shared block cannot change the tree of the other workers
+        view = memoryview(buffer).toreadonly()
+        offset = SNAPSHOT_HEADER.size
+        sections = []
+        for length, section_typecode in [(size, "q"), (size, "q"), (size, "q"), (size, "q"),
+                                         (size + 1, typecode.decode())]:
+            sections.append(view[offset:offset + 8 * length].cast(section_typecode))
+            offset += 8 * length
+        # the sections mirror AlgoBookFlatOrganization: ids sorted with their pre-order positions, subtree exits,
+        # manager positions and prefix sums of the budgets in pre-order
+        self.sorted_ids, self.sorted_positions, self.exits, self.managers, self.prefix_budgets = sections
+
+    @classmethod
+    def load(cls, path):
+        # memory map the snapshot read only, pages are loaded lazily by the operating system as queries touch them
+        with open(path, "rb") as file:
+            memory_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(memory_map, memory_map)
+
+    @classmethod
+    def attach(cls, name):
+        # attach to a shared memory block created by share_snapshot in another process, nothing is copied
+        # only the creating process owns the block. Python 3.13 can skip registering the block with the resource
+        # tracker. Older versions register it with the tracker of the attaching process, which unlinks the block
+        # when that process exits, so a worker that is not a child of the creator would destroy the shared org for
+        # every other worker. The registration is therefore taken back right away, unless this process created the
+        # block and the registration is the creator's own
+        try:
+            block = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            block = shared_memory.SharedMemory(name=name)
+            if block.name not in shared_snapshot_names:
+                resource_tracker.unregister(block._name, "shared_memory")
+        return cls(block.buf, block)
+
+    def close(self):
+        # release the views before closing the underlying buffer
+        for section in [self.sorted_ids, self.sorted_positions, self.exits, self.managers, self.prefix_budgets]:
+            section.release()
+        if self.source is not None:
+            self.source.close()
+
+    def get_org_position(self, employee_id):
+        # binary search the sorted ids in place, O(log n). The ids are 64-bit integers, so any other id is unknown
+        if not isinstance(employee_id, int):
+            return None
+        index = bisect.bisect_left(self.sorted_ids, employee_id)
+        if index == self.size or self.sorted_ids[index] != employee_id:
+            return None
+        position = self.sorted_positions[index]
+        # an IC (a subtree of size one) belongs to its manager's organization, unless it is a root on its own
+        if self.exits[position] - position == 1 and self.managers[position] >= 0:
+            return self.managers[position]
+        return position
+
+    def get_org_budget(self, employee_id):
+        position = self.get_org_position(employee_id)
+        # if the employee id does not exist in tree, return a budget of 0
+        if position is None:
+            return 0
+        return self.prefix_budgets[self.exits[position]] - self.prefix_budgets[position]
+
+    def get_org_budgets(self, employee_ids):
+        return [self.get_org_budget(employee_id) for employee_id in employee_ids]
 
 
 class TestAlgoBookOrganization:
@@ -138,6 +940,30 @@ class TestAlgoBookOrganization:
         self.test_employee_not_found()
         self.test_many_reports()
         self.test_entire_org()
+        self.test_index_matches_subtree_walk()
+        self.test_single_employee()
+        self.test_update_budget()
+        self.test_add_employee()
+        self.test_remove_employee()
+        self.test_move_employee()
+        self.test_move_into_own_org()
+        self.test_deep_chain()
+        self.test_flat_entire_org()
+        self.test_flat_out_of_order()
+        self.test_flat_update_budget()
+        self.test_flat_memory_footprint()
+        self.test_from_csv_file()
+        self.test_from_jsonl_file()
+        self.test_missing_manager()
+        self.test_repeated_id_drops_missing_manager()
+        self.test_snapshot_round_trip()
+        self.test_kth_manager()
+        self.test_lowest_common_manager()
+        self.test_manager_queries_after_move()
+        self.test_shared_snapshot()
+        self.test_shared_snapshot_independent_worker()
+        self.test_org_aggregates()
+        self.test_org_aggregates_after_update()
 
     def print_test_result(self, test_name, result):
         color = "\033[92m" if result else "\033[91m"
@@ -258,6 +1084,312 @@ class TestAlgoBookOrganization:
         expected = [3500, 1300, 1200, 500, 1300, 1200, 1200, 500, 500, 500]
 
         self.test_answer("test_entire_org", results, expected)
+        self.test_answer("test_entire_org_batch", org.get_org_budgets(range(1, 11)), expected)
+
+        flat_org = AlgoBookFlatOrganization([
+            Employee(node.id, node.manager_id, node.budget) for node in org.organization.values()
+        ])
+        self.test_answer("test_entire_org_flat_batch", flat_org.get_org_budgets(range(1, 11)), expected)
+
+    def test_index_matches_subtree_walk(self):
+        org = AlgoBookOrganization([
+            Employee(1, None, 1000),
+            Employee(2, 1, 500),
+            Employee(3, 1, 600),
+            Employee(4, 2, 200),
+            Employee(5, 2, 300),
+            Employee(6, 3, 400),
+            Employee(7, 3, 200),
+            Employee(8, 4, 100),
+            Employee(9, 4, 100),
+            Employee(10, 4, 100),
+        ])
+        results = [org.organization[i].org_budget for i in range(1, 11)]
+        expected = [org.get_subordinate_budgets(i) for i in range(1, 11)]
+
+        self.test_answer("test_index_matches_subtree_walk", results, expected)
+
+    def test_single_employee(self):
+        org = AlgoBookOrganization([
+            Employee(1, None, 1000),
+        ])
+        result = org.get_org_budget(1)
+        expected = 1000
+
+        self.test_answer("test_single_employee", result, expected)
+
+    def entire_org_employees(self):
+        return [
+            Employee(1, None, 1000),
+            Employee(2, 1, 500),
+            Employee(3, 1, 600),
+            Employee(4, 2, 200),
+            Employee(5, 2, 300),
+            Employee(6, 3, 400),
+            Employee(7, 3, 200),
+            Employee(8, 4, 100),
+            Employee(9, 4, 100),
+            Employee(10, 4, 100),
+        ]
+
+    def build_entire_org(self):
+        return AlgoBookOrganization(self.entire_org_employees())
+
+    def test_update_budget(self):
+        org = self.build_entire_org()
+        org.update_budget(8, 600)
+        results = [org.get_org_budget(i) for i in range(1, 11)]
+        expected = [4000, 1800, 1200, 1000, 1800, 1200, 1200, 1000, 1000, 1000]
+
+        self.test_answer("test_update_budget", results, expected)
+
+    def test_add_employee(self):
+        org = self.build_entire_org()
+        org.add_employee(Employee(11, 5, 50))
+        results = [org.get_org_budget(i) for i in [1, 2, 5, 11]]
+        expected = [3550, 1350, 350, 350]
+
+        self.test_answer("test_add_employee", results, expected)
+
+    def test_remove_employee(self):
+        org = self.build_entire_org()
+        org.remove_employee(4)
+        results = [org.get_org_budget(i) for i in [1, 2, 4, 8]]
+        expected = [3300, 1100, 0, 1100]
+
+        self.test_answer("test_remove_employee", results, expected)
+
+    def test_move_employee(self):
+        org = self.build_entire_org()
+        org.move_employee(4, 7)
+        results = [org.get_org_budget(i) for i in [1, 2, 3, 5, 7, 8]]
+        expected = [3500, 800, 1700, 800, 700, 500]
+
+        self.test_answer("test_move_employee", results, expected)
+
+    def test_move_into_own_org(self):
+        org = self.build_entire_org()
+        try:
+            org.move_employee(2, 8)
+            result = False
+        except InvalidReorgError:
+            result = True
+        results = [result, org.get_org_budget(2)]
+        expected = [True, 1300]
+
+        self.test_answer("test_move_into_own_org", results, expected)
+
+    def test_deep_chain(self):
+        # a chain far deeper than the recursion limit, each employee manages the next one
+        employees = [Employee(0, None, 1)]
+        for i in range(1, 20000):
+            employees.append(Employee(i, i - 1, 1))
+        org = AlgoBookOrganization(employees)
+        results = [org.get_org_budget(0), org.get_org_budget(19999), org.get_subordinate_budgets(10000)]
+        expected = [20000, 2, 10000]
+
+        self.test_answer("test_deep_chain", results, expected)
+
+    def test_flat_entire_org(self):
+        org = AlgoBookFlatOrganization(self.entire_org_employees())
+        results = [org.get_org_budget(i) for i in range(0, 12)]
+        expected = [0, 3500, 1300, 1200, 500, 1300, 1200, 1200, 500, 500, 500, 0]
+
+        self.test_answer("test_flat_entire_org", results, expected)
+
+    def test_flat_out_of_order(self):
+        org = AlgoBookFlatOrganization([
+            Employee(305, 234, 1000),
+            Employee(123, None, 1000),
+            Employee(233, 123, 1000),
+            Employee(301, 233, 100),
+            Employee(302, 233, 200),
+            Employee(304, 234, 0),
+            Employee(303, 234, 0),
+            Employee(234, 123, 2000),
+            Employee(235, 123, 3000)
+        ])
+        results = [org.get_org_budget(123), org.get_org_budget(235), org.get_org_budget(233), org.get_org_budget(305)]
+        expected = [8300, 8300, 1300, 3000]
+
+        self.test_answer("test_flat_out_of_order", results, expected)
+
+    def test_flat_update_budget(self):
+        org = AlgoBookFlatOrganization(self.entire_org_employees())
+        org.update_budget(8, 600)
+        results = [org.get_org_budget(i) for i in range(1, 11)]
+        expected = [4000, 1800, 1200, 1000, 1800, 1200, 1200, 1000, 1000, 1000]
+
+        self.test_answer("test_flat_update_budget", results, expected)
+        self.test_answer("test_flat_update_budget_batch", org.get_org_budgets([8, 404]), [1000, 0])
+
+    def test_flat_memory_footprint(self):
+        employees = [Employee(0, None, 1)] + [Employee(i, i // 4, 1) for i in range(1, 1000)]
+        node_org = AlgoBookOrganization(employees)
+        flat_org = AlgoBookFlatOrganization(employees)
+        results = [flat_org.get_org_budget(0), flat_org.memory_footprint() < node_org.memory_footprint()]
+        expected = [node_org.get_org_budget(0), True]
+
+        self.test_answer("test_flat_memory_footprint", results, expected)
+
+    def test_from_csv_file(self):
+        # reports are listed before their managers and split across several chunks
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "employees.csv")
+            with open(path, "w") as file:
+                file.write("employee_id,manager_id,budget\n")
+                for employee in reversed(self.entire_org_employees()):
+                    manager_id = "" if employee.manager_id is None else employee.manager_id
+                    file.write(f"{employee.employee_id},{manager_id},{employee.budget}\n")
+            org = AlgoBookOrganization.from_file(path, chunk_size=3)
+        results = [org.get_org_budget(i) for i in range(1, 11)]
+        expected = [3500, 1300, 1200, 500, 1300, 1200, 1200, 500, 500, 500]
+
+        self.test_answer("test_from_csv_file", results, expected)
+
+    def test_from_jsonl_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "employees.jsonl")
+            with open(path, "w") as file:
+                for employee in reversed(self.entire_org_employees()):
+                    record = {"employee_id": employee.employee_id, "manager_id": employee.manager_id,
+                              "budget": employee.budget}
+                    file.write(json.dumps(record) + "\n")
+            org = AlgoBookOrganization.from_file(path, chunk_size=4)
+        results = [org.get_org_budget(i) for i in range(1, 11)]
+        expected = [3500, 1300, 1200, 500, 1300, 1200, 1200, 500, 500, 500]
+
+        self.test_answer("test_from_jsonl_file", results, expected)
+
+    def test_missing_manager(self):
+        try:
+            AlgoBookOrganization([Employee(1, None, 1000), Employee(2, 404, 500)])
+            result = None
+        except KeyError as error:
+            result = error.args[0]
+
+        self.test_answer("test_missing_manager", result, 404)
+
+    def test_repeated_id_drops_missing_manager(self):
+        # the first record of employee 2 points at a manager that never arrives, the repeated record replaces it
+        org = AlgoBookOrganization([Employee(1, None, 10), Employee(2, 99, 5), Employee(2, 1, 7)])
+        results = [org.get_org_budget(1), org.get_org_budget(2), org.pending_reports]
+        expected = [17, 17, {}]
+
+        self.test_answer("test_repeated_id_drops_missing_manager", results, expected)
+
+    def test_snapshot_round_trip(self):
+        org = AlgoBookOrganization(self.entire_org_employees())
+        org.update_budget(8, 600)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "org.snapshot")
+            org.save_snapshot(path)
+            snapshot = AlgoBookSnapshotOrganization.load(path)
+            results = snapshot.get_org_budgets(list(range(0, 12)) + ["x", None])
+            snapshot.close()
+        expected = [0, 4000, 1800, 1200, 1000, 1800, 1200, 1200, 1000, 1000, 1000, 0, 0, 0]
+
+        self.test_answer("test_snapshot_round_trip", results, expected)
+
+    def test_kth_manager(self):
+        org = AlgoBookOrganization(self.entire_org_employees())
+        results = [org.get_kth_manager(8, k) for k in range(0, 5)] + [org.get_kth_manager_org_budget(8, 2),
+                                                                       org.get_kth_manager(404, 1)]
+        expected = [8, 4, 2, 1, None, 1300, None]
+
+        self.test_answer("test_kth_manager", results, expected)
+
+    def test_lowest_common_manager(self):
+        org = AlgoBookOrganization(self.entire_org_employees())
+        results = [org.get_lowest_common_manager(8, 10), org.get_lowest_common_manager(8, 5),
+                   org.get_lowest_common_manager(9, 7), org.get_lowest_common_manager(4, 9),
+                   org.get_lowest_common_manager(8, 404), org.get_common_manager_org_budget(8, 5),
+                   org.get_common_manager_org_budget(6, 7)]
+        expected = [4, 2, 1, 4, None, 1300, 1200]
+
+        self.test_answer("test_lowest_common_manager", results, expected)
+
+    def test_manager_queries_after_move(self):
+        org = AlgoBookOrganization(self.entire_org_employees())
+        org.get_lowest_common_manager(8, 6)
+        org.move_employee(4, 3)
+        results = [org.get_lowest_common_manager(8, 6), org.get_kth_manager(8, 2)]
+        expected = [3, 3]
+
+        self.test_answer("test_manager_queries_after_move", results, expected)
+
+    def test_shared_snapshot(self):
+        block = AlgoBookFlatOrganization(self.entire_org_employees()).share_snapshot()
+        snapshot = AlgoBookSnapshotOrganization.attach(block.name)
+        results = snapshot.get_org_budgets(range(0, 12))
+        snapshot.close()
+        block.close()
+        block.unlink()
+        expected = [0, 3500, 1300, 1200, 500, 1300, 1200, 1200, 500, 500, 500, 0]
+
+        self.test_answer("test_shared_snapshot", results, expected)
+
+    def test_shared_snapshot_independent_worker(self):
+        # a worker that is not a child of the creator attaches and exits, the block must stay for the other workers
+        block = AlgoBookFlatOrganization(self.entire_org_employees()).share_snapshot()
+        worker = ("import sys; from algo_book import AlgoBookSnapshotOrganization; "
+                  "snapshot = AlgoBookSnapshotOrganization.attach(sys.argv[1]); "
+                  "print(snapshot.get_org_budget(1)); snapshot.close()")
+        output = subprocess.run([sys.executable, "-c", worker, block.name], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        snapshot = AlgoBookSnapshotOrganization.attach(block.name)
+        results = [output.stdout.strip(), snapshot.get_org_budget(2)]
+        snapshot.close()
+        block.close()
+        block.unlink()
+        expected = ["3500", 1300]
+
+        self.test_answer("test_shared_snapshot_independent_worker", results, expected)
+
+    def build_cost_center_org(self):
+        org = AlgoBookOrganization([
+            Employee(1, None, 1000, {"cost_center": "exec"}),
+            Employee(2, 1, 500, {"cost_center": "eng"}),
+            Employee(3, 1, 600, {"cost_center": "sales"}),
+            Employee(4, 2, 200, {"cost_center": "eng"}),
+            Employee(5, 2, 300, {"cost_center": "eng"}),
+            Employee(6, 3, 400, {"cost_center": "sales"}),
+            Employee(7, 3, 200),
+        ])
+        org.set_org_aggregates({
+            "budget": SumAggregate(),
+            "headcount": CountAggregate(),
+            "max_budget": MaxAggregate(),
+            "budget_by_cost_center": CategorySumAggregate("cost_center"),
+        })
+        return org
+
+    def test_org_aggregates(self):
+        org = self.build_cost_center_org()
+        results = [org.get_org_aggregates(1), org.get_org_aggregates(5, ["budget", "budget_by_cost_center"]),
+                   org.get_org_aggregates(404, ["headcount", "max_budget"])]
+        expected = [
+            {"budget": 3200, "headcount": 7, "max_budget": 1000,
+             "budget_by_cost_center": {"exec": 1000, "eng": 1000, "sales": 1000}},
+            {"budget": 1000, "budget_by_cost_center": {"eng": 1000}},
+            {"headcount": 0, "max_budget": None},
+        ]
+
+        self.test_answer("test_org_aggregates", results, expected)
+
+    def test_org_aggregates_after_update(self):
+        org = self.build_cost_center_org()
+        org.get_org_aggregates(1)
+        org.update_budget(7, 2000)
+        org.move_employee(5, 3)
+        results = [org.get_org_aggregates(1, ["max_budget", "budget_by_cost_center"]),
+                   org.get_org_aggregates(3, ["budget", "headcount"])]
+        expected = [
+            {"max_budget": 2000, "budget_by_cost_center": {"exec": 1000, "eng": 1000, "sales": 1000}},
+            {"budget": 3300, "headcount": 4},
+        ]
+
+        self.test_answer("test_org_aggregates_after_update", results, expected)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,280 @@
+"""
+Benchmarks for the AlgoBook organization budget queries.
+
+Run every benchmark with:
+    python algo_book_benchmarks.py
+
+or only some of them by name:
+    python algo_book_benchmarks.py org_budget_index
+
+Code Author: Brendan Torok
+"""
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+from algo_book import AlgoBookFlatOrganization, AlgoBookOrganization, AlgoBookSnapshotOrganization, Employee
+
+
+def generate_employees(size, seed=526):
+    # every employee after the CEO reports to a random earlier employee, which builds a bushy tree of expected
+    # depth O(log n) with many managers of only a few reports
+    rng = random.Random(seed)
+    employees = [Employee(0, None, rng.randint(0, 1000))]
+    for employee_id in range(1, size):
+        employees.append(Employee(employee_id, rng.randrange(employee_id), rng.randint(0, 1000)))
+    return employees
+
+
+def generate_chain(size):
+    # every employee manages the next one, the deepest possible tree
+    return [Employee(0, None, 1)] + [Employee(employee_id, employee_id - 1, 1) for employee_id in range(1, size)]
+
+
+def write_employee_csv(path, size, seed=526):
+    # write a synthetic export row by row. Ids are scrambled with a multiplicative bijection and rows are written in
+    # reverse creation order, so every report is listed before its manager
+    rng = random.Random(seed)
+    managers = [None] + [rng.randrange(index) for index in range(1, size)]
+
+    def scramble(index):
+        return index * 2654435761 % (1 << 32)
+
+    with open(path, "w") as file:
+        file.write("employee_id,manager_id,budget\n")
+        for index in range(size - 1, -1, -1):
+            manager_id = "" if managers[index] is None else scramble(managers[index])
+            file.write(f"{scramble(index)},{manager_id},{rng.randint(0, 1000)}\n")
+
+
+def load_employee_file(path, chunk_size, results):
+    # runs in a fresh process so the peak RSS only covers the load
+    start = time.perf_counter()
+    org = AlgoBookOrganization.from_file(path, chunk_size)
+    elapsed = time.perf_counter() - start
+    results.put((len(org.organization), elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def walk_lowest_common_manager(org, first_id, second_id):
+    # the pointer walk the binary lifting index replaces: collect every manager of one employee, then walk up from
+    # the other until one of them is found
+    node = org.organization[first_id]
+    ancestors = set()
+    while node is not None:
+        ancestors.add(node)
+        node = node.manager_node
+    node = org.organization[second_id]
+    while node is not None and node not in ancestors:
+        node = node.manager_node
+    return None if node is None else node.id
+
+
+worker_snapshot = None
+
+
+def attach_worker_snapshot(name):
+    # pool initializer, every worker attaches to the same shared block once
+    global worker_snapshot
+    worker_snapshot = AlgoBookSnapshotOrganization.attach(name)
+
+
+def answer_worker_queries(employee_ids):
+    return sum(worker_snapshot.get_org_budgets(employee_ids))
+
+
+def time_queries(query, employee_ids):
+    # return the average latency of the query in microseconds
+    start = time.perf_counter()
+    for employee_id in employee_ids:
+        query(employee_id)
+    return (time.perf_counter() - start) / len(employee_ids) * 1e6
+
+
+class BenchmarkAlgoBookOrganization:
+    def run_benchmarks(self, names=None):
+        benchmarks = {
+            "org_budget_index": self.benchmark_org_budget_index,
+            "traversal": self.benchmark_traversal,
+            "flat_backend": self.benchmark_flat_backend,
+            "batch_org_budgets": self.benchmark_batch_org_budgets,
+            "streaming_loader": self.benchmark_streaming_loader,
+            "snapshot_startup": self.benchmark_snapshot_startup,
+            "manager_queries": self.benchmark_manager_queries,
+            "shared_memory_workers": self.benchmark_shared_memory_workers,
+        }
+        for name, benchmark in benchmarks.items():
+            if not names or name in names:
+                print(f"--- {name} ---")
+                benchmark()
+
+    def print_benchmark_result(self, label, value, unit):
+        print(f"{label:<48} {value:>14.2f} {unit}")
+
+    def benchmark_org_budget_index(self, sizes=(10_000, 100_000, 1_000_000), queries=200):
+        for size in sizes:
+            start = time.perf_counter()
+            org = AlgoBookOrganization(generate_employees(size))
+            self.print_benchmark_result(f"n={size} build tree and index", time.perf_counter() - start, "s")
+
+            rng = random.Random(size)
+            employee_ids = [rng.randrange(size) for _ in range(queries)]
+
+            # the old query path: resolve the IC redirect and then walk the whole subtree recursively
+            def subtree_walk(employee_id):
+                node = org.organization[employee_id]
+                if node.is_manager is False and node.manager_node is not None:
+                    node = node.manager_node
+                return org.get_subordinate_budgets(node.id)
+
+            self.print_benchmark_result(f"n={size} CEO subtree walk", time_queries(subtree_walk, [0] * 5), "us/query")
+            self.print_benchmark_result(f"n={size} CEO indexed lookup", time_queries(org.get_org_budget, [0] * queries),
+                                        "us/query")
+            self.print_benchmark_result(f"n={size} random subtree walk", time_queries(subtree_walk, employee_ids),
+                                        "us/query")
+            self.print_benchmark_result(f"n={size} random indexed lookup",
+                                        time_queries(org.get_org_budget, employee_ids), "us/query")
+
+    def benchmark_traversal(self, size=1_000_000):
+        for shape, employees in [("chain", generate_chain(size)), ("bushy", generate_employees(size))]:
+            org = AlgoBookOrganization(employees)
+            root = org.organization[0]
+
+            start = time.perf_counter()
+            org.build_org_budget_index()
+            elapsed = time.perf_counter() - start
+            self.print_benchmark_result(f"n={size} {shape} post-order index build", size / elapsed, "nodes/s")
+
+            start = time.perf_counter()
+            org.get_subordinate_budgets(root.id)
+            elapsed = time.perf_counter() - start
+            self.print_benchmark_result(f"n={size} {shape} pre-order subtree sum", size / elapsed, "nodes/s")
+
+    def benchmark_flat_backend(self, sizes=(100_000, 1_000_000), queries=100_000):
+        for size in sizes:
+            employees = generate_employees(size)
+            rng = random.Random(size)
+            employee_ids = [rng.randrange(size) for _ in range(queries)]
+            for label, backend in [("node objects", AlgoBookOrganization), ("flat arrays", AlgoBookFlatOrganization)]:
+                start = time.perf_counter()
+                org = backend(employees)
+                self.print_benchmark_result(f"n={size} {label} build", time.perf_counter() - start, "s")
+                self.print_benchmark_result(f"n={size} {label} memory", org.memory_footprint() / size, "bytes/employee")
+                self.print_benchmark_result(f"n={size} {label} get_org_budget",
+                                            time_queries(org.get_org_budget, employee_ids), "us/query")
+                del org
+
+    def benchmark_batch_org_budgets(self, size=1_000_000):
+        # the quarterly planning query: the org budget of every employee in the company
+        employees = generate_employees(size)
+        employee_ids = range(size)
+        for label, backend in [("node objects", AlgoBookOrganization), ("flat arrays", AlgoBookFlatOrganization)]:
+            org = backend(employees)
+
+            start = time.perf_counter()
+            [org.get_org_budget(employee_id) for employee_id in employee_ids]
+            self.print_benchmark_result(f"n={size} {label} one get_org_budget per id", time.perf_counter() - start,
+                                        "s")
+
+            start = time.perf_counter()
+            org.get_org_budgets(employee_ids)
+            self.print_benchmark_result(f"n={size} {label} get_org_budgets batch", time.perf_counter() - start, "s")
+            del org
+
+    def benchmark_streaming_loader(self, size=5_000_000, chunk_size=100_000):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "employees.csv")
+            write_employee_csv(path, size)
+            self.print_benchmark_result(f"n={size} csv file size", os.path.getsize(path) / 2 ** 20, "MiB")
+
+            results = multiprocessing.Queue()
+            loader = multiprocessing.Process(target=load_employee_file, args=(path, chunk_size, results))
+            loader.start()
+            rows, elapsed, max_rss = results.get()
+            loader.join()
+
+        self.print_benchmark_result(f"n={size} from_file throughput", rows / elapsed, "rows/s")
+        # ru_maxrss is reported in kilobytes on Linux
+        self.print_benchmark_result(f"n={size} from_file peak RSS", max_rss / 2 ** 10, "MiB")
+
+    def benchmark_snapshot_startup(self, size=1_000_000):
+        with tempfile.TemporaryDirectory() as directory:
+            csv_path = os.path.join(directory, "employees.csv")
+            snapshot_path = os.path.join(directory, "org.snapshot")
+            write_employee_csv(csv_path, size)
+
+            # cold start by rebuilding: parse the export, build the tree and answer the first query
+            start = time.perf_counter()
+            org = AlgoBookOrganization.from_file(csv_path)
+            org.get_org_budget(next(iter(org.organization)))
+            self.print_benchmark_result(f"n={size} rebuild from csv to first answer", time.perf_counter() - start, "s")
+
+            start = time.perf_counter()
+            org.save_snapshot(snapshot_path)
+            self.print_benchmark_result(f"n={size} save snapshot", time.perf_counter() - start, "s")
+            self.print_benchmark_result(f"n={size} snapshot size", os.path.getsize(snapshot_path) / 2 ** 20, "MiB")
+            employee_ids = list(org.organization)[:1000]
+            del org
+
+            # cold start from the snapshot: map the file and answer the first query
+            start = time.perf_counter()
+            snapshot = AlgoBookSnapshotOrganization.load(snapshot_path)
+            snapshot.get_org_budget(employee_ids[0])
+            self.print_benchmark_result(f"n={size} mmap snapshot to first answer", (time.perf_counter() - start) * 1e3,
+                                        "ms")
+            self.print_benchmark_result(f"n={size} snapshot get_org_budget",
+                                        time_queries(snapshot.get_org_budget, employee_ids), "us/query")
+            snapshot.close()
+
+    def benchmark_manager_queries(self, size=1_000_000, queries=100_000):
+        for shape, employees in [("bushy", generate_employees(size)), ("chain", generate_chain(size))]:
+            org = AlgoBookOrganization(employees)
+            rng = random.Random(size)
+            pairs = [(rng.randrange(size), rng.randrange(size)) for _ in range(queries)]
+
+            start = time.perf_counter()
+            org.get_ancestor_index()
+            self.print_benchmark_result(f"n={size} {shape} build ancestor index", time.perf_counter() - start, "s")
+
+            walk_pairs = pairs[:queries // 100] if shape == "chain" else pairs
+            self.print_benchmark_result(
+                f"n={size} {shape} LCA pointer walk",
+                time_queries(lambda pair: walk_lowest_common_manager(org, *pair), walk_pairs), "us/query")
+            self.print_benchmark_result(
+                f"n={size} {shape} LCA binary lifting",
+                time_queries(lambda pair: org.get_lowest_common_manager(*pair), pairs), "us/query")
+            self.print_benchmark_result(
+                f"n={size} {shape} common manager org budget",
+                time_queries(lambda pair: org.get_common_manager_org_budget(*pair), pairs), "us/query")
+            self.print_benchmark_result(
+                f"n={size} {shape} k-th manager (k=3)",
+                time_queries(lambda pair: org.get_kth_manager(pair[0], 3), pairs), "us/query")
+            del org
+
+    def benchmark_shared_memory_workers(self, size=1_000_000, queries=2_000_000, chunk_size=10_000,
+                                        workers=(1, 4, 8)):
+        block = AlgoBookFlatOrganization(generate_employees(size)).share_snapshot()
+        self.print_benchmark_result(f"n={size} shared block size (one copy)", block.size / 2 ** 20, "MiB")
+        rng = random.Random(size)
+        chunks = [[rng.randrange(size) for _ in range(chunk_size)] for _ in range(queries // chunk_size)]
+        try:
+            for worker_count in workers:
+                with multiprocessing.Pool(worker_count, attach_worker_snapshot, (block.name,)) as pool:
+                    # warm up so process start and attaching are not timed
+                    pool.map(answer_worker_queries, chunks[:worker_count])
+                    start = time.perf_counter()
+                    pool.map(answer_worker_queries, chunks)
+                    elapsed = time.perf_counter() - start
+                self.print_benchmark_result(f"n={size} {worker_count} workers throughput", queries / elapsed,
+                                            "queries/s")
+        finally:
+            block.close()
+            block.unlink()
+
+
+if __name__ == '__main__':
+    benchmark_runner = BenchmarkAlgoBookOrganization()
+    benchmark_runner.run_benchmarks(sys.argv[1:])
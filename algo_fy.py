@@ -1,4 +1,18 @@
+import asyncio
 import heapq
+import itertools
+import math
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter, deque
+from collections.abc import Mapping
 
 '''
  You are working for a promising new music streaming service “Algo-fy”.
@@ -34,52 +48,1095 @@ Code Author: Brendan Torok
 
 Running Time Analysis of get_top_k
 --------------------
-Instantiating the top_k list takes O(1) time
-The calls to create the stream_heap list has a time complexity of O(n) where n is the number of songs added.
-The heapify call takes O(n) time as well, where n is the number of songs added to the heal.
-The for loop to populate the top_k list runs n times, which at worst is equal to number of unique songs streamed, due 
-to the min() call, therefore the loop has a time complexity of O(n). 
-The call to append the return value of heappop() takes O(1) time, but the heappop() call takes O(logn) time due to the 
-requirement to maintain heap order property after popping. Therefore, the loop has a worst case
-time complexity of O(k + logn) 
-Returning the top_k list takes O(1) time.
-The overall time complexity is therefore calculated as O(n + n + nLogn) which can simplify.
-Therefore, the overall time complexity of get_top_k is O(n + n*Logn).
+AlgoFy keeps the songs in buckets of equal stream counts. The buckets are linked in count order from the most streamed
+bucket down, and only counts that some song currently has get a bucket.
+Walking the buckets from the highest count down visits at most k buckets, since every bucket visited adds at least one
+song to the top_k list.
+Songs with the same count are ordered by their songId. A bucket that fits entirely into the top_k list is sorted, and
+the last bucket only has its smallest remaining songIds selected with heapq.nsmallest.
+The overall time complexity of get_top_k is therefore O(k log k + b) where b is the size of the last bucket visited,
+instead of heapifying every distinct song on each call.
+
+--------------------
+
+Approximate mode
+--------------------
+AlgoFy(k, capacity) bounds the memory to capacity tracked songs with the Space-Saving algorithm. When a song that is
+not tracked arrives and all counters are in use, it replaces a song from the lowest bucket and starts from that
+bucket's count, which is remembered as its error. With N total streams and m = capacity counters:
+- every reported count is at least the true count and at most the true count plus N / m
+- every song streamed more than N / m times is tracked
+- a song whose reported count minus its error is at least the reported count of the (k + 1)th song is in the true top k
+get_error_bound returns N / m. The running times below stay the same, an eviction is O(1).
+
+--------------------
+
+Cached top k
+--------------------
+get_top_k keeps its last result and the set of its songs. Before a batch is merged, each of its d distinct songs is
+checked in O(1) time: the result can only change if the song is already in it, or if its new count reaches the count
+of the kth song. In approximate mode a batch whose new songs evict tracked songs always drops the cache, since every
+eviction raises the count new songs start from. Otherwise the cache is kept, so a read after an irrelevant batch and a
+repeated read only copy the k cached songs in O(k) time. cache_hits, cache_misses, cache_invalidations and
+get_cache_hit_rate expose how often the cache was used.
+
+--------------------
+
+Dense backend
+--------------------
+AlgoFy(k, dense=True) stores the counts of dense integer song ids in a typed array indexed by song id. Merging a batch
+is O(1) per distinct song and the array grows geometrically. The backend keeps the last top k and every song that has
+since passed its kth song as candidates. Counts only grow, so the next top k is among them and get_top_k ranks the m
+candidates in O(m log k) time. The first read, a read after a restore or after plays were taken back, and a read after
+a batch that lifted more than 4k + 4096 songs past the kth song scan every slot with heapq.nlargest instead. That
+scan loops in Python in O(u log k) time, about 0.2 s for 2 million songs. A batch with negative, non integer, huge or
+sparse ids moves the counts into the buckets in O(u + c log c) time and AlgoFy continues with the buckets.
+
+--------------------
+
+Segment rankings
+--------------------
+stream_songs and AsyncAlgoFy also take plays of the form (songId, segment, ...), for example (songId, "rock", "EU"),
+mixed freely with plain song ids. The batch is counted once with a Counter in O(n) time and every distinct play is split
+into the global counts and the counts of each of its segments in O(d * g) time, where g is the number of segments per
+play. Every segment with plays in the batch has its own AlgoFy that merges its share as above, so one ingest pass keeps
+the global and every segment ranking up to date, instead of one pass over the whole batch per segment.
+get_top_k(segment) reads the ranking of the segment with the same running time and cache as the global ranking.
+
+--------------------
+
+Checkpoints
+--------------------
+save_checkpoint copies the counts into typed arrays in O(u) time, which runs in C (a single memory copy for the dense
+backend), and writes the copies in a background thread while batches keep arriving. The file is a fixed header
+followed by the song ids and counts as 8-byte integers, about 16 bytes per tracked song (8 for the dense backend), and
+is written next to the destination and renamed so a crash never leaves a half written checkpoint. load_checkpoint
+reads the arrays back in C and regroups the songs into buckets in O(u + c log c) time. The header records how many
+batches were merged, so replay_batches only merges the batches that arrived after the checkpoint.
+
+--------------------
+
+Windowed and decayed rankings
+--------------------
+WindowedAlgoFy(k, window, slide) ranks the plays of the last window time units. Every batch is stamped with a
+timestamp and its counts are remembered in a pane of slide time units. When time moves past a pane, its counts are
+subtracted from the buckets again, walking each song down at most one bucket per play. Every play is therefore added
+once and subtracted once, so expiry costs O(1) per play amortized over the ingests and get_top_k is unchanged. Plays
+stamped before the window that ends at the latest time seen are dropped in O(1) time.
+
+DecayedAlgoFy(k, half_life) ranks songs by play counts that halve every half_life time units. It uses forward decay:
+new plays are weighted up by 2^((timestamp - landmark) / half_life) instead of decaying every old score. Scores only
+grow, so the exact top k is kept in a dictionary with a min-heap of its weakest member. Each distinct song of a batch
+costs O(log k), and get_top_k sorts the k members in O(k log k). Weights are rescaled in one O(u) pass whenever they
+would grow past e^200, which happens once every 200 / ln 2 (about 288) half lives of stream time.
+
+--------------------
+
+Sharded ranking
+--------------------
+ShardedAlgoFy(k, shards) runs one AlgoFy per worker process and sends every song to the shard songId % shards. A
+producer counts its batch in O(n) time, splits its d distinct songs by shard in O(d) time and puts every share into
+the inbox of its shard, and the shards merge their counts in parallel. ShardedAlgoFy.producer() hands out producers
+for other processes, so the counting and splitting also run in parallel instead of in a single coordinator. Because
+every song is counted by a single shard, the global top k is always among the top k songs of the shards, so get_top_k
+gathers k candidates per shard and selects the best k of the s * k candidates in O(s * k log k) time.
+
+--------------------
+
+Asyncio ingestion
+--------------------
+AsyncAlgoFy puts batches into a bounded asyncio queue, so producers wait instead of growing an unbounded backlog. One
+ingest task coalesces the queued batches, counts them and merges the counts into the ranker in chunks, yielding to
+the event loop after every chunk. The total work is the same O(n) as stream_songs, but a get_top_k read waits for at
+most one chunk of merge_chunk plays or songs instead of a whole batch. A batch that cannot be counted is skipped and
+recorded in failed_batches, so one bad batch never stops the ingest task.
 
 --------------------
 
 Running Time Analysis of stream_songs
-Looping through the song IDs and adding them to a dictionary takes O(n) time as each song stream must be evaluated
-Assigning each song ID to the dictionary and updating the play count within the for loop takes O(1) time
-Therefore the overall time complexity is O(1 + n) time which simplifies to an overall time complexity of O(n) for
-stream_songs
+Counting the song IDs of the batch with a Counter takes O(n) time as each song stream must be evaluated
+Each distinct song of the batch then moves from the bucket for its old count to the bucket for its new count. The walk
+up the linked buckets passes at most one bucket per play of the song in the batch, the new bucket is linked in where
+the walk stops and the old bucket is unlinked if it becomes empty. Every step is a dictionary, set or pointer update
+and takes O(1) time, so the moves take O(n) time in total
+Therefore the overall time complexity is O(n) for stream_songs, O(1) per streamed song
+
+stream_song_array takes a typed buffer of song IDs. Converting the buffer and counting it both run in C in O(n) time.
+When the batch has fewer distinct songs than a quarter of the tracked songs, each distinct song is walked up the
+buckets as above. Larger batches update the counts dictionary in bulk and regroup all u tracked songs into buckets,
+which takes O(u + c log c) time where c is the number of distinct counts, so the ingest is O(n + u + c log c) per batch
+and never worse than walking every distinct song
 
 '''
 
 
+# checkpoint header: magic, format version, byte order, dense backend flag, k, capacity (0 for exact counts), batches
+# merged, total streams, number of count entries and number of Space-Saving error entries. The header is followed by
+# 8-byte signed integer sections: song ids and counts (or the dense count array) and the error song ids and errors
+CHECKPOINT_HEADER = struct.Struct("<8sIcB2xQQQQQQ")
+CHECKPOINT_MAGIC = b"ALGOFYCK"
+CHECKPOINT_VERSION = 1
+
+
+def write_checkpoint(path, header, sections):
+    # write next to the destination and rename, so a restart never reads a half written checkpoint
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(header)
+        for section in sections:
+            section.tofile(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, path)
+
+
+class StreamBucket:
+    def __init__(self, count):
+        # every song streamed exactly count times, linked to the buckets with the next higher and lower counts
+        self.count = count
+        self.songs = set()
+        self.higher = None
+        self.lower = None
+
+
+class SongCountBuckets:
+    def __init__(self, capacity=None):
+        # song id -> number of streams
+        self.counts = {}
+        # number of streams -> bucket of the songs with that count. Only counts that some song has are present, and
+        # the buckets are linked in count order so the top songs are found without scanning every song
+        self.buckets = {}
+        self.highest = None
+        self.lowest = None
+        # with a capacity at most that many songs are tracked (Space-Saving). A new song replaces a song with the
+        # lowest count and inherits that count, which is recorded as the maximum overestimate of the new song
+        self.capacity = capacity
+        self.errors = {}
+        self.total_streams = 0
+
+    def __len__(self):
+        return len(self.counts)
+
+    def link_bucket(self, count, lower, higher):
+        # create a bucket for count between two neighbouring buckets (either may be None at the ends of the list)
+        bucket = StreamBucket(count)
+        bucket.lower = lower
+        bucket.higher = higher
+        if lower is None:
+            self.lowest = bucket
+        else:
+            lower.higher = bucket
+        if higher is None:
+            self.highest = bucket
+        else:
+            higher.lower = bucket
+        self.buckets[count] = bucket
+        return bucket
+
+    def unlink_bucket(self, bucket):
+        if bucket.lower is None:
+            self.lowest = bucket.higher
+        else:
+            bucket.lower.higher = bucket.higher
+        if bucket.higher is None:
+            self.highest = bucket.lower
+        else:
+            bucket.higher.lower = bucket.lower
+        del self.buckets[bucket.count]
+
+    def add(self, song, delta=1):
+        # move the song up by delta streams and return its new count
+        self.total_streams += delta
+        count = self.counts.get(song, 0)
+        if count:
+            bucket = self.buckets[count]
+            bucket.songs.discard(song)
+            lower, higher = bucket, bucket.higher
+        elif self.capacity is not None and len(self.counts) >= self.capacity:
+            # every counter is in use, so the new song takes over the counter of a song with the lowest count
+            bucket = self.lowest
+            evicted_song = bucket.songs.pop()
+            del self.counts[evicted_song]
+            self.errors.pop(evicted_song, None)
+            count = bucket.count
+            self.errors[song] = count
+            lower, higher = bucket, bucket.higher
+        else:
+            bucket = None
+            lower, higher = None, self.lowest
+        new_count = count + delta
+
+        # walk up to the bucket for the new count. Every bucket passed has a distinct count between the old and the
+        # new one, so the walk is at most delta steps and a single stream is O(1)
+        while higher is not None and higher.count < new_count:
+            lower, higher = higher, higher.higher
+        if higher is None or higher.count != new_count:
+            higher = self.link_bucket(new_count, lower, higher)
+        higher.songs.add(song)
+        self.counts[song] = new_count
+
+        if bucket is not None and not bucket.songs:
+            self.unlink_bucket(bucket)
+        return new_count
+
+    def add_counts(self, song_counts):
+        # merge a mapping of song id -> additional streams. When the batch touches a large share of the songs it is
+        # cheaper to update the counts in bulk and regroup every song than to walk each song up the buckets. With a
+        # capacity every song has to go through add, which evicts songs when the counters are full
+        if self.capacity is not None or len(song_counts) * 4 < len(self.counts):
+            for song, delta in song_counts.items():
+                self.add(song, delta)
+            return
+        counts = self.counts
+        for song, delta in song_counts.items():
+            counts[song] = counts.get(song, 0) + delta
+            self.total_streams += delta
+        self.rebuild()
+
+    def subtract(self, song, delta=1):
+        # move the song down by delta streams and return its new count, a song that reaches 0 is no longer tracked
+        self.total_streams -= delta
+        count = self.counts[song]
+        new_count = count - delta
+        bucket = self.buckets[count]
+        bucket.songs.discard(song)
+
+        # walk down to the bucket for the new count, at most delta steps like the walk up in add
+        lower, higher = bucket.lower, bucket
+        while lower is not None and lower.count > new_count:
+            lower, higher = lower.lower, lower
+        if new_count > 0:
+            if lower is None or lower.count != new_count:
+                lower = self.link_bucket(new_count, lower, higher)
+            lower.songs.add(song)
+            self.counts[song] = new_count
+        else:
+            del self.counts[song]
+
+        if not bucket.songs:
+            self.unlink_bucket(bucket)
+        return new_count
+
+    def subtract_counts(self, song_counts):
+        # remove a mapping of song id -> streams that were added before, in bulk for batches touching many songs
+        if len(song_counts) * 4 < len(self.counts):
+            for song, delta in song_counts.items():
+                self.subtract(song, delta)
+            return
+        counts = self.counts
+        for song, delta in song_counts.items():
+            count = counts[song] - delta
+            if count > 0:
+                counts[song] = count
+            else:
+                del counts[song]
+            self.total_streams -= delta
+        self.rebuild()
+
+    def rebuild(self):
+        # regroup every song by its count and relink the buckets in count order
+        groups = {}
+        for song, count in self.counts.items():
+            songs = groups.get(count)
+            if songs is None:
+                groups[count] = songs = set()
+            songs.add(song)
+        self.buckets = {}
+        self.highest = self.lowest = None
+        for count in sorted(groups):
+            self.link_bucket(count, self.highest, None).songs = groups[count]
+
+    def top(self, k):
+        # walk the buckets from the highest count down until k songs are found. Songs with the same count are ranked
+        # by smaller song id first, so only the last bucket needed has to be partially sorted
+        top_k = []
+        bucket = self.highest
+        while bucket is not None and len(top_k) < k:
+            remaining = k - len(top_k)
+            if len(bucket.songs) <= remaining:
+                songs = sorted(bucket.songs)
+            else:
+                songs = heapq.nsmallest(remaining, bucket.songs)
+            top_k.extend((song, bucket.count) for song in songs)
+            bucket = bucket.lower
+        return top_k
+
+
+class DenseSongCountsView(Mapping):
+    # read only song id -> count mapping over a DenseSongCounts, so song_streams works for both backends
+    def __init__(self, dense_counts):
+        self.dense_counts = dense_counts
+
+    def __getitem__(self, song):
+        counts = self.dense_counts.array
+        if not isinstance(song, int) or not 0 <= song < len(counts) or counts[song] == 0:
+            raise KeyError(song)
+        return counts[song]
+
+    def __iter__(self):
+        return (song for song, count in enumerate(self.dense_counts.array) if count)
+
+    def __len__(self):
+        return self.dense_counts.distinct_songs
+
+
+class DenseSongCounts:
+    # below this many slots the array is always allowed to grow, above it the array must stay reasonably full
+    MIN_SPARSE_CHECK = 1 << 16
+
+    def __init__(self, max_songs=1 << 25):
+        # counts of dense integer song ids in a typed array indexed by song id, 8 bytes per song instead of a
+        # dictionary entry and a Python int per song. The array grows on demand up to max_songs slots
+        self.array = array("q")
+        self.max_songs = max_songs
+        self.distinct_songs = 0
+        self.total_streams = 0
+        self.capacity = None
+        self.counts = DenseSongCountsView(self)
+        # candidates for the next top k: the last top k songs plus every song that has since reached the key (count,
+        # -song id) of the kth song. Counts only grow while the candidates are kept, so the next top k is always among
+        # them and a read does not scan every slot. None means the next read scans the whole array
+        self.candidates = None
+        self.candidate_k = None
+        self.threshold = (0, 0)
+
+    def __len__(self):
+        return self.distinct_songs
+
+    def accepts(self, song_counts):
+        # the ids must be non negative integers below max_songs, and the array must not become mostly empty slots
+        # (sparse or huge ids are better served by the dictionary backend). Converting the ids to a typed array
+        # checks that they are all 64-bit integers at C speed
+        if not song_counts:
+            return True
+        try:
+            songs = array("q", song_counts)
+        except (TypeError, OverflowError):
+            return False
+        if min(songs) < 0:
+            return False
+        slots = max(len(self.array), max(songs) + 1)
+        if slots > self.max_songs:
+            return False
+        return slots <= self.MIN_SPARSE_CHECK or slots <= 8 * (self.distinct_songs + len(song_counts))
+
+    def add_counts(self, song_counts):
+        counts = self.array
+        highest = max(song_counts, default=-1)
+        if highest >= len(counts):
+            # grow geometrically so repeated growth is amortized O(1) per slot
+            slots = min(self.max_songs, max(highest + 1, 2 * len(counts)))
+            counts.frombytes(bytes(8 * (slots - len(counts))))
+        candidates = self.candidates
+        threshold_count, threshold_song = self.threshold
+        for song, plays in song_counts.items():
+            count = counts[song]
+            if count == 0:
+                self.distinct_songs += 1
+            count += plays
+            counts[song] = count
+            self.total_streams += plays
+            if candidates is not None and (count > threshold_count or count == threshold_count and
+                                           song <= threshold_song):
+                candidates.add(song)
+        # a batch that lifts many songs past the kth song is cheaper to rank with one scan than to keep as candidates
+        if candidates is not None and len(candidates) > self.max_candidates():
+            self.candidates = None
+
+    def max_candidates(self):
+        return 4 * self.candidate_k + 4096
+
+    def subtract_counts(self, song_counts):
+        # counts that go down can let any song into the top k, so the next read scans the array again
+        self.candidates = None
+        counts = self.array
+        for song, plays in song_counts.items():
+            counts[song] -= plays
+            if counts[song] == 0:
+                self.distinct_songs -= 1
+            self.total_streams -= plays
+
+    def top(self, k):
+        if k == 0:
+            return []
+        counts = self.array
+        if self.candidates is not None and self.candidate_k == k:
+            # rank the few candidates by count and then by smaller song id, the same ranking as the buckets
+            top_k = heapq.nsmallest(k, self.candidates, key=lambda song: (-counts[song], song))
+        else:
+            # heapq.nlargest is stable, so songs with the same count keep the smaller song id first. The loop over
+            # every slot runs in Python, O(u log k), so it is only taken after a restore, a subtraction or a batch
+            # that touched too many songs
+            top_k = [song for song in heapq.nlargest(k, range(len(counts)), key=counts.__getitem__) if counts[song]]
+
+        # the songs of this result are the candidates of the next read, and only songs that pass the kth song join
+        self.candidates = set(top_k)
+        self.candidate_k = k
+        if len(top_k) == k:
+            self.threshold = (counts[top_k[-1]], top_k[-1])
+        else:
+            # fewer than k songs have plays, so every song with a play is a candidate
+            self.threshold = (0, 0)
+        return [(song, counts[song]) for song in top_k]
+
+
 class AlgoFy:
-    def __init__(self, k):
+    def __init__(self, k, capacity=None, dense=False):
         self.k = k
-        self.song_streams = {}
+        # stream counts grouped into linked buckets, so the ranking is maintained as batches arrive. A capacity
+        # switches to the approximate Space-Saving mode that tracks at most capacity songs (at least k)
+        if capacity is not None and capacity < k:
+            raise ValueError("The capacity of an approximate AlgoFy must be at least k")
+        if capacity is not None and dense:
+            raise ValueError("The dense backend only supports exact counts")
+        # dense=True stores the counts of dense integer song ids in a typed array instead, switching back to the
+        # buckets as soon as a batch contains sparse, huge or non integer ids
+        self.song_counts = DenseSongCounts() if dense else SongCountBuckets(capacity)
+        self.song_streams = self.song_counts.counts
+        # the last top k result with the set of its songs. It is dropped only when a batch could change the members
+        # or their order, so reads between relevant batches are served from the cache
+        self.top_k_cache = None
+        self.top_k_members = set()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_invalidations = 0
+        # number of input batches merged so far (not merge calls), recorded in checkpoints so a restart only replays
+        # the batches after it. With a checkpoint path, a checkpoint is written in the background every
+        # checkpoint_every batches
+        self.batches_streamed = 0
+        self.checkpoint_path = None
+        self.checkpoint_every = None
+        self.checkpoint_thread = None
+        # segment -> AlgoFy ranking only the plays streamed in that segment (genre, region, ...)
+        self.segments = {}
+
+    def get_cache_hit_rate(self):
+        reads = self.cache_hits + self.cache_misses
+        return self.cache_hits / reads if reads else 0.0
+
+    def invalidate_top_k(self):
+        if self.top_k_cache is not None:
+            self.top_k_cache = None
+            self.cache_invalidations += 1
+
+    def may_change_top_k(self, song_counts):
+        # with k = 0 the result is always empty
+        if self.k == 0:
+            return False
+        # with fewer than k songs every play shows up in the result
+        if len(self.top_k_cache) < self.k:
+            return len(song_counts) > 0
+        # otherwise a batch matters only if it streams a song in the result (its count and maybe its order change)
+        # or lifts another song to at least the count of the kth song
+        kth_count = self.top_k_cache[-1][1]
+        counts = self.song_streams
+        members = self.top_k_members
+        # in approximate mode a batch that evicts songs changes counts in ways a single pass cannot bound: every
+        # eviction can raise the lowest bucket, so a later new song of the same batch may start above the kth count
+        # or evict a member. The cache is dropped as soon as the new songs of the batch do not fit in the counters
+        capacity = self.song_counts.capacity
+        if capacity is not None:
+            untracked_songs = sum(1 for songId in song_counts if songId not in counts)
+            if untracked_songs and len(counts) + untracked_songs > capacity:
+                return True
+        # otherwise an untracked song starts from 0
+        for songId, plays in song_counts.items():
+            if songId in members or counts.get(songId, 0) + plays >= kth_count:
+                return True
+        return False
+
+    def get_error_bound(self):
+        # in approximate mode every reported count overestimates the true count by at most this many streams, and
+        # every song streamed more often than this is guaranteed to be tracked. Exact mode has no error
+        if self.song_counts.capacity is None:
+            return 0
+        return self.song_counts.total_streams // self.song_counts.capacity
 
     def stream_songs(self, songIds):
-        # loop through all songs in songIds and create a hashmap, keeping track of the number of streams for each song
-        for songId in songIds:
-            self.song_streams[songId] = 1 + self.song_streams.get(songId, 0)
+        # count the batch first, then move every distinct song up by its number of plays in the batch, keeping track
+        # of the number of streams and the ranking of every song. A batch of (songId, segment, ...) plays also updates
+        # the ranking of every segment
+        self.stream_song_counts(Counter(songIds))
+        self.record_batches(1)
+
+    def split_segment_counts(self, play_counts):
+        # split counted plays into the global counts and the counts of each segment in one pass. A (songId, segment,
+        # ...) play counts for the song and every one of its segments, a plain song id only for the song
+        song_counts = {}
+        segment_counts = {}
+        for play, plays in play_counts.items():
+            if type(play) is not tuple:
+                song_counts[play] = song_counts.get(play, 0) + plays
+                continue
+            songId = play[0]
+            song_counts[songId] = song_counts.get(songId, 0) + plays
+            for segment in play[1:]:
+                counts = segment_counts.get(segment)
+                if counts is None:
+                    segment_counts[segment] = counts = {}
+                counts[songId] = counts.get(songId, 0) + plays
+        return song_counts, segment_counts
+
+    def use_bucket_counts(self):
+        # move the counts of the dense backend into the buckets, the cached result stays valid
+        dense_counts = self.song_counts
+        self.song_counts = SongCountBuckets()
+        self.song_counts.counts.update(dense_counts.counts.items())
+        self.song_counts.total_streams = dense_counts.total_streams
+        self.song_counts.rebuild()
+        self.song_streams = self.song_counts.counts
+
+    def stream_song_counts(self, song_counts):
+        # merge already counted plays (play -> number of plays) into the ranking. stream_songs and the AsyncAlgoFy
+        # ingest both come through here, so (songId, segment, ...) plays update the segment rankings either way
+        if any(type(play) is tuple for play in song_counts):
+            if self.checkpoint_path is not None:
+                # rejected before anything is merged, the segment rankings are not part of a checkpoint
+                raise ValueError("Segment rankings cannot be checkpointed")
+            song_counts, segment_counts = self.split_segment_counts(song_counts)
+            for segment, counts in segment_counts.items():
+                ranker = self.segments.get(segment)
+                if ranker is None:
+                    self.segments[segment] = ranker = AlgoFy(self.k, self.song_counts.capacity)
+                ranker.merge_song_counts(counts)
+        self.merge_song_counts(song_counts)
+
+    def merge_song_counts(self, song_counts):
+        # merge already counted plays (song id -> number of plays) into the ranking in bulk
+        if isinstance(self.song_counts, DenseSongCounts) and not self.song_counts.accepts(song_counts):
+            self.use_bucket_counts()
+        if self.top_k_cache is not None and self.may_change_top_k(song_counts):
+            self.invalidate_top_k()
+        self.song_counts.add_counts(song_counts)
+
+    def record_batches(self, batches):
+        # count input batches once they are fully merged. stream_song_counts is also used for parts of a batch (the
+        # chunks of AsyncAlgoFy, the share of a segment), so the entry points that take whole batches record them
+        previous_batches = self.batches_streamed
+        self.batches_streamed += batches
+        if self.checkpoint_every and \
+                self.batches_streamed // self.checkpoint_every > previous_batches // self.checkpoint_every:
+            # a periodic checkpoint is skipped while the previous one is still being written, so ingestion never
+            # waits for the disk
+            if self.checkpoint_thread is None or not self.checkpoint_thread.is_alive():
+                self.save_checkpoint(self.checkpoint_path, wait=False)
+
+    def remove_song_counts(self, song_counts):
+        # take back plays that were streamed before, (songId, segment, ...) plays are taken back from their segments
+        # as well and a segment without plays is dropped
+        if any(type(play) is tuple for play in song_counts):
+            song_counts, segment_counts = self.split_segment_counts(song_counts)
+            for segment, counts in segment_counts.items():
+                ranker = self.segments[segment]
+                ranker.remove_song_counts(counts)
+                if not ranker.song_streams:
+                    del self.segments[segment]
+        # songs outside the result only move further down, so only removing plays of a song in the result changes it
+        if self.top_k_cache is not None and not self.top_k_members.isdisjoint(song_counts):
+            self.invalidate_top_k()
+        self.song_counts.subtract_counts(song_counts)
+
+    def stream_song_array(self, songIds):
+        # fast path for a typed buffer of song ids (array('q'), a NumPy integer array, a memoryview, ...). The buffer
+        # is converted to Python ints in one C-level tolist call and counted with Counter, which also runs in C, so
+        # the only Python level work is one merge per distinct song of the batch
+        view = memoryview(songIds)
+        if view.ndim != 1:
+            view = view.cast("B").cast(view.format)
+        self.stream_song_counts(Counter(view.tolist()))
+        self.record_batches(1)
+
+    def check_checkpointable(self):
+        if self.segments:
+            raise ValueError("Segment rankings cannot be checkpointed")
+
+    def checkpoint_state(self):
+        # copy the counts into typed arrays, at C speed, so they can be written while later batches change the counts
+        self.check_checkpointable()
+        song_counts = self.song_counts
+        dense = isinstance(song_counts, DenseSongCounts)
+        if dense:
+            sections = [song_counts.array[:]]
+            capacity = 0
+            errors = {}
+        else:
+            try:
+                sections = [array("q", song_counts.counts), array("q", song_counts.counts.values())]
+                errors = song_counts.errors
+                sections += [array("q", errors), array("q", errors.values())]
+            except (TypeError, OverflowError):
+                raise ValueError("Only 64-bit integer song ids can be checkpointed")
+            capacity = song_counts.capacity or 0
+        header = CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, CHECKPOINT_VERSION, sys.byteorder[0].encode(), dense,
+                                        self.k, capacity, self.batches_streamed, song_counts.total_streams,
+                                        len(sections[0]), len(errors))
+        return header, sections
+
+    def save_checkpoint(self, path, wait=True):
+        # the counts are copied now and written by a background thread, which is returned. A checkpoint still being
+        # written is finished first, so checkpoints reach the disk in order
+        header, sections = self.checkpoint_state()
+        self.wait_for_checkpoint()
+        self.checkpoint_thread = threading.Thread(target=write_checkpoint, args=(path, header, sections))
+        self.checkpoint_thread.start()
+        if wait:
+            self.wait_for_checkpoint()
+        return self.checkpoint_thread
+
+    def wait_for_checkpoint(self):
+        if self.checkpoint_thread is not None:
+            self.checkpoint_thread.join()
+
+    def enable_checkpoints(self, path, every_batches=1000):
+        # a ranker that cannot be checkpointed is rejected here, not by the first periodic checkpoint in the middle of
+        # an ingest. Once enabled, batches with segment plays are rejected before they are merged
+        self.check_checkpointable()
+        self.checkpoint_path = path
+        self.checkpoint_every = every_batches
+
+    def close(self):
+        # write the final checkpoint at shutdown
+        if self.checkpoint_path is not None:
+            self.save_checkpoint(self.checkpoint_path)
+        self.wait_for_checkpoint()
+
+    @classmethod
+    def load_checkpoint(cls, path):
+        with open(path, "rb") as file:
+            header = file.read(CHECKPOINT_HEADER.size)
+            if len(header) != CHECKPOINT_HEADER.size:
+                raise ValueError("Not an AlgoFy checkpoint")
+            magic, version, byteorder, dense, k, capacity, batches_streamed, total_streams, size, error_size = \
+                CHECKPOINT_HEADER.unpack(header)
+            if magic != CHECKPOINT_MAGIC or version != CHECKPOINT_VERSION:
+                raise ValueError("Not an AlgoFy checkpoint")
+            sections = []
+            for section_size in [size] if dense else [size, size, error_size, error_size]:
+                section = array("q")
+                section.fromfile(file, section_size)
+                if byteorder.decode() != sys.byteorder[0]:
+                    section.byteswap()
+                sections.append(section)
+
+        ranker = cls(k, capacity or None, bool(dense))
+        song_counts = ranker.song_counts
+        if dense:
+            song_counts.array = sections[0]
+            song_counts.distinct_songs = len(sections[0]) - sections[0].count(0)
+        else:
+            song_ids, counts, error_ids, errors = [section.tolist() for section in sections]
+            song_counts.counts.update(zip(song_ids, counts))
+            song_counts.errors.update(zip(error_ids, errors))
+            song_counts.rebuild()
+        song_counts.total_streams = total_streams
+        ranker.batches_streamed = batches_streamed
+        return ranker
+
+    def replay_batches(self, batches, first_batch=0):
+        # stream the batches of a log whose first batch has the sequence number first_batch, skipping the batches
+        # that were already merged before the checkpoint
+        for sequence, songIds in enumerate(batches, first_batch):
+            if sequence >= self.batches_streamed:
+                self.stream_songs(songIds)
+
+    def get_top_k_counts(self, segment=None):
+        # the top k songs in order, paired with their stream counts, recomputed only after a relevant batch
+        if segment is not None:
+            ranker = self.segments.get(segment)
+            return [] if ranker is None else ranker.get_top_k_counts()
+        if self.top_k_cache is None:
+            self.cache_misses += 1
+            self.top_k_cache = self.song_counts.top(self.k)
+            self.top_k_members = {songId for songId, count in self.top_k_cache}
+        else:
+            self.cache_hits += 1
+        return list(self.top_k_cache)
+
+    def get_top_k(self, segment=None):
+        # walk the buckets from the most streamed songs down, taking index 0 to return the songId and not the count
+        return [songId for songId, count in self.get_top_k_counts(segment)]
+
+
+class WindowedAlgoFy(AlgoFy):
+    def __init__(self, k, window, slide=None):
+        # rank the plays of the last window time units. Batches are grouped into panes of slide time units by their
+        # timestamp and a whole pane expires once it falls out of the window. slide defaults to the window, which
+        # gives tumbling windows, a smaller slide gives a sliding window that moves slide time units at a time
+        super().__init__(k)
+        self.window = window
+        self.slide = window if slide is None else slide
+        # (pane start, Counter of the plays in the pane), oldest pane first
+        self.panes = deque()
+        # the latest time seen by a batch or advance_time, the window always ends at the pane of this time
+        self.current_time = None
+
+    def stream_songs(self, songIds, timestamp=None):
+        self.stream_song_counts(Counter(songIds), timestamp)
+        self.record_batches(1)
+
+    def stream_song_array(self, songIds, timestamp=None):
+        view = memoryview(songIds)
+        if view.ndim != 1:
+            view = view.cast("B").cast(view.format)
+        self.stream_song_counts(Counter(view.tolist()), timestamp)
+        self.record_batches(1)
+
+    def stream_song_counts(self, song_counts, timestamp=None):
+        # batches without a timestamp are stamped with the current time
+        timestamp = time.time() if timestamp is None else timestamp
+        pane_start = timestamp - timestamp % self.slide
+        self.advance_time(timestamp)
+        # plays that are already outside the window ending at the current time are dropped, even when every pane has
+        # expired already
+        current_pane_start = self.current_time - self.current_time % self.slide
+        if pane_start <= current_pane_start - self.window:
+            return
+
+        # plays are remembered in their pane so they can be subtracted again when the pane expires. Late batches
+        # join an earlier pane that is still inside the window
+        for start, counts in reversed(self.panes):
+            if start == pane_start:
+                counts.update(song_counts)
+                break
+            if start < pane_start:
+                self.insert_pane(pane_start, song_counts)
+                break
+        else:
+            self.insert_pane(pane_start, song_counts)
+        # the panes keep the plays as they arrived, so segment plays also expire from their segment rankings
+        super().stream_song_counts(song_counts)
+
+    def insert_pane(self, pane_start, song_counts):
+        # keep the panes ordered by start, new panes are almost always the newest and go at the end
+        index = len(self.panes)
+        while index > 0 and self.panes[index - 1][0] > pane_start:
+            index -= 1
+        self.panes.insert(index, (pane_start, Counter(song_counts)))
+
+    def check_checkpointable(self):
+        # the panes are not part of the checkpoint, so a restored ranker could never expire the checkpointed plays
+        raise ValueError("A WindowedAlgoFy cannot be checkpointed")
+
+    def advance_time(self, timestamp):
+        # expire every pane that is entirely older than the window ending at the pane of the timestamp. Each pane is
+        # added once and subtracted once, so expiry is amortized over the ingests instead of rescanning at read time.
+        # Time never moves backwards, a late batch does not bring back the panes that already expired
+        if self.current_time is None or timestamp > self.current_time:
+            self.current_time = timestamp
+        current_pane_start = self.current_time - self.current_time % self.slide
+        while self.panes and self.panes[0][0] <= current_pane_start - self.window:
+            start, counts = self.panes.popleft()
+            self.remove_song_counts(counts)
+
+
+class DecayedAlgoFy:
+    # weights beyond this exponent are rescaled so they stay far away from floating point overflow
+    MAX_EXPONENT = 200
+
+    def __init__(self, k, half_life):
+        # rank songs by exponentially decayed play counts: a play half_life time units old counts half as much as a
+        # play now. Forward decay is used, every play is weighted by 2^((timestamp - landmark) / half_life) when it
+        # arrives, which ranks songs exactly like decaying all old scores but never touches the old scores
+        self.k = k
+        self.rate = math.log(2) / half_life
+        self.landmark = None
+        self.latest = None
+        self.scores = {}
+        # the current top k songs with their scores, and a min-heap of (score, -songId) over them so the weakest
+        # member is found in O(log k). Heap entries of songs whose score changed since are skipped lazily
+        self.top_scores = {}
+        self.top_heap = []
+
+    def stream_songs(self, songIds, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        if self.landmark is None:
+            self.landmark = timestamp
+        if (timestamp - self.landmark) * self.rate > self.MAX_EXPONENT:
+            self.rescale(timestamp)
+        self.latest = timestamp if self.latest is None else max(self.latest, timestamp)
+
+        weight = math.exp((timestamp - self.landmark) * self.rate)
+        for songId, plays in Counter(songIds).items():
+            score = self.scores.get(songId, 0) + plays * weight
+            self.scores[songId] = score
+            self.offer(songId, score)
+
+    def offer(self, songId, score):
+        # scores only grow, so a song outside the top k can only enter it when it gets new plays. Comparing it with
+        # the weakest member keeps the top k exact without ever scanning the other songs. With k = 0 there is no
+        # member to compare with and the ranking stays empty
+        if self.k == 0:
+            return
+        if songId in self.top_scores or len(self.top_scores) < self.k:
+            self.top_scores[songId] = score
+            heapq.heappush(self.top_heap, (score, -songId))
+        else:
+            weakest_score, weakest_song = self.weakest_top_entry()
+            if (score, -songId) <= (weakest_score, weakest_song):
+                return
+            heapq.heappop(self.top_heap)
+            del self.top_scores[-weakest_song]
+            self.top_scores[songId] = score
+            heapq.heappush(self.top_heap, (score, -songId))
+
+        # drop the stale entries once they outnumber the members
+        if len(self.top_heap) > 4 * self.k + 16:
+            self.top_heap = [(score, -songId) for songId, score in self.top_scores.items()]
+            heapq.heapify(self.top_heap)
+
+    def weakest_top_entry(self):
+        # skip heap entries left behind by songs whose score has grown since
+        while self.top_scores.get(-self.top_heap[0][1]) != self.top_heap[0][0]:
+            heapq.heappop(self.top_heap)
+        return self.top_heap[0]
+
+    def rescale(self, timestamp):
+        # move the landmark to the timestamp and scale every score down by the same factor, which keeps the ranking.
+        # Songs whose score falls below a billionth of a play have effectively expired and are dropped
+        factor = math.exp(-(timestamp - self.landmark) * self.rate)
+        self.landmark = timestamp
+        self.scores = {songId: score * factor for songId, score in self.scores.items()
+                       if score * factor >= 1e-9 or songId in self.top_scores}
+        self.top_scores = {songId: score * factor for songId, score in self.top_scores.items()}
+        self.top_heap = [(score, -songId) for songId, score in self.top_scores.items()]
+        heapq.heapify(self.top_heap)
+
+    def get_top_k_counts(self):
+        # the top k songs in order, paired with their decayed play counts as of the latest batch
+        decay = 1 if self.latest is None else math.exp(-(self.latest - self.landmark) * self.rate)
+        ranking = sorted(self.top_scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(songId, score * decay) for songId, score in ranking]
 
     def get_top_k(self):
-        # create a max heap by taking the negative of the count value for each song in the song_streams hash map
-        stream_heap = [(-count, songId) for songId, count in self.song_streams.items()]
-        heapq.heapify(stream_heap)
+        return [songId for songId, score in self.get_top_k_counts()]
 
-        # instantiate a list for the top_k songs
-        top_k = []
-        # loop through whatever is smaller, the number of unique songs streamed or k
-        for i in range(min(self.k, len(self.song_streams))):
-            # for each k, append the most streamed song. Take index 1 to append songId and not stream count
-            top_k.append(heapq.heappop(stream_heap)[1])
 
-        return top_k
+def run_algo_fy_shard(k, inbox, connection):
+    # worker process of a ShardedAlgoFy: ingest the counted batches that the producers put into the inbox of this
+    # shard and answer top k requests with counts on the connection, until the shard is closed
+    ranker = AlgoFy(k)
+    while True:
+        command, payload = inbox.get()
+        if command == "stream":
+            ranker.stream_song_counts(payload)
+        elif command == "top":
+            connection.send(ranker.song_counts.top(payload))
+        else:
+            connection.close()
+            return
+
+
+class ShardedAlgoFyProducer:
+    def __init__(self, inboxes):
+        # writes batches straight into the inboxes of the shards. A producer can be handed to another process (as an
+        # argument of multiprocessing.Process), so several producers count and partition their batches in parallel
+        # instead of funnelling every batch through the coordinator
+        self.inboxes = inboxes
+
+    def stream_songs(self, songIds):
+        # count the batch in C, split the distinct songs by shard and hand every shard its counts. The shards ingest
+        # in parallel, this call does not wait for them
+        self.stream_song_counts(Counter(songIds))
+
+    def stream_song_counts(self, song_counts):
+        shards = len(self.inboxes)
+        shard_counts = [{} for _ in range(shards)]
+        for songId, plays in song_counts.items():
+            shard_counts[songId % shards][songId] = plays
+        for inbox, counts in zip(self.inboxes, shard_counts):
+            if counts:
+                inbox.put(("stream", counts))
+
+
+def run_algo_fy_producer(producer, batches):
+    # producer process of a ShardedAlgoFy benchmark or test: stream every batch straight into the shards
+    for songIds in batches:
+        producer.stream_songs(songIds)
+
+
+class ShardedAlgoFy:
+    def __init__(self, k, shards=4):
+        # song ids are partitioned across worker processes by songId % shards, and every song lives in exactly one
+        # shard. The global top k is therefore contained in the union of the per shard top k lists, so the
+        # coordinator only merges k candidates per shard instead of shipping every count
+        self.k = k
+        self.shards = shards
+        # every shard reads its batches from an inbox that any number of producers write to, and answers top k
+        # requests on its own pipe
+        self.inboxes = []
+        self.connections = []
+        self.workers = []
+        for _ in range(shards):
+            inbox = multiprocessing.Queue()
+            coordinator_end, worker_end = multiprocessing.Pipe(duplex=False)
+            worker = multiprocessing.Process(target=run_algo_fy_shard, args=(k, inbox, worker_end), daemon=True)
+            worker.start()
+            worker_end.close()
+            self.inboxes.append(inbox)
+            self.connections.append(coordinator_end)
+            self.workers.append(worker)
+        self.coordinator_producer = self.producer()
+
+    def producer(self):
+        # a handle that streams batches directly into the shards, for producer processes or threads
+        return ShardedAlgoFyProducer(self.inboxes)
+
+    def stream_songs(self, songIds):
+        self.coordinator_producer.stream_songs(songIds)
+
+    def stream_song_counts(self, song_counts):
+        self.coordinator_producer.stream_song_counts(song_counts)
+
+    def get_top_k_counts(self):
+        # ask every shard for its top k with counts, then merge the candidates with the same tie rule as AlgoFy. The
+        # request queues up behind the batches already in the inbox, so the answer includes every batch streamed
+        # before by this process and every batch other producers had put into the inboxes
+        for inbox in self.inboxes:
+            inbox.put(("top", self.k))
+        candidates = [candidate for connection in self.connections for candidate in connection.recv()]
+        return heapq.nsmallest(self.k, candidates, key=lambda candidate: (-candidate[1], candidate[0]))
+
+    def get_top_k(self):
+        return [songId for songId, count in self.get_top_k_counts()]
+
+    def close(self):
+        # producers in other processes must have finished streaming before the shards are closed
+        for inbox in self.inboxes:
+            inbox.put(("close", None))
+        for worker in self.workers:
+            worker.join()
+        for inbox, connection in zip(self.inboxes, self.connections):
+            inbox.close()
+            connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncAlgoFy:
+    def __init__(self, ranker, max_pending_batches=64, coalesce_plays=100_000, merge_chunk=2_000):
+        # asyncio front end for an AlgoFy (or any ranker with stream_song_counts and get_top_k). Producers put
+        # batches into a bounded queue and wait when it is full (backpressure). A single ingest task drains the queue,
+        # coalesces small batches into one of up to coalesce_plays plays, and counts and merges it in chunks of
+        # merge_chunk, yielding to the event loop between chunks so get_top_k reads are served during the ingest
+        self.ranker = ranker
+        self.queue = asyncio.Queue(max_pending_batches)
+        self.coalesce_plays = coalesce_plays
+        self.merge_chunk = merge_chunk
+        self.ingest_task = None
+        # (batch, exception) of every batch that could not be counted or merged. A bad batch is skipped and reported
+        # here, the ingest task keeps draining the queue
+        self.failed_batches = []
+
+    def start(self):
+        if self.ingest_task is None:
+            self.ingest_task = asyncio.get_running_loop().create_task(self.ingest())
+
+    async def stop(self):
+        # finish every batch already queued, then stop the ingest task. If the ingest task died the queue is never
+        # drained, so its exception is raised instead of waiting forever
+        if self.ingest_task is not None:
+            join = asyncio.ensure_future(self.queue.join())
+            await asyncio.wait([join, self.ingest_task], return_when=asyncio.FIRST_COMPLETED)
+            if not join.done():
+                join.cancel()
+                self.check_ingest_task()
+        else:
+            await self.queue.join()
+        if self.ingest_task is not None:
+            self.ingest_task.cancel()
+            try:
+                await self.ingest_task
+            except asyncio.CancelledError:
+                pass
+            self.ingest_task = None
+
+    def check_ingest_task(self):
+        # raise the exception that ended the ingest task, so producers do not block on a queue nobody drains
+        task = self.ingest_task
+        if task is not None and task.done():
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+            raise RuntimeError("The AlgoFy ingest task is not running")
+
+    async def put(self, songIds):
+        # waits while max_pending_batches batches are already queued
+        self.check_ingest_task()
+        await self.queue.put(songIds)
+
+    async def consume(self, batches):
+        # feed every batch of an async iterator, for example the batches read from the iStream socket
+        async for songIds in batches:
+            await self.put(songIds)
+
+    async def ingest(self):
+        while True:
+            # coalesce whatever is already queued into one larger batch. taken counts every batch taken from the queue,
+            # including the ones without a length (a generator, None, ...) that are reported and skipped right away
+            batches = []
+            taken = 0
+            plays = 0
+            while not batches or (plays < self.coalesce_plays and not self.queue.empty()):
+                if not batches and taken:
+                    # only bad batches so far, finish them before waiting for the next batch so stop() never waits
+                    # for them
+                    self.finish_batches(taken)
+                    taken = 0
+                songIds = self.queue.get_nowait() if batches else await self.queue.get()
+                taken += 1
+                try:
+                    plays += len(songIds)
+                except Exception as error:
+                    self.failed_batches.append((songIds, error))
+                    continue
+                batches.append(songIds)
+
+            try:
+                # every batch is counted on its own first, so a batch that cannot be counted (an unhashable id, a
+                # batch that is not a sequence) is skipped without losing the batches coalesced with it
+                song_counts = Counter()
+                counted_batches = []
+                for songIds in batches:
+                    try:
+                        batch_counts = Counter()
+                        for start in range(0, len(songIds), self.merge_chunk):
+                            batch_counts.update(songIds[start:start + self.merge_chunk])
+                            await asyncio.sleep(0)
+                    except Exception as error:
+                        self.failed_batches.append((songIds, error))
+                        continue
+                    song_counts.update(batch_counts)
+                    counted_batches.append(songIds)
+
+                # merge the distinct songs in chunks as well, a read between two chunks sees part of the batch
+                try:
+                    distinct_songs = iter(song_counts.items())
+                    chunk = dict(itertools.islice(distinct_songs, self.merge_chunk))
+                    while chunk:
+                        self.ranker.stream_song_counts(chunk)
+                        await asyncio.sleep(0)
+                        chunk = dict(itertools.islice(distinct_songs, self.merge_chunk))
+                except Exception as error:
+                    # the ranker rejected the merge, the counted batches may be partially merged
+                    self.failed_batches.extend((songIds, error) for songIds in counted_batches)
+            finally:
+                self.finish_batches(taken)
+
+    def finish_batches(self, batches):
+        # every source batch taken from the queue has been merged or reported, so a ranker that numbers its batches
+        # for checkpoints counts them now, failed batches included since replaying them fails again
+        record_batches = getattr(self.ranker, "record_batches", None)
+        if record_batches is not None:
+            record_batches(batches)
+        for _ in range(batches):
+            self.queue.task_done()
+
+    def get_top_k(self):
+        # reads run on the event loop between ingest chunks, so they never wait for a whole batch to be counted
+        return self.ranker.get_top_k()
 
 
 class TestAlgoFy:
@@ -89,6 +1146,33 @@ class TestAlgoFy:
         self.test_many_batches()
         self.test_fewer_than_k()
         self.test_empty()
+        self.test_ties()
+        self.test_matches_heap_ranking()
+        self.test_stream_song_array()
+        self.test_approximate_heavy_hitters()
+        self.test_approximate_error_bound()
+        self.test_tumbling_window()
+        self.test_sliding_window()
+        self.test_window_drops_late_plays()
+        self.test_window_segments()
+        self.test_decayed_ranking()
+        self.test_sharded_ranking()
+        self.test_sharded_producers()
+        self.test_async_ingest()
+        self.test_async_ingest_bad_batch()
+        self.test_top_k_cache()
+        self.test_top_k_cache_window_expiry()
+        self.test_top_k_cache_approximate()
+        self.test_dense_backend()
+        self.test_dense_backend_fallback()
+        self.test_dense_top_k_candidates()
+        self.test_checkpoint_restore()
+        self.test_checkpoint_backends()
+        self.test_periodic_checkpoints()
+        self.test_async_checkpoint_batches()
+        self.test_segment_top_k()
+        self.test_segment_mixed_and_async()
+        self.test_segment_checkpoint_rejected()
 
     def print_test_result(self, test_name, result):
         color = "\033[92m" if result else "\033[91m"
@@ -154,6 +1238,510 @@ class TestAlgoFy:
 
         self.test_answer("test_empty", result, expected_answer)
 
+    def test_ties(self):
+        ranker = AlgoFy(3)
+
+        ranker.stream_songs([9, 7, 8, 5, 9, 7, 8, 6])
+        result = [ranker.get_top_k(), ranker.get_top_k_counts()]
+        expected_answer = [[7, 8, 9], [(7, 2), (8, 2), (9, 2)]]
+
+        self.test_answer("test_ties", result, expected_answer)
+
+    def test_matches_heap_ranking(self):
+        ranker = AlgoFy(10)
+        rng = random.Random(526)
+        results = []
+        expected_answer = []
+        for _ in range(50):
+            ranker.stream_songs([rng.randrange(40) for _ in range(rng.randrange(100))])
+            results.append(ranker.get_top_k())
+            # the ranking rebuilt from scratch with a heap over every song
+            stream_heap = [(-count, songId) for songId, count in ranker.song_streams.items()]
+            expected_answer.append([songId for count, songId in heapq.nsmallest(10, stream_heap)])
+
+        self.test_answer("test_matches_heap_ranking", results, expected_answer)
+
+    def test_stream_song_array(self):
+        ranker = AlgoFy(10)
+        array_ranker = AlgoFy(10)
+        rng = random.Random(526)
+        results = []
+        expected_answer = []
+        for batch_size in [0, 10, 1000, 5, 20000, 3]:
+            batch = [rng.randrange(300) for _ in range(batch_size)]
+            ranker.stream_songs(batch)
+            array_ranker.stream_song_array(array("q", batch))
+            results.append(array_ranker.get_top_k_counts())
+            expected_answer.append(ranker.get_top_k_counts())
+
+        self.test_answer("test_stream_song_array", results, expected_answer)
+
+    def test_approximate_heavy_hitters(self):
+        ranker = AlgoFy(2, capacity=4)
+        # two heavy songs mixed into a long tail of songs streamed once
+        for tail_song in range(100, 200):
+            ranker.stream_songs([1, 2, 1, tail_song])
+        result = [ranker.get_top_k(), len(ranker.song_streams)]
+        expected_answer = [[1, 2], 4]
+
+        self.test_answer("test_approximate_heavy_hitters", result, expected_answer)
+
+    def test_approximate_error_bound(self):
+        ranker = AlgoFy(5, capacity=20)
+        rng = random.Random(526)
+        true_counts = Counter()
+        for _ in range(100):
+            batch = [int(200 * rng.random() ** 4) for _ in range(50)]
+            true_counts.update(batch)
+            ranker.stream_songs(batch)
+        bound = ranker.get_error_bound()
+        within_bound = all(true_counts[songId] <= count <= true_counts[songId] + bound
+                           for songId, count in ranker.song_streams.items())
+        heavy_tracked = all(songId in ranker.song_streams for songId, count in true_counts.items() if count > bound)
+        result = [within_bound, heavy_tracked, len(ranker.song_streams) <= 20]
+        expected_answer = [True, True, True]
+
+        self.test_answer("test_approximate_error_bound", result, expected_answer)
+
+    def test_tumbling_window(self):
+        ranker = WindowedAlgoFy(2, window=60)
+        ranker.stream_songs([1, 1, 1, 2, 2, 3], timestamp=0)
+        ranker.stream_songs([3, 3], timestamp=30)
+        first_window = ranker.get_top_k()
+        ranker.stream_songs([2, 4, 4], timestamp=65)
+        result = [first_window, ranker.get_top_k_counts()]
+        expected_answer = [[1, 3], [(4, 2), (2, 1)]]
+
+        self.test_answer("test_tumbling_window", result, expected_answer)
+
+    def test_sliding_window(self):
+        ranker = WindowedAlgoFy(2, window=30, slide=10)
+        ranker.stream_songs([1, 1, 1], timestamp=0)
+        ranker.stream_songs([2, 2], timestamp=10)
+        ranker.stream_songs([3], timestamp=20)
+        ranker.stream_songs([3, 3], timestamp=25)
+        before_expiry = ranker.get_top_k()
+        ranker.stream_songs([4], timestamp=31)
+        after_first_expiry = ranker.get_top_k()
+        ranker.advance_time(45)
+        result = [before_expiry, after_first_expiry, ranker.get_top_k_counts()]
+        expected_answer = [[1, 3], [3, 2], [(3, 3), (4, 1)]]
+
+        self.test_answer("test_sliding_window", result, expected_answer)
+
+    def test_window_drops_late_plays(self):
+        ranker = WindowedAlgoFy(2, window=30, slide=10)
+        ranker.stream_songs([1, 1], timestamp=0)
+        # every pane has expired, plays stamped long before the current time are still outside the window
+        ranker.advance_time(100)
+        ranker.stream_songs([5, 5], timestamp=3)
+        expired = ranker.get_top_k()
+        # a late batch inside the window still joins its earlier pane
+        ranker.stream_songs([2], timestamp=95)
+        ranker.stream_songs([3, 3], timestamp=80)
+        result = [expired, ranker.get_top_k_counts(), [start for start, counts in ranker.panes]]
+        expected_answer = [[], [(3, 2), (2, 1)], [80, 90]]
+
+        self.test_answer("test_window_drops_late_plays", result, expected_answer)
+
+    def test_window_segments(self):
+        ranker = WindowedAlgoFy(2, window=60)
+        ranker.stream_songs([(1, "rock"), (1, "rock"), 2, (4, "jazz")], timestamp=0)
+        first_window = [ranker.get_top_k(), ranker.get_top_k("rock"), ranker.get_top_k("jazz")]
+        # the first pane expires from the global ranking and from every segment ranking
+        ranker.stream_songs([(3, "rock")], timestamp=70)
+        result = [first_window, ranker.get_top_k(), ranker.get_top_k("rock"), ranker.get_top_k("jazz"),
+                  sorted(ranker.segments)]
+        expected_answer = [[[1, 2], [1], [4]], [3], [3], [], ["rock"]]
+
+        self.test_answer("test_window_segments", result, expected_answer)
+
+    def test_decayed_ranking(self):
+        ranker = DecayedAlgoFy(2, half_life=10)
+        ranker.stream_songs([1, 1, 1, 1, 2, 2, 2], timestamp=0)
+        early = ranker.get_top_k()
+        # two half lives later a play of song 3 is worth four of the first batch
+        ranker.stream_songs([3, 3], timestamp=20)
+        later = ranker.get_top_k()
+        # far enough in the future to rescale every score
+        ranker.stream_songs([2], timestamp=10000)
+        empty_ranker = DecayedAlgoFy(0, half_life=10)
+        empty_ranker.stream_songs([1, 1, 2], timestamp=0)
+        result = [early, later, ranker.get_top_k(), round(ranker.get_top_k_counts()[0][1], 6), empty_ranker.get_top_k()]
+        expected_answer = [[1, 2], [3, 1], [2, 3], 1.0, []]
+
+        self.test_answer("test_decayed_ranking", result, expected_answer)
+
+    def test_sharded_ranking(self):
+        ranker = AlgoFy(5)
+        rng = random.Random(526)
+        with ShardedAlgoFy(5, shards=3) as sharded_ranker:
+            results = []
+            expected_answer = []
+            for _ in range(20):
+                batch = [int(100 * rng.random() ** 2) for _ in range(200)]
+                ranker.stream_songs(batch)
+                sharded_ranker.stream_songs(batch)
+                results.append(sharded_ranker.get_top_k_counts())
+                expected_answer.append(ranker.get_top_k_counts())
+
+        self.test_answer("test_sharded_ranking", results, expected_answer)
+
+    def test_sharded_producers(self):
+        rng = random.Random(526)
+        batches = [[int(100 * rng.random() ** 2) for _ in range(200)] for _ in range(12)]
+        ranker = AlgoFy(5)
+        for batch in batches:
+            ranker.stream_songs(batch)
+        with ShardedAlgoFy(5, shards=3) as sharded_ranker:
+            # three producer processes feed the shards directly, none of their batches pass the coordinator
+            producers = [multiprocessing.Process(target=run_algo_fy_producer,
+                                                 args=(sharded_ranker.producer(), batches[start::3]))
+                         for start in range(3)]
+            for producer in producers:
+                producer.start()
+            for producer in producers:
+                producer.join()
+            result = sharded_ranker.get_top_k_counts()
+        expected_answer = ranker.get_top_k_counts()
+
+        self.test_answer("test_sharded_producers", result, expected_answer)
+
+    def test_async_ingest(self):
+        rng = random.Random(526)
+        batches = [[int(100 * rng.random() ** 2) for _ in range(rng.randrange(1, 300))] for _ in range(50)]
+        ranker = AlgoFy(5)
+        for batch in batches:
+            ranker.stream_songs(batch)
+
+        async def produce():
+            for batch in batches:
+                yield batch
+
+        async def run():
+            async_ranker = AsyncAlgoFy(AlgoFy(5), max_pending_batches=4, coalesce_plays=500, merge_chunk=64)
+            async_ranker.start()
+            reads = []
+
+            async def read():
+                while len(reads) < 10:
+                    reads.append(async_ranker.get_top_k())
+                    await asyncio.sleep(0)
+
+            await asyncio.gather(async_ranker.consume(produce()), read())
+            await async_ranker.stop()
+            return [len(reads), async_ranker.get_top_k()]
+
+        result = asyncio.run(run())
+        expected_answer = [10, ranker.get_top_k()]
+
+        self.test_answer("test_async_ingest", result, expected_answer)
+
+    def test_async_ingest_bad_batch(self):
+        async def run():
+            async_ranker = AsyncAlgoFy(AlgoFy(2), max_pending_batches=2, coalesce_plays=10)
+            async_ranker.start()
+            # the list id cannot be counted and the generator and None have no length, the batches before and after
+            # them are still ingested and every batch is numbered for checkpoints
+            for batch in [[1, 1, 2], [3, [4]], [2, 2], (song for song in [7, 7, 7]), None, [5], [5], [5]]:
+                await async_ranker.put(batch)
+            await async_ranker.stop()
+            # a batch without a length as the only queued batch is reported without blocking stop()
+            async_ranker.start()
+            await async_ranker.put(iter([1, 2]))
+            await async_ranker.stop()
+            failed_batches = async_ranker.failed_batches
+            return [async_ranker.get_top_k(), sorted(type(batch).__name__ for batch, error in failed_batches),
+                    [3, [4]] in [batch for batch, error in failed_batches],
+                    [type(error) for batch, error in failed_batches], async_ranker.ranker.batches_streamed]
+
+        result = asyncio.run(asyncio.wait_for(run(), 10))
+        expected_answer = [[2, 5], ["NoneType", "generator", "list", "list_iterator"], True, [TypeError] * 4, 9]
+
+        self.test_answer("test_async_ingest_bad_batch", result, expected_answer)
+
+    def test_top_k_cache(self):
+        ranker = AlgoFy(2)
+        ranker.stream_songs([1, 1, 1, 2, 2, 3])
+        ranker.get_top_k()
+        ranker.get_top_k()
+        # song 4 stays below the kth count, so the cached result is still valid
+        ranker.stream_songs([4])
+        unchanged = ranker.get_top_k()
+        # song 3 ties the kth count, so the result is recomputed and song 2 keeps its place with the smaller id
+        ranker.stream_songs([3])
+        tied = ranker.get_top_k()
+        ranker.stream_songs([3, 4, 4, 4])
+        # k = 0 keeps an empty cached result
+        empty_ranker = AlgoFy(0)
+        empty_ranker.get_top_k()
+        empty_ranker.stream_songs([1, 1, 2])
+        result = [unchanged, tied, ranker.get_top_k(), ranker.cache_hits, ranker.cache_misses,
+                  ranker.get_cache_hit_rate(), empty_ranker.get_top_k()]
+        expected_answer = [[1, 2], [1, 2], [4, 1], 2, 3, 0.4, []]
+
+        self.test_answer("test_top_k_cache", result, expected_answer)
+
+    def test_top_k_cache_window_expiry(self):
+        ranker = WindowedAlgoFy(1, window=10)
+        ranker.stream_songs([1, 1, 2], timestamp=0)
+        first = ranker.get_top_k()
+        ranker.stream_songs([2], timestamp=15)
+        result = [first, ranker.get_top_k(), ranker.cache_invalidations]
+        expected_answer = [[1], [2], 1]
+
+        self.test_answer("test_top_k_cache_window_expiry", result, expected_answer)
+
+    def test_top_k_cache_approximate(self):
+        ranker = AlgoFy(1, capacity=3)
+        ranker.stream_songs([7, 29, 29, 0, 0, 0])
+        first = ranker.get_top_k_counts()
+        # every new song evicts the lowest song and starts from its count, so the later new songs pass the kth count
+        ranker.stream_songs([19, 26, 1, 22, 8])
+        evicted = ranker.get_top_k_counts()
+        # a batch of new songs that fit in a free counter keeps the cache
+        ranker = AlgoFy(1, capacity=3)
+        ranker.stream_songs([0, 0, 0])
+        ranker.get_top_k()
+        ranker.stream_songs([4, 5])
+        result = [first, evicted, dict(ranker.song_streams), ranker.get_top_k(), ranker.cache_hits]
+        expected_answer = [[(0, 3)], [(8, 4)], {0: 3, 4: 1, 5: 1}, [0], 1]
+
+        # random batches in approximate mode against the ranking recomputed from the counts
+        rng = random.Random(526)
+        ranker = AlgoFy(3, capacity=6)
+        results = []
+        expected_rankings = []
+        for _ in range(300):
+            ranker.stream_songs([int(30 * rng.random() ** 2) for _ in range(rng.randrange(8))])
+            results.append(ranker.get_top_k_counts())
+            expected_rankings.append(ranker.song_counts.top(3))
+        result.append(results)
+        expected_answer.append(expected_rankings)
+
+        self.test_answer("test_top_k_cache_approximate", result, expected_answer)
+
+    def test_dense_backend(self):
+        ranker = AlgoFy(10)
+        dense_ranker = AlgoFy(10, dense=True)
+        rng = random.Random(526)
+        results = []
+        expected_answer = []
+        for _ in range(30):
+            batch = [int(500 * rng.random() ** 2) for _ in range(rng.randrange(200))]
+            ranker.stream_songs(batch)
+            dense_ranker.stream_songs(batch)
+            results.append(dense_ranker.get_top_k_counts())
+            expected_answer.append(ranker.get_top_k_counts())
+        results.append([dense_ranker.song_streams.get(0), len(dense_ranker.song_streams), 10 ** 9 in
+                        dense_ranker.song_streams])
+        expected_answer.append([ranker.song_streams.get(0), len(ranker.song_streams), False])
+
+        self.test_answer("test_dense_backend", results, expected_answer)
+
+    def test_dense_backend_fallback(self):
+        ranker = AlgoFy(3, dense=True)
+        ranker.stream_songs([1, 1, 2, 3, 3, 3])
+        dense_before = isinstance(ranker.song_counts, DenseSongCounts)
+        # a huge id would need an enormous mostly empty array, so the counts move into the buckets
+        ranker.stream_songs([10 ** 12, 10 ** 12, 10 ** 12, 10 ** 12])
+        result = [dense_before, isinstance(ranker.song_counts, SongCountBuckets), ranker.get_top_k()]
+        expected_answer = [True, True, [10 ** 12, 3, 1]]
+
+        self.test_answer("test_dense_backend_fallback", result, expected_answer)
+
+    def test_dense_top_k_candidates(self):
+        ranker = AlgoFy(5)
+        dense_ranker = AlgoFy(5, dense=True)
+        rng = random.Random(526)
+        results = []
+        expected_answer = []
+        candidate_sizes = []
+        for batch_number in range(60):
+            batch = [int(2000 * rng.random() ** 3) for _ in range(rng.randrange(300))]
+            ranker.stream_songs(batch)
+            dense_ranker.stream_songs(batch)
+            if batch_number % 10 == 9:
+                # taking plays back lowers counts, after which the next read scans the array again
+                removed = Counter(batch[:20])
+                ranker.remove_song_counts(removed)
+                dense_ranker.remove_song_counts(removed)
+            if batch_number % 3 == 0:
+                results.append(dense_ranker.get_top_k_counts())
+                expected_answer.append(ranker.get_top_k_counts())
+                candidate_sizes.append(len(dense_ranker.song_counts.candidates))
+        # reads only rank the last top k and the songs that passed its kth song since
+        results.append(max(candidate_sizes) <= dense_ranker.song_counts.max_candidates())
+        expected_answer.append(True)
+        # k = 0 never ranks anything and keeps no candidates
+        empty_ranker = AlgoFy(0, dense=True)
+        empty_ranker.stream_songs([1, 2])
+        empty_ranker.get_top_k()
+        empty_ranker.stream_songs([1])
+        results.append([empty_ranker.get_top_k(), empty_ranker.song_counts.candidates])
+        expected_answer.append([[], None])
+
+        self.test_answer("test_dense_top_k_candidates", results, expected_answer)
+
+    def test_checkpoint_restore(self):
+        rng = random.Random(526)
+        batches = [[int(300 * rng.random() ** 2) for _ in range(rng.randrange(100))] for _ in range(20)]
+        ranker = AlgoFy(5)
+        for batch in batches[:12]:
+            ranker.stream_songs(batch)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "algo_fy.checkpoint")
+            ranker.save_checkpoint(path)
+            # the restarted ranker only replays the 8 batches after the checkpoint from the full log of the day
+            restored = AlgoFy.load_checkpoint(path)
+            restored.replay_batches(batches)
+        for batch in batches[12:]:
+            ranker.stream_songs(batch)
+        result = [restored.get_top_k_counts(), dict(restored.song_streams), restored.batches_streamed]
+        expected_answer = [ranker.get_top_k_counts(), dict(ranker.song_streams), 20]
+
+        self.test_answer("test_checkpoint_restore", result, expected_answer)
+
+    def test_checkpoint_backends(self):
+        result = []
+        expected_answer = []
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "algo_fy.checkpoint")
+            for ranker in [AlgoFy(2, dense=True), AlgoFy(2, capacity=3)]:
+                ranker.stream_songs([1, 1, 2, 3, 3, 3, 4, 5, 5])
+                ranker.save_checkpoint(path)
+                restored = AlgoFy.load_checkpoint(path)
+                result.append([type(restored.song_counts), restored.get_top_k_counts(), dict(restored.song_streams),
+                               restored.song_counts.errors if ranker.song_counts.capacity else None,
+                               restored.get_error_bound()])
+                expected_answer.append([type(ranker.song_counts), ranker.get_top_k_counts(),
+                                        dict(ranker.song_streams),
+                                        ranker.song_counts.errors if ranker.song_counts.capacity else None,
+                                        ranker.get_error_bound()])
+
+        self.test_answer("test_checkpoint_backends", result, expected_answer)
+
+    def test_periodic_checkpoints(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "algo_fy.checkpoint")
+            ranker = AlgoFy(2)
+            ranker.enable_checkpoints(path, every_batches=2)
+            ranker.stream_songs([1, 1, 2])
+            ranker.stream_songs([3])
+            ranker.wait_for_checkpoint()
+            periodic = AlgoFy.load_checkpoint(path)
+            ranker.stream_songs([3, 3])
+            # the final checkpoint at shutdown includes the last batch
+            ranker.close()
+            final = AlgoFy.load_checkpoint(path)
+        result = [periodic.batches_streamed, periodic.get_top_k(), final.batches_streamed, final.get_top_k()]
+        expected_answer = [2, [1, 2], 3, [3, 1]]
+
+        self.test_answer("test_periodic_checkpoints", result, expected_answer)
+
+    def test_async_checkpoint_batches(self):
+        rng = random.Random(526)
+        batches = [[rng.randrange(50) for _ in range(10)] for _ in range(12)]
+        ranker = AlgoFy(3)
+        for batch in batches:
+            ranker.stream_songs(batch)
+
+        async def run(async_ranker):
+            async_ranker.start()
+            # the first 7 batches are merged in chunks of 2 plays, each source batch is numbered once
+            for batch in batches[:7]:
+                await async_ranker.put(batch)
+            await async_ranker.stop()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "algo_fy.checkpoint")
+            async_ranker = AsyncAlgoFy(AlgoFy(3), coalesce_plays=30, merge_chunk=2)
+            asyncio.run(run(async_ranker))
+            async_ranker.ranker.save_checkpoint(path)
+            restored = AlgoFy.load_checkpoint(path)
+            restored.replay_batches(batches)
+        result = [async_ranker.ranker.batches_streamed, restored.batches_streamed, restored.get_top_k_counts()]
+        expected_answer = [7, 12, ranker.get_top_k_counts()]
+
+        self.test_answer("test_async_checkpoint_batches", result, expected_answer)
+
+    def test_segment_top_k(self):
+        rng = random.Random(526)
+        plays = [(int(100 * rng.random() ** 2), rng.choice(["rock", "jazz"]), rng.choice(["EU", "US", "APAC"]))
+                 for _ in range(2000)]
+        ranker = AlgoFy(5)
+        for start in range(0, len(plays), 250):
+            ranker.stream_songs(plays[start:start + 250])
+
+        # the same rankings from one AlgoFy per segment, each streamed only the plays of its segment
+        global_ranker = AlgoFy(5)
+        global_ranker.stream_songs([play[0] for play in plays])
+        result = [ranker.get_top_k_counts()]
+        expected_answer = [global_ranker.get_top_k_counts()]
+        for segment in ["rock", "jazz", "EU", "US", "APAC"]:
+            segment_ranker = AlgoFy(5)
+            segment_ranker.stream_songs([play[0] for play in plays if segment in play[1:]])
+            result.append(ranker.get_top_k(segment))
+            expected_answer.append(segment_ranker.get_top_k())
+        result.append(ranker.get_top_k("classical"))
+        expected_answer.append([])
+
+        self.test_answer("test_segment_top_k", result, expected_answer)
+
+    def test_segment_mixed_and_async(self):
+        plays = [(1, "rock"), 2, (2, "jazz"), 1, (1, "rock", "EU"), 3, 3, 3]
+        ranker = AlgoFy(2)
+        ranker.stream_songs(plays)
+
+        async def run():
+            async_ranker = AsyncAlgoFy(AlgoFy(2), merge_chunk=3)
+            async_ranker.start()
+            await async_ranker.put(plays)
+            await async_ranker.stop()
+            return async_ranker.ranker
+
+        async_ranker = asyncio.run(run())
+        result = []
+        expected_answer = []
+        for algo_fy in [ranker, async_ranker]:
+            result.append([algo_fy.get_top_k_counts(), algo_fy.get_top_k("rock"), algo_fy.get_top_k("jazz"),
+                           algo_fy.get_top_k("EU"), algo_fy.batches_streamed])
+            expected_answer.append([[(1, 3), (3, 3)], [1], [2], [1], 1])
+
+        self.test_answer("test_segment_mixed_and_async", result, expected_answer)
+
+    def test_segment_checkpoint_rejected(self):
+        result = []
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "algo_fy.checkpoint")
+            ranker = AlgoFy(2)
+            ranker.stream_songs([(1, "rock")])
+            try:
+                ranker.enable_checkpoints(path)
+                result.append("enabled")
+            except ValueError:
+                result.append("rejected")
+
+            # a segment batch after checkpoints were enabled is rejected before any of its plays are merged
+            ranker = AlgoFy(2)
+            ranker.enable_checkpoints(path, every_batches=1)
+            ranker.stream_songs([1, 1])
+            try:
+                ranker.stream_songs([2, (3, "rock")])
+                result.append("merged")
+            except ValueError:
+                result.append("rejected")
+            ranker.close()
+            result += [ranker.get_top_k_counts(), ranker.batches_streamed, AlgoFy.load_checkpoint(path).get_top_k()]
+            try:
+                WindowedAlgoFy(2, window=60).enable_checkpoints(path)
+                result.append("enabled")
+            except ValueError:
+                result.append("rejected")
+        expected_answer = ["rejected", "rejected", [(1, 2)], 1, [1], "rejected"]
+
+        self.test_answer("test_segment_checkpoint_rejected", result, expected_answer)
+
 
 if __name__ == '__main__':
     test_runner = TestAlgoFy()
@@ -0,0 +1,363 @@
+"""
+Benchmarks for the AlgoFy top k ranking.
+
+Run every benchmark with:
+    python algo_fy_benchmarks.py
+
+or only some of them by name:
+    python algo_fy_benchmarks.py incremental_top_k
+
+Code Author: Brendan Torok
+"""
+import asyncio
+import heapq
+import itertools
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+
+from algo_fy import AlgoFy, AsyncAlgoFy, ShardedAlgoFy, run_algo_fy_producer
+
+
+class HeapifyAlgoFy:
+    # the original AlgoFy: a plain dictionary of counts and a heap over every distinct song on each get_top_k
+    def __init__(self, k):
+        self.k = k
+        self.song_streams = {}
+
+    def stream_songs(self, songIds):
+        for songId in songIds:
+            self.song_streams[songId] = 1 + self.song_streams.get(songId, 0)
+
+    def get_top_k(self):
+        stream_heap = [(-count, songId) for songId, count in self.song_streams.items()]
+        heapq.heapify(stream_heap)
+        return [heapq.heappop(stream_heap)[1] for _ in range(min(self.k, len(self.song_streams)))]
+
+
+def generate_batches(distinct_songs, batches, batch_size, seed=526):
+    # plays skewed towards low song ids, so there is a clear head of popular songs and a long tail
+    rng = random.Random(seed)
+    return [[int(distinct_songs * rng.random() ** 3) for _ in range(batch_size)] for _ in range(batches)]
+
+
+def generate_zipf_batches(distinct_songs, batches, batch_size, exponent=1.1, seed=526):
+    # plays drawn from a Zipf distribution: song i is streamed with probability proportional to 1 / (i + 1)^exponent
+    rng = random.Random(seed)
+    cumulative_weights = list(itertools.accumulate(1 / (song + 1) ** exponent for song in range(distinct_songs)))
+    songs = range(distinct_songs)
+    return [rng.choices(songs, cum_weights=cumulative_weights, k=batch_size) for _ in range(batches)]
+
+
+async def stand_in_producer(stream, delay=0.0):
+    # local stand-in for the iStream socket: yields each batch as if it had just been read from the network
+    for batch in stream:
+        await asyncio.sleep(delay)
+        yield batch
+
+
+async def measure_read_latency(ranker, done, latencies, interval=0.001):
+    # a dashboard reader: every interval ask for the top k, recording how late the read finishes compared to when it
+    # was due, which includes any time the event loop was blocked by ingestion
+    loop = asyncio.get_running_loop()
+    while not done.is_set():
+        due = loop.time() + interval
+        await asyncio.sleep(interval)
+        ranker.get_top_k()
+        latencies.append(loop.time() - due)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class BenchmarkAlgoFy:
+    def run_benchmarks(self, names=None):
+        benchmarks = {
+            "incremental_top_k": self.benchmark_incremental_top_k,
+            "array_ingest": self.benchmark_array_ingest,
+            "approximate_accuracy": self.benchmark_approximate_accuracy,
+            "sharded_ingest": self.benchmark_sharded_ingest,
+            "async_ingest": self.benchmark_async_ingest,
+            "top_k_cache": self.benchmark_top_k_cache,
+            "dense_backend": self.benchmark_dense_backend,
+            "checkpoint_restore": self.benchmark_checkpoint_restore,
+            "segment_top_k": self.benchmark_segment_top_k,
+        }
+        for name, benchmark in benchmarks.items():
+            if not names or name in names:
+                print(f"--- {name} ---")
+                benchmark()
+
+    def print_benchmark_result(self, label, value, unit):
+        print(f"{label:<48} {value:>14.2f} {unit}")
+
+    def benchmark_incremental_top_k(self, distinct_songs=1_000_000, batches=100, batch_size=100_000, k=100,
+                                    reads=20):
+        plays = batches * batch_size
+        stream = generate_batches(distinct_songs, batches, batch_size)
+        for label, ranker in [("heapify", HeapifyAlgoFy(k)), ("buckets", AlgoFy(k))]:
+            start = time.perf_counter()
+            for batch in stream:
+                ranker.stream_songs(batch)
+            self.print_benchmark_result(f"{label} ingest", plays / (time.perf_counter() - start), "plays/s")
+
+            start = time.perf_counter()
+            for _ in range(reads):
+                ranker.get_top_k()
+            self.print_benchmark_result(f"{label} get_top_k (k={k}, {len(ranker.song_streams)} songs)",
+                                        (time.perf_counter() - start) / reads * 1e3, "ms/read")
+
+    def benchmark_array_ingest(self, distinct_songs=1_000_000, batch_sizes=(1_000, 10_000, 100_000, 1_000_000,
+                                                                            10_000_000), plays=10_000_000):
+        rng = random.Random(526)
+        for batch_size in batch_sizes:
+            batch = array("q", (int(distinct_songs * rng.random() ** 3) for _ in range(batch_size)))
+            batch_list = batch.tolist()
+            repeats = max(1, plays // batch_size)
+            for label, ingest, songIds in [("stream_songs list", "stream_songs", batch_list),
+                                           ("stream_song_array", "stream_song_array", batch)]:
+                ranker = AlgoFy(100)
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    getattr(ranker, ingest)(songIds)
+                elapsed = time.perf_counter() - start
+                self.print_benchmark_result(f"batch={batch_size} {label}", repeats * batch_size / elapsed, "plays/s")
+
+    def benchmark_approximate_accuracy(self, distinct_songs=1_000_000, batches=100, batch_size=100_000, k=100,
+                                       capacities=(200, 1_000, 10_000, 100_000), exponents=(0.8, 1.1, 1.5)):
+        for exponent in exponents:
+            stream = generate_zipf_batches(distinct_songs, batches, batch_size, exponent)
+            exact = AlgoFy(k)
+            for batch in stream:
+                exact.stream_songs(batch)
+            exact_top_k = exact.get_top_k_counts()
+            self.print_benchmark_result(f"zipf s={exponent} exact tracked songs", len(exact.song_streams), "songs")
+
+            for capacity in capacities:
+                ranker = AlgoFy(k, capacity)
+                start = time.perf_counter()
+                for batch in stream:
+                    ranker.stream_songs(batch)
+                elapsed = time.perf_counter() - start
+
+                # recall of the true top k, and the worst overestimate among the reported top k
+                top_k = ranker.get_top_k_counts()
+                recall = len({songId for songId, count in top_k} & {songId for songId, count in exact_top_k}) / k
+                max_error = max(count - exact.song_streams[songId] for songId, count in top_k)
+                label = f"zipf s={exponent} capacity={capacity}"
+                self.print_benchmark_result(f"{label} recall@{k}", recall * 100, "%")
+                self.print_benchmark_result(f"{label} max top-k error", max_error, "streams")
+                self.print_benchmark_result(f"{label} error bound", ranker.get_error_bound(), "streams")
+                self.print_benchmark_result(f"{label} ingest", batches * batch_size / elapsed, "plays/s")
+
+    def benchmark_sharded_ingest(self, distinct_songs=10_000_000, batches=100, batch_size=100_000, k=100,
+                                 shard_counts=(1, 2, 4, 8)):
+        plays = batches * batch_size
+        stream = generate_batches(distinct_songs, batches, batch_size)
+
+        ranker = AlgoFy(k)
+        start = time.perf_counter()
+        for batch in stream:
+            ranker.stream_songs(batch)
+        ranker.get_top_k()
+        self.print_benchmark_result("single process ingest", plays / (time.perf_counter() - start), "plays/s")
+
+        for shards in shard_counts:
+            with ShardedAlgoFy(k, shards) as sharded_ranker:
+                start = time.perf_counter()
+                for batch in stream:
+                    sharded_ranker.stream_songs(batch)
+                # the read waits until every shard has ingested all batches
+                sharded_ranker.get_top_k()
+                self.print_benchmark_result(f"{shards} shards coordinator ingest",
+                                            plays / (time.perf_counter() - start), "plays/s")
+
+            # one producer process per shard, each counting and splitting its share of the batches
+            with ShardedAlgoFy(k, shards) as sharded_ranker:
+                start = time.perf_counter()
+                producers = [multiprocessing.Process(target=run_algo_fy_producer,
+                                                     args=(sharded_ranker.producer(), stream[first::shards]))
+                             for first in range(shards)]
+                for producer in producers:
+                    producer.start()
+                for producer in producers:
+                    producer.join()
+                sharded_ranker.get_top_k()
+                self.print_benchmark_result(f"{shards} shards {shards} producers ingest",
+                                            plays / (time.perf_counter() - start), "plays/s")
+
+    def benchmark_async_ingest(self, distinct_songs=100_000, batches=2_000, batch_size=1_000, k=100):
+        plays = batches * batch_size
+        stream = generate_batches(distinct_songs, batches, batch_size)
+
+        async def synchronous_handler():
+            # today's behaviour: the network handler calls stream_songs directly
+            ranker = AlgoFy(k)
+            done = asyncio.Event()
+            latencies = []
+            reader = asyncio.create_task(measure_read_latency(ranker, done, latencies))
+            start = time.perf_counter()
+            async for batch in stand_in_producer(stream):
+                ranker.stream_songs(batch)
+            elapsed = time.perf_counter() - start
+            done.set()
+            await reader
+            return elapsed, latencies
+
+        async def async_pipeline():
+            async_ranker = AsyncAlgoFy(AlgoFy(k))
+            async_ranker.start()
+            done = asyncio.Event()
+            latencies = []
+            reader = asyncio.create_task(measure_read_latency(async_ranker, done, latencies))
+            start = time.perf_counter()
+            await async_ranker.consume(stand_in_producer(stream))
+            await async_ranker.stop()
+            elapsed = time.perf_counter() - start
+            done.set()
+            await reader
+            return elapsed, latencies
+
+        for label, pipeline in [("synchronous handler", synchronous_handler), ("AsyncAlgoFy", async_pipeline)]:
+            elapsed, latencies = asyncio.run(pipeline())
+            self.print_benchmark_result(f"{label} ingest", plays / elapsed, "plays/s")
+            self.print_benchmark_result(f"{label} read latency p50", percentile(latencies, 0.5) * 1e3, "ms")
+            self.print_benchmark_result(f"{label} read latency p99", percentile(latencies, 0.99) * 1e3, "ms")
+
+    def benchmark_top_k_cache(self, distinct_songs=1_000_000, batches=200, batch_size=10_000, k=100,
+                              reads_per_batch=50):
+        # readers poll far more often than batches arrive
+        stream = generate_zipf_batches(distinct_songs, batches, batch_size)
+        ranker = AlgoFy(k)
+        read_time = 0
+        for batch in stream:
+            ranker.stream_songs(batch)
+            start = time.perf_counter()
+            for _ in range(reads_per_batch):
+                ranker.get_top_k()
+            read_time += time.perf_counter() - start
+        reads = batches * reads_per_batch
+        self.print_benchmark_result("cached get_top_k", read_time / reads * 1e6, "us/read")
+        self.print_benchmark_result("cache hit rate", ranker.get_cache_hit_rate() * 100, "%")
+        self.print_benchmark_result("batches that invalidated the cache", ranker.cache_invalidations, "batches")
+
+        # the same reads with the cache dropped before every read
+        start = time.perf_counter()
+        for _ in range(reads_per_batch):
+            ranker.invalidate_top_k()
+            ranker.get_top_k()
+        self.print_benchmark_result("uncached get_top_k", (time.perf_counter() - start) / reads_per_batch * 1e6,
+                                    "us/read")
+
+    def benchmark_dense_backend(self, distinct_songs=1_000_000, batches=20, batch_size=500_000, k=100,
+                                read_batches=5):
+        stream = [list(range(distinct_songs))] + generate_batches(distinct_songs, batches, batch_size)
+        plays = distinct_songs + batches * batch_size
+        for label, dense in [("buckets", False), ("dense array", True)]:
+            start = time.perf_counter()
+            ranker = AlgoFy(k, dense=dense)
+            for batch in stream:
+                ranker.stream_songs(batch)
+            self.print_benchmark_result(f"{label} ingest", plays / (time.perf_counter() - start), "plays/s")
+
+            start = time.perf_counter()
+            ranker.invalidate_top_k()
+            ranker.get_top_k()
+            self.print_benchmark_result(f"{label} uncached get_top_k", (time.perf_counter() - start) * 1e3, "ms")
+
+            # the usual read: a batch arrives and the top k is read without the AlgoFy cache
+            read_time = 0
+            for batch in stream[1:read_batches + 1]:
+                ranker.stream_songs(batch)
+                start = time.perf_counter()
+                ranker.invalidate_top_k()
+                ranker.get_top_k()
+                read_time += time.perf_counter() - start
+            self.print_benchmark_result(f"{label} uncached get_top_k after a batch", read_time / read_batches * 1e3,
+                                        "ms")
+            del ranker
+
+            # the same ingest traced separately, since tracing slows every allocation down. The memory still held
+            # by the ranker afterwards is scaled to a million tracked songs
+            tracemalloc.start()
+            ranker = AlgoFy(k, dense=dense)
+            for batch in stream:
+                ranker.stream_songs(batch)
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            self.print_benchmark_result(f"{label} memory", memory / len(ranker.song_streams) * 1e6 / 2 ** 20,
+                                        "MiB/million songs")
+            del ranker
+
+    def benchmark_checkpoint_restore(self, distinct_songs=10_000_000, batches=50, batch_size=200_000, k=100):
+        stream = [list(range(distinct_songs))] + generate_batches(distinct_songs, batches, batch_size)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "algo_fy.checkpoint")
+            for label, dense in [("buckets", False), ("dense array", True)]:
+                # a restart without checkpoints replays every batch of the day
+                start = time.perf_counter()
+                ranker = AlgoFy(k, dense=dense)
+                for batch in stream:
+                    ranker.stream_songs(batch)
+                self.print_benchmark_result(f"{label} replay all batches", time.perf_counter() - start, "s")
+
+                # ingestion only pauses while the counts are copied, the file is written in the background
+                start = time.perf_counter()
+                thread = ranker.save_checkpoint(path, wait=False)
+                self.print_benchmark_result(f"{label} checkpoint ingest pause", (time.perf_counter() - start) * 1e3,
+                                            "ms")
+                thread.join()
+                self.print_benchmark_result(f"{label} checkpoint write", time.perf_counter() - start, "s")
+                self.print_benchmark_result(f"{label} checkpoint size", os.path.getsize(path) / 2 ** 20, "MiB")
+                del ranker
+
+                start = time.perf_counter()
+                restored = AlgoFy.load_checkpoint(path)
+                restored.get_top_k()
+                self.print_benchmark_result(f"{label} restore to first answer", time.perf_counter() - start, "s")
+                del restored
+
+    def benchmark_segment_top_k(self, distinct_songs=100_000, batches=5, batch_size=100_000, k=100,
+                                segment_counts=(1, 50, 500)):
+        for segments in segment_counts:
+            rng = random.Random(segments)
+            stream = [[(songId, rng.randrange(segments)) for songId in batch]
+                      for batch in generate_batches(distinct_songs, batches, batch_size)]
+
+            # today: a global AlgoFy and one AlgoFy per segment, every segment filtering its plays out of each batch
+            start = time.perf_counter()
+            global_ranker = AlgoFy(k)
+            segment_rankers = [AlgoFy(k) for _ in range(segments)]
+            for batch in stream:
+                global_ranker.stream_songs([songId for songId, segment in batch])
+                for segment, ranker in enumerate(segment_rankers):
+                    ranker.stream_songs([songId for songId, play_segment in batch if play_segment == segment])
+            elapsed = time.perf_counter() - start
+            self.print_benchmark_result(f"{segments} segments one AlgoFy per segment",
+                                        batches * batch_size / elapsed, "plays/s")
+
+            start = time.perf_counter()
+            ranker = AlgoFy(k)
+            for batch in stream:
+                ranker.stream_songs(batch)
+            elapsed = time.perf_counter() - start
+            self.print_benchmark_result(f"{segments} segments single ingest pass", batches * batch_size / elapsed,
+                                        "plays/s")
+
+            start = time.perf_counter()
+            for segment in range(segments):
+                ranker.get_top_k(segment)
+            self.print_benchmark_result(f"{segments} segments get_top_k per segment",
+                                        (time.perf_counter() - start) / segments * 1e3, "ms")
+
+
+if __name__ == '__main__':
+    benchmark_runner = BenchmarkAlgoFy()
+    benchmark_runner.run_benchmarks(sys.argv[1:])
@@ -1,5 +1,9 @@
 import heapq
 import math
+import multiprocessing
+import random
+from array import array
+from collections import Counter, OrderedDict
 
 """
  You are working for a promising new “flight hacking” startup “AlgoJet”.
@@ -50,6 +54,70 @@ import math
  This time complexity is therefore O(n + nlogm) where n is the number of flights and m is the number of 
  potential cities visited. This simplifies to O(nlogm).
  --------------------
+
+ Compact graph
+ --------------------
+ initialize_flight_graph(flights, compact=True) interns every city name to an integer id and stores the cheapest
+ flight of every route in compressed sparse rows: the flights leaving city i are targets[offsets[i]:offsets[i + 1]]
+ with their prices at the same positions, all in typed arrays. Building it keeps the cheapest flight per route in
+ O(f) time, sorts the r routes by source city in O(r log r) time and counts the rows in O(r + n) time.
+ Every load merges its flights with the flights loaded before, like the dictionary graph, and loading into the other
+ graph moves the loaded routes over.
+ The search keeps one distance array and one epoch stamp array for all queries. A query increments the epoch, and a
+ distance only counts when its stamp equals the current epoch, so resetting the distances is O(1) instead of the O(n)
+ prices dictionary. The search itself has the same O(n log m) running time as above, without allocating per city.
+ --------------------
+
+ Bidirectional and landmark searches
+ --------------------
+ initialize_flight_graph also builds the reverse graph in O(f) time. get_cheapest_flight(source, destination,
+ "bidirectional") runs one Dijkstra forward from the source and one backward from the destination over the reverse
+ graph, always expanding the side with the smaller queue. Every flight relaxed towards a city the other side has
+ reached gives a candidate price, and the search stops once the two smallest queue keys add up to at least the best
+ candidate, since any cheaper path would have to pass through a city still queued on both sides. Both searches cover
+ roughly a ball of half the price around their end, far fewer cities than one ball of the full price.
+
+ initialize_flight_graph(flights, landmarks=L) also picks L landmark cities, each the city farthest from the landmarks
+ already picked, and stores the cheapest price from and to every city for each of them, 2L Dijkstra runs of
+ O(f log n) time. By the triangle inequality, price(v, t) >= price(l, t) - price(l, v) and price(v, t) >= price(v, l) -
+ price(t, l) for every landmark l, so the largest of these bounds is a consistent lower bound. get_cheapest_flight(
+ source, destination, "alt") runs A* with it, which settles cities in order of price so far plus bound, in O(L) time
+ per city on top of Dijkstra, and settles only the cities that the bound cannot rule out.
+ settled_cities counts the cities settled by the last query of any search, for comparing them.
+ --------------------
+
+ Contraction hierarchy
+ --------------------
+ build_contraction_hierarchy contracts the cities one at a time in order of importance (the shortcuts a contraction
+ adds minus the flights it removes, plus the neighbours already contracted). Contracting a city runs one witness
+ Dijkstra of at most witness_limit settled cities per incoming flight and adds a shortcut u -> w for every flight pair
+ u -> city -> w without a path avoiding the city that is at least as cheap. Importances change as neighbours are
+ contracted and are updated lazily when a city comes up in the queue. Each city keeps its flights and shortcuts to
+ higher ranked cities in the upward and downward graphs.
+ get_cheapest_flight(source, destination, "hierarchy") searches up from both ends and never down, since every
+ cheapest path can be replaced by one that goes up to its highest ranked city and down again with the same price. On
+ road like networks the two upward searches settle a few hundred cities instead of most of the graph, at the same
+ O(n log m) per settled city as Dijkstra.
+ --------------------
+
+ Fare tables
+ --------------------
+ get_cheapest_flights_from(source) runs Dijkstra without stopping at a destination and returns the cheapest price to
+ every reachable city, O(n log m) for all of them instead of for each one. build_fare_table(sources, processes) runs
+ these single source searches for many source cities in a process pool, where every worker receives the graph once,
+ and keeps every table until the next initialize_flight_graph, so repeated sources cost a dictionary lookup.
+ --------------------
+
+ Query cache
+ --------------------
+ AlgoJet(cache_size, hot_source_cache_size) keeps the last cache_size answers in an LRU cache (an OrderedDict moved to
+ the end on every hit and evicted from the front), so a repeated query is O(1). A source asked hot_source_queries times
+ gets its complete fare table computed once and kept in a second LRU cache of hot_source_cache_size sources, after
+ which every destination from it is O(1) as well. graph_version is incremented by every initialize_flight_graph and
+ update_flight, and the caches are dropped on the first query that sees a new version. update_flight changes one
+ route in O(1) time on the dictionary graph (and on an existing compact route), a new or removed compact route
+ rebuilds the rows in O(r + n) time.
+ --------------------
  
  """
 
@@ -61,11 +129,113 @@ class Flight:
         self.price = price
 
 
+def get_cheapest_prices(graph, source):
+    # a complete Dijkstra over a dictionary graph: the cheapest price from the source to every reachable city
+    prices = {source: 0}
+    settled = {}
+    pq = [(0, source)]
+    while pq:
+        curr_cost, curr_city = heapq.heappop(pq)
+        if curr_city in settled:
+            continue
+        settled[curr_city] = curr_cost
+        for next_city, price in graph[curr_city].items():
+            cost = curr_cost + price
+            if cost < prices.get(next_city, math.inf):
+                prices[next_city] = cost
+                heapq.heappush(pq, (cost, next_city))
+    return settled
+
+
+worker_algo_jet = None
+
+
+def initialize_fare_worker(graph, compact_graph):
+    # pool initializer, every worker rebuilds an AlgoJet around the graph it received once
+    global worker_algo_jet
+    worker_algo_jet = AlgoJet()
+    worker_algo_jet.graph = graph
+    if compact_graph is not None:
+        worker_algo_jet.compact = True
+        worker_algo_jet.cities, worker_algo_jet.offsets, worker_algo_jet.targets, worker_algo_jet.prices = compact_graph
+        worker_algo_jet.city_ids = {city: city_id for city_id, city in enumerate(worker_algo_jet.cities)}
+        city_count = len(worker_algo_jet.cities)
+        worker_algo_jet.distances = array(worker_algo_jet.prices.typecode, bytes(8 * city_count))
+        worker_algo_jet.stamps = array("q", bytes(8 * city_count))
+
+
+def get_worker_fares(source):
+    return source, worker_algo_jet.get_cheapest_flights_from(source)
+
+
 class AlgoJet:
-    def __init__(self):
+    def __init__(self, cache_size=0, hot_source_cache_size=0, hot_source_queries=3):
         self.graph = {}  # Recommended graph is {city: {destination : best_price}}
+        # incremented whenever the flights change, cached answers of an older version are dropped
+        self.graph_version = 0
+        # LRU caches of (source, destination) -> price and of hot source -> price to every reachable city. A source
+        # becomes hot once it has been asked hot_source_queries times. Both caches are disabled with a size of 0
+        self.cache_size = cache_size
+        self.hot_source_cache_size = hot_source_cache_size
+        self.hot_source_queries = hot_source_queries
+        self.price_cache = OrderedDict()
+        self.hot_source_cache = OrderedDict()
+        self.source_queries = Counter()
+        self.cache_version = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        # the flights of the graph reversed, {city: {source: best_price}}, searched backwards from the destination
+        self.reverse_graph = {}
+        # landmark city -> cheapest prices from it to every city, and from every city to it (ALT lower bounds)
+        self.landmark_prices_from = {}
+        self.landmark_prices_to = {}
+        # contraction hierarchy: the rank of every city in the contraction order, and for every city its flights and
+        # shortcuts to higher ranked cities, forward {city: {destination: price}} and backward {city: {source: price}}
+        self.hierarchy_ranks = {}
+        self.upward_graph = {}
+        self.downward_graph = {}
+        # source city -> cheapest price to every reachable city, kept until the next initialize_flight_graph
+        self.fare_tables = {}
+        # number of cities settled by the last query
+        self.settled_cities = 0
+        # compact graph: city name <-> integer id, and the routes in compressed sparse rows (see build_compact_graph)
+        self.compact = False
+        self.city_ids = {}
+        self.cities = []
+        self.offsets = array("q")
+        self.targets = array("q")
+        self.prices = array("q")
+        # search state reused by every compact query: a distance only counts when its stamp is the current epoch
+        self.distances = array("q")
+        self.stamps = array("q")
+        self.epoch = 0
+
+    def initialize_flight_graph(self, flights: list[Flight], compact=False, landmarks=0):
+        # fare tables and cached answers of the previous flights would show outdated prices
+        self.graph_version += 1
+        self.fare_tables = {}
+        # the compact graph replaces the dictionary graph, which is never built for it. Like the dictionary graph it
+        # merges the flights with the ones loaded before, whichever graph they were loaded into
+        if compact:
+            if landmarks:
+                raise ValueError("Landmarks are only supported on the dictionary graph")
+            self.build_compact_graph(flights)
+            self.graph = {}
+            self.reverse_graph = {}
+            self.hierarchy_ranks = {}
+            self.upward_graph = {}
+            self.downward_graph = {}
+            return
+
+        # flights loaded into the compact graph before move back into the dictionary graph, and the compact arrays
+        # are dropped so no query reads them any more
+        if self.compact:
+            self.graph = {city: {} for city in self.cities}
+            for source, destination, price in self.get_compact_routes():
+                self.graph[source][destination] = price
+            self.reset_compact_graph()
 
-    def initialize_flight_graph(self, flights: list[Flight]):
         for flight in flights:
 
             # if the source is not currently in the graph, then initialize an empty value for dictionary for future
@@ -86,10 +256,516 @@ class AlgoJet:
             if flight.destination not in self.graph:
                 self.graph[flight.destination] = {}
 
-    def get_cheapest_flight(self, source, destination):
+        self.build_reverse_graph()
+        self.build_landmarks(landmarks)
+        # a hierarchy of the previous flights would answer with outdated prices
+        self.hierarchy_ranks = {}
+        self.upward_graph = {}
+        self.downward_graph = {}
+
+    def update_flight(self, source, destination, price=None):
+        # set the price of the route from source to destination, replacing the cheapest price loaded so far so it
+        # can also go up, or remove the route with a price of None. The graph version moves on, so cached answers
+        # and fare tables of the old prices are dropped on the next query
+        self.graph_version += 1
+        self.fare_tables = {}
+        if self.compact:
+            self.update_compact_flight(source, destination, price)
+            return
+        self.update_graph_flight(self.graph, source, destination, price)
+        self.update_graph_flight(self.reverse_graph, destination, source, price)
+        # landmark bounds and shortcuts of the old prices could give wrong answers, build_landmarks and
+        # build_contraction_hierarchy have to run again
+        self.landmark_prices_from = {}
+        self.landmark_prices_to = {}
+        self.hierarchy_ranks = {}
+        self.upward_graph = {}
+        self.downward_graph = {}
+
+    def update_graph_flight(self, graph, source, destination, price):
+        if price is None:
+            graph.get(source, {}).pop(destination, None)
+            return
+        graph.setdefault(source, {})[destination] = price
+        graph.setdefault(destination, {})
+
+    def update_compact_flight(self, source, destination, price):
+        # a route that already exists gets its new price in place, if the price fits the typed price array
+        source_id = self.city_ids.get(source)
+        destination_id = self.city_ids.get(destination)
+        if source_id is not None and destination_id is not None and price is not None:
+            for edge in range(self.offsets[source_id], self.offsets[source_id + 1]):
+                if self.targets[edge] == destination_id:
+                    if self.prices.typecode == "d" or type(price) is int:
+                        self.prices[edge] = price
+                        return
+                    break
+
+        # a new or removed route changes the rows, so the compact graph is rebuilt from its routes in O(r + n) time
+        self.graph = {city: {} for city in self.cities}
+        for route_source, route_destination, route_price in self.get_compact_routes():
+            self.graph[route_source][route_destination] = route_price
+        self.update_graph_flight(self.graph, source, destination, price)
+        self.reset_compact_graph()
+        self.build_compact_graph([])
+        self.graph = {}
+
+    def has_city(self, city):
+        return city in self.city_ids if self.compact else city in self.graph
+
+    def build_reverse_graph(self):
+        # rebuilt from the whole graph, since initialize_flight_graph can be called again with more flights
+        self.reverse_graph = {city: {} for city in self.graph}
+        for city, destinations in self.graph.items():
+            for destination, price in destinations.items():
+                self.reverse_graph[destination][city] = price
+
+    def build_landmarks(self, landmarks):
+        # pick every landmark as the city farthest from the landmarks already picked (unreachable cities are not
+        # candidates), starting from the city with the most flights
+        self.landmark_prices_from = {}
+        self.landmark_prices_to = {}
+        if not landmarks or not self.graph:
+            return
+        landmark = max(self.graph, key=lambda city: len(self.graph[city]))
+        nearest_landmark_prices = {}
+        while landmark is not None and len(self.landmark_prices_from) < landmarks:
+            prices_from = get_cheapest_prices(self.graph, landmark)
+            self.landmark_prices_from[landmark] = prices_from
+            self.landmark_prices_to[landmark] = get_cheapest_prices(self.reverse_graph, landmark)
+            for city, price in prices_from.items():
+                if price < nearest_landmark_prices.get(city, math.inf):
+                    nearest_landmark_prices[city] = price
+            landmark = None
+            farthest_price = 0
+            for city, price in nearest_landmark_prices.items():
+                if price > farthest_price and city not in self.landmark_prices_from:
+                    landmark, farthest_price = city, price
+
+    def get_landmark_bound(self, city, destination):
+        # lower bound on the price from city to destination by the triangle inequality over every landmark, or
+        # infinity when a landmark proves the destination cannot be reached from the city
+        bound = 0
+        for landmark, prices_from in self.landmark_prices_from.items():
+            # price(l, t) <= price(l, v) + price(v, t)
+            landmark_to_destination = prices_from.get(destination)
+            landmark_to_city = prices_from.get(city)
+            if landmark_to_city is not None:
+                if landmark_to_destination is None:
+                    return math.inf
+                bound = max(bound, landmark_to_destination - landmark_to_city)
+            # price(v, l) <= price(v, t) + price(t, l)
+            prices_to = self.landmark_prices_to[landmark]
+            city_to_landmark = prices_to.get(city)
+            destination_to_landmark = prices_to.get(destination)
+            if destination_to_landmark is not None:
+                if city_to_landmark is None:
+                    return math.inf
+                bound = max(bound, city_to_landmark - destination_to_landmark)
+        return bound
+
+    def reset_compact_graph(self):
+        self.compact = False
+        self.city_ids = {}
+        self.cities = []
+        self.offsets = array("q")
+        self.targets = array("q")
+        self.prices = array("q")
+        self.distances = array("q")
+        self.stamps = array("q")
+        self.epoch = 0
+
+    def get_compact_routes(self):
+        # every route of the compact graph as (source, destination, price) with city names
+        cities, offsets, targets, prices = self.cities, self.offsets, self.targets, self.prices
+        for source_id, source in enumerate(cities):
+            for edge in range(offsets[source_id], offsets[source_id + 1]):
+                yield source, cities[targets[edge]], prices[edge]
+
+    def build_compact_graph(self, flights):
+        # the routes loaded before (into the compact or the dictionary graph) are merged with the new flights
+        if self.compact:
+            loaded_cities = self.cities
+            loaded_routes = list(self.get_compact_routes())
+        else:
+            loaded_cities = list(self.graph)
+            loaded_routes = [(source, destination, price) for source, destinations in self.graph.items()
+                             for destination, price in destinations.items()]
+        self.compact = True
+        # intern the city names in order of first appearance, setdefault hands every new city the next id
+        city_ids = dict(zip(loaded_cities, range(len(loaded_cities))))
+        sources = [city_ids.setdefault(flight.source, len(city_ids)) for flight in flights]
+        destinations = [city_ids.setdefault(flight.destination, len(city_ids)) for flight in flights]
+        self.city_ids = city_ids
+        self.cities = list(city_ids)
+        city_count = len(city_ids)
+
+        # keep the cheapest flight per route. A route is keyed by one integer, source * city_count + destination, so
+        # sorting the keys orders the routes by source city and then by destination
+        routes = {city_ids[source] * city_count + city_ids[destination]: price
+                  for source, destination, price in loaded_routes}
+        for source, destination, flight in zip(sources, destinations, flights):
+            route = source * city_count + destination
+            if flight.price < routes.get(route, math.inf):
+                routes[route] = flight.price
+        route_keys = sorted(routes)
+        # integer prices are stored as 64-bit integers so the answers stay integers, anything else as doubles
+        route_prices = [routes[route] for route in route_keys]
+        typecode = "q" if all(type(price) is int for price in route_prices) else "d"
+
+        # count the routes leaving every city, the running total is the offset of every city's row
+        self.offsets = array("q", bytes(8 * (city_count + 1)))
+        for route in route_keys:
+            self.offsets[route // city_count + 1] += 1
+        for city in range(city_count):
+            self.offsets[city + 1] += self.offsets[city]
+        self.targets = array("q", [route % city_count for route in route_keys])
+        self.prices = array(typecode, route_prices)
+
+        self.distances = array(typecode, bytes(8 * city_count))
+        self.stamps = array("q", bytes(8 * city_count))
+        self.epoch = 0
+
+    def get_cheapest_compact_flight(self, source, destination):
+        source_id = self.city_ids[source]
+        destination_id = self.city_ids[destination]
+        # a new epoch makes every distance of the previous query stale without touching the arrays
+        self.epoch += 1
+        epoch = self.epoch
+        stamps, distances = self.stamps, self.distances
+        offsets, targets, prices = self.offsets, self.targets, self.prices
+        stamps[source_id] = epoch
+        distances[source_id] = 0
+        pq = [(0, source_id)]
+        self.settled_cities = 0
+        while pq:
+            curr_cost, curr_city = heapq.heappop(pq)
+            # skip queue entries of cities that were reached more cheaply after they were pushed
+            if curr_cost > distances[curr_city]:
+                continue
+            self.settled_cities += 1
+            if curr_city == destination_id:
+                return curr_cost
+            for edge in range(offsets[curr_city], offsets[curr_city + 1]):
+                next_city = targets[edge]
+                cost = curr_cost + prices[edge]
+                if stamps[next_city] != epoch or cost < distances[next_city]:
+                    stamps[next_city] = epoch
+                    distances[next_city] = cost
+                    heapq.heappush(pq, (cost, next_city))
+        return -1
+
+    def find_shortcuts(self, city, out_flights, in_flights, witness_limit):
+        # the shortcuts needed to contract city: for every flight u -> city -> w, a shortcut u -> w unless a witness
+        # search from u that avoids city finds a path to w that is at least as cheap. The witness search settles at
+        # most witness_limit cities, stopping early only adds shortcuts that were not needed
+        outgoing = out_flights[city]
+        if not outgoing:
+            return []
+        max_price = max(outgoing.values())
+        shortcuts = []
+        for source, source_price in in_flights[city].items():
+            limit = source_price + max_price
+            prices = {source: 0}
+            settled = set()
+            pq = [(0, source)]
+            while pq and len(settled) < witness_limit:
+                curr_cost, curr_city = heapq.heappop(pq)
+                if curr_cost > limit:
+                    break
+                if curr_city in settled:
+                    continue
+                settled.add(curr_city)
+                for next_city, price in out_flights[curr_city].items():
+                    cost = curr_cost + price
+                    if next_city != city and cost < prices.get(next_city, math.inf):
+                        prices[next_city] = cost
+                        heapq.heappush(pq, (cost, next_city))
+            for destination, price in outgoing.items():
+                if destination != source and prices.get(destination, math.inf) > source_price + price:
+                    shortcuts.append((source, destination, source_price + price))
+        return shortcuts
+
+    def build_contraction_hierarchy(self, witness_limit=50):
+        # contract the cities one by one, least important first, replacing every cheapest path through a contracted
+        # city by a shortcut between its remaining neighbours. out_flights and in_flights hold the flights and
+        # shortcuts between the cities that are not contracted yet
+        out_flights = {city: {destination: price for destination, price in destinations.items() if destination != city}
+                       for city, destinations in self.graph.items()}
+        in_flights = {city: {source: price for source, price in sources.items() if source != city}
+                      for city, sources in self.reverse_graph.items()}
+        contracted_neighbors = dict.fromkeys(self.graph, 0)
+        self.hierarchy_ranks = {}
+        self.upward_graph = {}
+        self.downward_graph = {}
+
+        def importance(city, shortcuts):
+            # edge difference plus the number of contracted neighbours, which spreads the contraction over the map
+            return (len(shortcuts) - len(in_flights[city]) - len(out_flights[city]) + contracted_neighbors[city],
+                    city)
+
+        pq = []
+        for city in self.graph:
+            pq.append(importance(city, self.find_shortcuts(city, out_flights, in_flights, witness_limit)))
+        heapq.heapify(pq)
+        while pq:
+            # the importance of a city changes as its neighbours are contracted, so it is recomputed when the city
+            # comes up (lazy updates) and the city goes back into the queue if another city is now less important
+            curr_city = heapq.heappop(pq)[1]
+            shortcuts = self.find_shortcuts(curr_city, out_flights, in_flights, witness_limit)
+            priority = importance(curr_city, shortcuts)
+            if pq and priority > pq[0]:
+                heapq.heappush(pq, priority)
+                continue
+
+            # every remaining flight of the city leads to or comes from a higher ranked city
+            self.hierarchy_ranks[curr_city] = len(self.hierarchy_ranks)
+            self.upward_graph[curr_city] = out_flights.pop(curr_city)
+            self.downward_graph[curr_city] = in_flights.pop(curr_city)
+            for destination in self.upward_graph[curr_city]:
+                del in_flights[destination][curr_city]
+                contracted_neighbors[destination] += 1
+            for source in self.downward_graph[curr_city]:
+                del out_flights[source][curr_city]
+                contracted_neighbors[source] += 1
+            for source, destination, price in shortcuts:
+                if price < out_flights[source].get(destination, math.inf):
+                    out_flights[source][destination] = price
+                    in_flights[destination][source] = price
+
+    def get_cheapest_hierarchy_flight(self, source, destination):
+        # bidirectional Dijkstra that only follows flights and shortcuts to higher ranked cities: forward from the
+        # source over the upward graph and backward from the destination over the downward graph. The cheapest path
+        # goes up to its highest ranked city and down again, so both searches settle that city. A side stops once
+        # its smallest queue key reaches the best price found
+        forward_prices, backward_prices = {source: 0}, {destination: 0}
+        forward_pq, backward_pq = [(0, source)], [(0, destination)]
+        best = math.inf
+        self.settled_cities = 0
+        while True:
+            forward_open = forward_pq and forward_pq[0][0] < best
+            backward_open = backward_pq and backward_pq[0][0] < best
+            if not forward_open and not backward_open:
+                break
+            if forward_open and (not backward_open or forward_pq[0][0] <= backward_pq[0][0]):
+                graph, pq, prices, other_prices = self.upward_graph, forward_pq, forward_prices, backward_prices
+            else:
+                graph, pq, prices, other_prices = self.downward_graph, backward_pq, backward_prices, forward_prices
+            curr_cost, curr_city = heapq.heappop(pq)
+            if curr_cost > prices[curr_city]:
+                continue
+            self.settled_cities += 1
+            if curr_city in other_prices and curr_cost + other_prices[curr_city] < best:
+                best = curr_cost + other_prices[curr_city]
+            for next_city, price in graph[curr_city].items():
+                cost = curr_cost + price
+                if cost < prices.get(next_city, math.inf):
+                    prices[next_city] = cost
+                    heapq.heappush(pq, (cost, next_city))
+        return -1 if best == math.inf else best
+
+    def get_cheapest_bidirectional_flight(self, source, destination):
+        # forward Dijkstra from the source over the graph and backward Dijkstra from the destination over the reverse
+        # graph. best is the cheapest complete path seen so far, found whenever a flight reaches a city the other
+        # side has already reached
+        forward_prices, backward_prices = {source: 0}, {destination: 0}
+        forward_settled, backward_settled = set(), set()
+        forward_pq, backward_pq = [(0, source)], [(0, destination)]
+        best = math.inf
+        while forward_pq and backward_pq:
+            # every path cheaper than best would still need a city queued on both sides
+            if forward_pq[0][0] + backward_pq[0][0] >= best:
+                break
+            # expand the side with fewer queued cities
+            if len(forward_pq) <= len(backward_pq):
+                graph, pq, prices, settled, other_prices = (self.graph, forward_pq, forward_prices, forward_settled,
+                                                            backward_prices)
+            else:
+                graph, pq, prices, settled, other_prices = (self.reverse_graph, backward_pq, backward_prices,
+                                                            backward_settled, forward_prices)
+            curr_cost, curr_city = heapq.heappop(pq)
+            if curr_city in settled:
+                continue
+            settled.add(curr_city)
+            for next_city, price in graph[curr_city].items():
+                cost = curr_cost + price
+                if cost < prices.get(next_city, math.inf):
+                    prices[next_city] = cost
+                    heapq.heappush(pq, (cost, next_city))
+                    if next_city in other_prices and cost + other_prices[next_city] < best:
+                        best = cost + other_prices[next_city]
+        self.settled_cities = len(forward_settled) + len(backward_settled)
+        return -1 if best == math.inf else best
+
+    def get_cheapest_landmark_flight(self, source, destination):
+        # A* with the landmark lower bound: cities are settled in order of the price so far plus the bound on the
+        # remaining price. The bound is consistent, so a city is final when it is settled, like in Dijkstra
+        prices = {source: 0}
+        settled = set()
+        bounds = {}
+        pq = [(self.get_landmark_bound(source, destination), 0, source)]
+        while pq:
+            estimate, curr_cost, curr_city = heapq.heappop(pq)
+            if curr_city in settled:
+                continue
+            settled.add(curr_city)
+            if curr_city == destination:
+                self.settled_cities = len(settled)
+                return curr_cost
+            for next_city, price in self.graph[curr_city].items():
+                cost = curr_cost + price
+                if cost < prices.get(next_city, math.inf):
+                    bound = bounds.get(next_city)
+                    if bound is None:
+                        bound = bounds[next_city] = self.get_landmark_bound(next_city, destination)
+                    # cities the landmarks prove cannot reach the destination are never queued
+                    if bound < math.inf:
+                        prices[next_city] = cost
+                        heapq.heappush(pq, (cost + bound, cost, next_city))
+        self.settled_cities = len(settled)
+        return -1
+
+    def get_cheapest_compact_flights_from(self, source):
+        # a complete Dijkstra over the compact graph, reusing the epoch stamped distances
+        source_id = self.city_ids[source]
+        self.epoch += 1
+        epoch = self.epoch
+        stamps, distances = self.stamps, self.distances
+        offsets, targets, prices, cities = self.offsets, self.targets, self.prices, self.cities
+        stamps[source_id] = epoch
+        distances[source_id] = 0
+        fares = {}
+        pq = [(0, source_id)]
+        while pq:
+            curr_cost, curr_city = heapq.heappop(pq)
+            if curr_cost > distances[curr_city]:
+                continue
+            fares[cities[curr_city]] = curr_cost
+            for edge in range(offsets[curr_city], offsets[curr_city + 1]):
+                next_city = targets[edge]
+                cost = curr_cost + prices[edge]
+                if stamps[next_city] != epoch or cost < distances[next_city]:
+                    stamps[next_city] = epoch
+                    distances[next_city] = cost
+                    heapq.heappush(pq, (cost, next_city))
+        return fares
+
+    def get_cheapest_flights_from(self, source):
+        # the cheapest price from the source to every reachable city (the source itself costs 0), from one complete
+        # search. Unreachable cities are left out. The result is a copy, so callers may change it
+        self.check_cache_version()
+        fares = self.fare_tables.get(source)
+        if fares is None:
+            if self.compact:
+                fares = self.get_cheapest_compact_flights_from(source)
+            else:
+                fares = get_cheapest_prices(self.graph, source)
+            self.settled_cities = len(fares)
+        return dict(fares)
+
+    def build_fare_table(self, sources, processes=None):
+        # fare tables of many source cities (for example every hub), computed in a process pool and kept until the
+        # next initialize_flight_graph. Returns {source: {destination: price}}, the tables themselves are the cached
+        # ones and must not be changed
+        self.check_cache_version()
+        sources = list(dict.fromkeys(sources))
+        missing = [source for source in sources if source not in self.fare_tables]
+        if len(missing) > 1 and processes != 1:
+            compact_graph = (self.cities, self.offsets, self.targets, self.prices) if self.compact else None
+            with multiprocessing.Pool(processes, initialize_fare_worker, (self.graph, compact_graph)) as pool:
+                self.fare_tables.update(pool.imap_unordered(get_worker_fares, missing))
+        else:
+            for source in missing:
+                self.fare_tables[source] = self.get_cheapest_flights_from(source)
+        return {source: self.fare_tables[source] for source in sources}
+
+    def check_cache_version(self):
+        if self.cache_version != self.graph_version:
+            self.price_cache.clear()
+            self.hot_source_cache.clear()
+            self.source_queries.clear()
+            self.fare_tables = {}
+            self.cache_version = self.graph_version
+
+    def cache_price(self, cache, key, value, size):
+        # insert as the most recently used entry and evict the least recently used ones beyond the size. An evicted
+        # hot source has to be asked hot_source_queries times again before its fares are recomputed, so a cache that
+        # is too small does not recompute complete fare tables on every query
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > size:
+            evicted_key, evicted_value = cache.popitem(last=False)
+            if cache is self.hot_source_cache:
+                del self.source_queries[evicted_key]
+            self.cache_evictions += 1
+
+    def get_fare(self, fares, destination):
+        # a fare table leaves out the unreachable cities, -1 like a search. A city that is not in the graph at all
+        # raises a KeyError, the same as the search does
+        price = fares.get(destination)
+        if price is None:
+            if not self.has_city(destination):
+                raise KeyError(destination)
+            return -1
+        return price
+
+    def get_cache_hit_rate(self):
+        queries = self.cache_hits + self.cache_misses
+        return self.cache_hits / queries if queries else 0.0
+
+    def get_cheapest_flight(self, source, destination, search="dijkstra"):
         # error handling if source is destination
         if source == destination:
+            self.settled_cities = 0
             return 0
+        if not self.cache_size and not self.hot_source_cache_size:
+            return self.search_cheapest_flight(source, destination, search)
+
+        self.check_cache_version()
+        key = (source, destination)
+        if key in self.price_cache:
+            self.price_cache.move_to_end(key)
+            self.cache_hits += 1
+            self.settled_cities = 0
+            return self.price_cache[key]
+        # the complete fare table of a hot source (or a fare table that was built anyway) answers every destination
+        fares = self.hot_source_cache.get(source)
+        if fares is not None:
+            self.hot_source_cache.move_to_end(source)
+        else:
+            fares = self.fare_tables.get(source)
+        if fares is not None:
+            self.cache_hits += 1
+            self.settled_cities = 0
+            return self.get_fare(fares, destination)
+
+        self.cache_misses += 1
+        self.source_queries[source] += 1
+        if self.hot_source_cache_size and self.source_queries[source] >= self.hot_source_queries:
+            fares = self.get_cheapest_flights_from(source)
+            self.cache_price(self.hot_source_cache, source, fares, self.hot_source_cache_size)
+            price = self.get_fare(fares, destination)
+        else:
+            price = self.search_cheapest_flight(source, destination, search)
+        if self.cache_size:
+            self.cache_price(self.price_cache, key, price, self.cache_size)
+        return price
+
+    def search_cheapest_flight(self, source, destination, search):
+        if self.compact:
+            if search != "dijkstra":
+                raise ValueError("The compact graph only supports the dijkstra search")
+            return self.get_cheapest_compact_flight(source, destination)
+        if search == "bidirectional":
+            return self.get_cheapest_bidirectional_flight(source, destination)
+        if search == "alt":
+            return self.get_cheapest_landmark_flight(source, destination)
+        if search == "hierarchy":
+            if len(self.hierarchy_ranks) != len(self.graph):
+                raise ValueError("build_contraction_hierarchy must run before hierarchy searches")
+            return self.get_cheapest_hierarchy_flight(source, destination)
+        if search != "dijkstra":
+            raise ValueError(f"Unknown search {search}")
 
         # Initialize price to each city as infinity
         prices = {city: math.inf for city in self.graph.keys()}
@@ -97,11 +773,17 @@ class AlgoJet:
         prices[source] = 0
         # Initialize a priority queue with key 0 (price to city) and source (city to process)
         pq = [(0, source)]
+        self.settled_cities = 0
         # while the priority queue is not empty, continue analyzing the price to the current city
         while pq:
             # pop the current cost of travel and the new city from the queue
             curr_cost, curr_city = heapq.heappop(pq)
 
+            # skip queue entries of cities that were reached more cheaply after they were pushed
+            if curr_cost > prices[curr_city]:
+                continue
+            self.settled_cities += 1
+
             # if we reach the destination, then break out of the while loop
             if curr_city == destination:
                 break
@@ -135,7 +817,18 @@ class TestAlgoFlights:
         self.test_same_source_and_destination()
         self.test_cycle()
         self.test_multiple_flights()
-
+        self.test_compact_graph()
+        self.test_compact_matches_dict_graph()
+        self.test_compact_graph_reloads()
+        self.test_bidirectional_and_landmark_searches()
+        self.test_searches_match_dijkstra()
+        self.test_contraction_hierarchy()
+        self.test_hierarchy_matches_dijkstra()
+        self.test_cheapest_flights_from()
+        self.test_fare_table()
+        self.test_query_cache()
+        self.test_query_cache_invalidation()
+        self.test_unknown_destination()
 
     def print_test_result(self, test_name, result):
         color = "\033[92m" if result else "\033[91m"
@@ -233,6 +926,262 @@ class TestAlgoFlights:
         result = algo_jet.get_cheapest_flight("A", "E")
         self.test_answer("test_multiple_flights", result, 350)
 
+    def test_compact_graph(self):
+        algo_jet = AlgoJet()
+        flights = [
+            Flight("A", "B", 200),
+            Flight("B", "C", 150),
+            Flight("A", "C", 140),
+            Flight("A", "C", 180),
+            Flight("A", "B", 100),
+            Flight("B", "E", 300),
+            Flight("B", "E", 250),
+            Flight("C", "E", 220),
+            Flight("D", "A", 10),
+        ]
+
+        algo_jet.initialize_flight_graph(flights, compact=True)
+
+        result = [algo_jet.get_cheapest_flight("A", "E"), algo_jet.get_cheapest_flight("A", "D"),
+                  algo_jet.get_cheapest_flight("D", "E"), algo_jet.get_cheapest_flight("E", "E"), algo_jet.graph,
+                  len(algo_jet.targets)]
+        self.test_answer("test_compact_graph", result, [350, -1, 360, 0, {}, 6])
+
+    def test_compact_matches_dict_graph(self):
+        rng = random.Random(526)
+        result = []
+        expected_answer = []
+        for price in [lambda: rng.randint(1, 500), lambda: round(rng.uniform(1, 500), 2)]:
+            flights = [Flight(f"C{rng.randrange(60)}", f"C{rng.randrange(60)}", price()) for _ in range(300)]
+            algo_jet = AlgoJet()
+            algo_jet.initialize_flight_graph(flights)
+            compact_algo_jet = AlgoJet()
+            compact_algo_jet.initialize_flight_graph(flights, compact=True)
+            for _ in range(200):
+                source, destination = rng.choice(flights).source, rng.choice(flights).destination
+                result.append(compact_algo_jet.get_cheapest_flight(source, destination))
+                expected_answer.append(algo_jet.get_cheapest_flight(source, destination))
+
+        self.test_answer("test_compact_matches_dict_graph", result, expected_answer)
+
+    def test_compact_graph_reloads(self):
+        result = []
+        # loads of either graph merge with the flights loaded before, the same as two dictionary loads
+        for first_compact, second_compact in [(False, False), (True, True), (False, True), (True, False)]:
+            algo_jet = AlgoJet()
+            algo_jet.initialize_flight_graph([Flight("A", "B", 100), Flight("A", "C", 300)], first_compact)
+            algo_jet.initialize_flight_graph([Flight("B", "C", 100), Flight("C", "D", 50)], second_compact)
+            result.append([algo_jet.compact, algo_jet.get_cheapest_flight("A", "C"),
+                           algo_jet.get_cheapest_flight("A", "D"), algo_jet.get_cheapest_flight("D", "A")])
+        # a dictionary load drops the compact arrays
+        result.append([len(algo_jet.cities), len(algo_jet.targets), sorted(algo_jet.graph["A"].items())])
+        expected_answer = [[False, 200, 250, -1], [True, 200, 250, -1], [True, 200, 250, -1], [False, 200, 250, -1],
+                           [0, 0, [("B", 100), ("C", 300)]]]
+
+        self.test_answer("test_compact_graph_reloads", result, expected_answer)
+
+    def test_bidirectional_and_landmark_searches(self):
+        algo_jet = AlgoJet()
+        flights = [
+            Flight("A", "B", 100),
+            Flight("A", "C", 150),
+            Flight("B", "C", 40),
+            Flight("B", "D", 200),
+            Flight("C", "D", 100),
+            Flight("C", "E", 120),
+            Flight("D", "E", 80),
+            Flight("F", "A", 10),
+        ]
+        algo_jet.initialize_flight_graph(flights, landmarks=2)
+
+        result = []
+        for search in ["bidirectional", "alt"]:
+            result.append([algo_jet.get_cheapest_flight(source, destination, search)
+                           for source, destination in [("A", "E"), ("A", "D"), ("B", "E"), ("E", "A"), ("C", "C")]])
+        self.test_answer("test_bidirectional_and_landmark_searches", result, [[260, 240, 160, -1, 0]] * 2)
+
+    def test_searches_match_dijkstra(self):
+        rng = random.Random(526)
+        result = []
+        expected_answer = []
+        for price in [lambda: rng.randint(1, 500), lambda: round(rng.uniform(1, 500), 2)]:
+            flights = [Flight(f"C{rng.randrange(80)}", f"C{rng.randrange(80)}", price()) for _ in range(250)]
+            algo_jet = AlgoJet()
+            algo_jet.initialize_flight_graph(flights, landmarks=4)
+            for _ in range(300):
+                source, destination = rng.choice(flights).source, rng.choice(flights).destination
+                # the searches add up float prices in a different order, so they are compared after rounding
+                expected = round(algo_jet.get_cheapest_flight(source, destination), 6)
+                result.append([round(algo_jet.get_cheapest_flight(source, destination, "bidirectional"), 6),
+                               round(algo_jet.get_cheapest_flight(source, destination, "alt"), 6)])
+                expected_answer.append([expected, expected])
+
+        self.test_answer("test_searches_match_dijkstra", result, expected_answer)
+
+    def test_contraction_hierarchy(self):
+        algo_jet = AlgoJet()
+        flights = [
+            Flight("A", "B", 100),
+            Flight("A", "C", 150),
+            Flight("B", "C", 40),
+            Flight("B", "D", 200),
+            Flight("C", "D", 100),
+            Flight("C", "E", 120),
+            Flight("D", "E", 80),
+            Flight("F", "A", 10),
+        ]
+        algo_jet.initialize_flight_graph(flights)
+        algo_jet.build_contraction_hierarchy()
+
+        result = [algo_jet.get_cheapest_flight(source, destination, "hierarchy")
+                  for source, destination in [("A", "E"), ("F", "D"), ("E", "A")]]
+        result.append(len(algo_jet.hierarchy_ranks))
+        # loading more flights drops the hierarchy, which no longer matches the graph
+        algo_jet.initialize_flight_graph([Flight("A", "E", 1)])
+        try:
+            algo_jet.get_cheapest_flight("A", "E", "hierarchy")
+            result.append("no error")
+        except ValueError:
+            result.append("ValueError")
+        self.test_answer("test_contraction_hierarchy", result, [260, 250, -1, 6, "ValueError"])
+
+    def test_hierarchy_matches_dijkstra(self):
+        rng = random.Random(526)
+        result = []
+        expected_answer = []
+        for price in [lambda: rng.randint(1, 500), lambda: round(rng.uniform(1, 500), 2)]:
+            flights = [Flight(f"C{rng.randrange(100)}", f"C{rng.randrange(100)}", price()) for _ in range(400)]
+            algo_jet = AlgoJet()
+            algo_jet.initialize_flight_graph(flights)
+            # a tiny witness limit forces extra shortcuts, which must not change any price
+            for witness_limit in [50, 2]:
+                algo_jet.build_contraction_hierarchy(witness_limit)
+                for _ in range(200):
+                    source, destination = rng.choice(flights).source, rng.choice(flights).destination
+                    result.append(round(algo_jet.get_cheapest_flight(source, destination, "hierarchy"), 6))
+                    expected_answer.append(round(algo_jet.get_cheapest_flight(source, destination), 6))
+
+        self.test_answer("test_hierarchy_matches_dijkstra", result, expected_answer)
+
+    def test_cheapest_flights_from(self):
+        flights = [
+            Flight("A", "B", 100),
+            Flight("A", "C", 150),
+            Flight("B", "C", 40),
+            Flight("B", "D", 200),
+            Flight("C", "D", 100),
+            Flight("C", "E", 120),
+            Flight("D", "E", 80),
+            Flight("F", "A", 10),
+        ]
+        result = []
+        for compact in [False, True]:
+            algo_jet = AlgoJet()
+            algo_jet.initialize_flight_graph(flights, compact)
+            result.append(algo_jet.get_cheapest_flights_from("A"))
+            result.append(algo_jet.get_cheapest_flights_from("E"))
+        expected_answer = [{"A": 0, "B": 100, "C": 140, "D": 240, "E": 260}, {"E": 0}] * 2
+
+        self.test_answer("test_cheapest_flights_from", result, expected_answer)
+
+    def test_fare_table(self):
+        rng = random.Random(526)
+        flights = [Flight(f"C{rng.randrange(50)}", f"C{rng.randrange(50)}", rng.randint(1, 500)) for _ in range(300)]
+        hubs = ["C1", "C2", "C3", "C1"]
+        result = []
+        expected_answer = []
+        for compact in [False, True]:
+            algo_jet = AlgoJet()
+            algo_jet.initialize_flight_graph(flights, compact)
+            fare_table = algo_jet.build_fare_table(hubs, processes=2)
+            # every entry matches a single query, and unreachable cities are left out
+            for hub in hubs:
+                for city in ["C0", "C10", "C20", "C30", "C40"]:
+                    result.append(fare_table[hub].get(city, -1))
+                    expected_answer.append(algo_jet.get_cheapest_flight(hub, city))
+            result.append([sorted(fare_table), algo_jet.build_fare_table(["C1"])["C1"] is fare_table["C1"]])
+            expected_answer.append([["C1", "C2", "C3"], True])
+        # loading flights again drops the cached tables
+        algo_jet.initialize_flight_graph(flights)
+        result.append(algo_jet.fare_tables)
+        expected_answer.append({})
+
+        self.test_answer("test_fare_table", result, expected_answer)
+
+    def test_query_cache(self):
+        algo_jet = AlgoJet(cache_size=2, hot_source_cache_size=1, hot_source_queries=3)
+        flights = [
+            Flight("A", "B", 100),
+            Flight("A", "C", 150),
+            Flight("B", "C", 40),
+            Flight("B", "D", 200),
+            Flight("C", "D", 100),
+            Flight("C", "E", 120),
+            Flight("D", "E", 80),
+        ]
+        algo_jet.initialize_flight_graph(flights)
+
+        result = []
+        # A becomes hot on its third miss, so its later queries never search again. The price cache only holds two
+        # answers, so the others are evicted in least recently used order
+        for source, destination in [("A", "E"), ("A", "E"), ("A", "D"), ("B", "E"), ("A", "C"), ("A", "E"),
+                                    ("C", "E"), ("D", "E"), ("B", "E")]:
+            result.append(algo_jet.get_cheapest_flight(source, destination))
+        result.append([algo_jet.cache_hits, algo_jet.cache_misses, algo_jet.cache_evictions,
+                       list(algo_jet.price_cache), list(algo_jet.hot_source_cache)])
+        expected_answer = [260, 260, 240, 160, 140, 260, 120, 80, 160,
+                           [2, 7, 5, [("D", "E"), ("B", "E")], ["A"]]]
+
+        self.test_answer("test_query_cache", result, expected_answer)
+
+    def test_query_cache_invalidation(self):
+        algo_jet = AlgoJet(cache_size=10, hot_source_cache_size=10, hot_source_queries=1)
+        algo_jet.initialize_flight_graph([Flight("A", "B", 100), Flight("B", "C", 100)])
+        result = [algo_jet.get_cheapest_flight("A", "C")]
+        # a cheaper direct flight is loaded, the cached fares of A must not be used any more
+        algo_jet.initialize_flight_graph([Flight("A", "C", 50)])
+        result.append(algo_jet.get_cheapest_flight("A", "C"))
+        # every update of a route drops the cached answers, including price increases and removed routes
+        algo_jet.update_flight("A", "C", 20)
+        result.append(algo_jet.get_cheapest_flight("A", "C"))
+        algo_jet.update_flight("A", "C", 500)
+        result.append(algo_jet.get_cheapest_flight("A", "C"))
+        algo_jet.update_flight("A", "C")
+        result.append(algo_jet.get_cheapest_flight("A", "C"))
+        algo_jet.update_flight("A", "B")
+        result.append(algo_jet.get_cheapest_flight("A", "C"))
+
+        # the same updates on the compact graph, in place for an existing route and rebuilt for a new one
+        compact_algo_jet = AlgoJet(cache_size=10)
+        compact_algo_jet.initialize_flight_graph([Flight("A", "B", 100), Flight("B", "C", 100)], compact=True)
+        result.append(compact_algo_jet.get_cheapest_flight("A", "C"))
+        compact_algo_jet.update_flight("B", "C", 30)
+        result.append(compact_algo_jet.get_cheapest_flight("A", "C"))
+        compact_algo_jet.update_flight("A", "C", 12.5)
+        result.append(compact_algo_jet.get_cheapest_flight("A", "C"))
+        compact_algo_jet.update_flight("A", "C")
+        result.append(compact_algo_jet.get_cheapest_flight("A", "C"))
+
+        self.test_answer("test_query_cache_invalidation", result, [200, 50, 20, 200, 200, -1, 200, 130, 12.5, 130])
+
+    def test_unknown_destination(self):
+        flights = [Flight("A", "B", 100), Flight("C", "A", 100)]
+        result = []
+        # a city that is not in the graph raises KeyError with and without the caches, an unreachable one is -1
+        for sizes in [(0, 0), (10, 0), (10, 10)]:
+            for compact in [False, True]:
+                algo_jet = AlgoJet(*sizes, hot_source_queries=1)
+                algo_jet.initialize_flight_graph(flights, compact)
+                answers = []
+                for destination in ["B", "C", "Z", "C"]:
+                    try:
+                        answers.append(algo_jet.get_cheapest_flight("A", destination))
+                    except KeyError:
+                        answers.append("KeyError")
+                result.append(answers)
+        expected_answer = [[100, -1, "KeyError", -1]] * 6
+
+        self.test_answer("test_unknown_destination", result, expected_answer)
 
 
 if __name__ == '__main__':
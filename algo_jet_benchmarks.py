@@ -0,0 +1,250 @@
+"""
+Benchmarks for the AlgoJet cheapest flight queries.
+
+Run every benchmark with:
+    python algo_jet_benchmarks.py
+
+or only some of them by name:
+    python algo_jet_benchmarks.py compact_graph
+
+Code Author: Brendan Torok
+"""
+import math
+import random
+import sys
+import time
+import tracemalloc
+
+from algo_jet import AlgoJet, Flight
+
+
+def generate_flights(cities, flights_per_city, seed=526):
+    # every city has flights to random other cities, a few hubs get a share of all flights so the network has the
+    # hub and spoke shape of real airlines. Some routes are offered more than once at different prices
+    rng = random.Random(seed)
+    names = [f"CITY{city:07d}" for city in range(cities)]
+    hubs = names[:max(1, cities // 1000)]
+    flights = []
+    for source in names:
+        for _ in range(flights_per_city):
+            destination = rng.choice(hubs) if rng.random() < 0.2 else rng.choice(names)
+            flights.append(Flight(source, destination, rng.randint(20, 2000)))
+    return flights
+
+
+def generate_geographic_flights(cities, flights_per_city, seed=526):
+    # cities at random points of a square map. Every city has flights to its nearest cities and back, priced by
+    # distance plus a fee, the way regional routes connect neighbouring airports. The hubs (one city in a thousand)
+    # are also connected to each other by cheaper long-haul flights, so long trips are cheapest through a hub
+    rng = random.Random(seed)
+    grid_size = max(1, int(math.sqrt(cities / 4)))
+    positions = [(rng.random(), rng.random()) for _ in range(cities)]
+    cells = {}
+    for city, (x, y) in enumerate(positions):
+        cells.setdefault((int(x * grid_size), int(y * grid_size)), []).append(city)
+
+    def price(source, destination):
+        (x1, y1), (x2, y2) = positions[source], positions[destination]
+        return int(math.hypot(x1 - x2, y1 - y2) * 10_000) + rng.randint(20, 100)
+
+    names = [f"CITY{city:07d}" for city in range(cities)]
+    flights = []
+    for city, (x, y) in enumerate(positions):
+        cell_x, cell_y = int(x * grid_size), int(y * grid_size)
+        nearby = [other for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                  for other in cells.get((cell_x + dx, cell_y + dy), []) if other != city]
+        nearby.sort(key=lambda other: math.dist(positions[city], positions[other]))
+        for destination in nearby[:flights_per_city // 2]:
+            flights.append(Flight(names[city], names[destination], price(city, destination)))
+            flights.append(Flight(names[destination], names[city], price(destination, city)))
+    hubs = range(0, cities, 1000)
+    for source in hubs:
+        for destination in hubs:
+            if source != destination:
+                flights.append(Flight(names[source], names[destination], price(source, destination) // 2))
+    return flights
+
+
+def dict_graph_size(graph):
+    # bytes held by a dictionary graph and its inner dictionaries, the city names and prices are not counted
+    return sys.getsizeof(graph) + sum(sys.getsizeof(destinations) for destinations in graph.values())
+
+
+def generate_queries(flights, queries, seed=526):
+    rng = random.Random(seed)
+    return [(rng.choice(flights).source, rng.choice(flights).destination) for _ in range(queries)]
+
+
+def generate_zipf_query_log(flights, queries, popular_pairs=300, popular_sources=60, exponent=1.1, seed=526):
+    # customer traffic: a few hundred popular city pairs out of a few dozen popular sources, the ith most popular pair
+    # asked with probability proportional to 1 / i^exponent
+    rng = random.Random(seed)
+    sources = [rng.choice(flights).source for _ in range(popular_sources)]
+    pairs = [(rng.choice(sources), rng.choice(flights).destination) for _ in range(popular_pairs)]
+    weights = [1 / (rank + 1) ** exponent for rank in range(popular_pairs)]
+    return rng.choices(pairs, weights, k=queries)
+
+
+def time_queries(query, pairs):
+    # return the average latency of the query in milliseconds
+    start = time.perf_counter()
+    for source, destination in pairs:
+        query(source, destination)
+    return (time.perf_counter() - start) / len(pairs) * 1e3
+
+
+class BenchmarkAlgoJet:
+    def run_benchmarks(self, names=None):
+        benchmarks = {
+            "compact_graph": self.benchmark_compact_graph,
+            "search_modes": self.benchmark_search_modes,
+            "contraction_hierarchy": self.benchmark_contraction_hierarchy,
+            "fare_tables": self.benchmark_fare_tables,
+            "query_cache": self.benchmark_query_cache,
+        }
+        for name, benchmark in benchmarks.items():
+            if not names or name in names:
+                print(f"--- {name} ---")
+                benchmark()
+
+    def print_benchmark_result(self, label, value, unit):
+        print(f"{label:<48} {value:>14.2f} {unit}")
+
+    def benchmark_compact_graph(self, cities=200_000, flights_per_city=10, queries=20):
+        pairs = generate_queries(generate_flights(cities, flights_per_city), queries)
+        for label, compact in [("dict graph", False), ("compact graph", True)]:
+            flights = generate_flights(cities, flights_per_city)
+            start = time.perf_counter()
+            algo_jet = AlgoJet()
+            algo_jet.initialize_flight_graph(flights, compact)
+            self.print_benchmark_result(f"{label} build", time.perf_counter() - start, "s")
+            self.print_benchmark_result(f"{label} query latency", time_queries(algo_jet.get_cheapest_flight, pairs),
+                                        "ms/query")
+            del algo_jet, flights
+
+            # the same load traced separately, since tracing slows every allocation down. The flights are generated
+            # inside the trace and dropped after the build like after the nightly load, so the memory still held is
+            # the graph with its city names and the price objects it keeps alive
+            tracemalloc.start()
+            flights = generate_flights(cities, flights_per_city)
+            algo_jet = AlgoJet()
+            algo_jet.initialize_flight_graph(flights, compact)
+            del flights
+            memory, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.print_benchmark_result(f"{label} memory", memory / 2 ** 20, "MiB")
+            self.print_benchmark_result(f"{label} peak memory during load", peak / 2 ** 20, "MiB")
+            del algo_jet
+
+    def benchmark_search_modes(self, cities=100_000, flights_per_city=6, landmarks=8, queries=50):
+        flights = generate_geographic_flights(cities, flights_per_city)
+        pairs = generate_queries(flights, queries)
+        start = time.perf_counter()
+        algo_jet = AlgoJet()
+        algo_jet.initialize_flight_graph(flights)
+        self.print_benchmark_result("build graph and reverse graph", time.perf_counter() - start, "s")
+        start = time.perf_counter()
+        algo_jet.build_landmarks(landmarks)
+        self.print_benchmark_result(f"precompute {landmarks} landmarks", time.perf_counter() - start, "s")
+
+        for search in ["dijkstra", "bidirectional", "alt"]:
+            settled_cities = 0
+            start = time.perf_counter()
+            for source, destination in pairs:
+                algo_jet.get_cheapest_flight(source, destination, search)
+                settled_cities += algo_jet.settled_cities
+            elapsed = time.perf_counter() - start
+            self.print_benchmark_result(f"{search} settled cities", settled_cities / queries, "cities/query")
+            self.print_benchmark_result(f"{search} query latency", elapsed / queries * 1e3, "ms/query")
+
+    def benchmark_contraction_hierarchy(self, cities=100_000, flights_per_city=6, queries=50):
+        flights = generate_geographic_flights(cities, flights_per_city)
+        pairs = generate_queries(flights, queries)
+        algo_jet = AlgoJet()
+        algo_jet.initialize_flight_graph(flights)
+
+        start = time.perf_counter()
+        algo_jet.build_contraction_hierarchy()
+        self.print_benchmark_result("contraction hierarchy preprocessing", time.perf_counter() - start, "s")
+        flight_count = sum(len(destinations) for destinations in algo_jet.graph.values())
+        hierarchy_count = sum(len(destinations) for destinations in algo_jet.upward_graph.values())
+        hierarchy_count += sum(len(sources) for sources in algo_jet.downward_graph.values())
+        self.print_benchmark_result("shortcuts added", hierarchy_count - flight_count, "shortcuts")
+        graph_memory = dict_graph_size(algo_jet.graph) + dict_graph_size(algo_jet.reverse_graph)
+        hierarchy_memory = (dict_graph_size(algo_jet.upward_graph) + dict_graph_size(algo_jet.downward_graph) +
+                            sys.getsizeof(algo_jet.hierarchy_ranks))
+        self.print_benchmark_result("graph and reverse graph memory", graph_memory / 2 ** 20, "MiB")
+        self.print_benchmark_result("extra hierarchy memory", hierarchy_memory / 2 ** 20, "MiB")
+
+        latencies = {}
+        for search in ["dijkstra", "hierarchy"]:
+            settled_cities = 0
+            start = time.perf_counter()
+            for source, destination in pairs:
+                algo_jet.get_cheapest_flight(source, destination, search)
+                settled_cities += algo_jet.settled_cities
+            latencies[search] = (time.perf_counter() - start) / queries
+            self.print_benchmark_result(f"{search} settled cities", settled_cities / queries, "cities/query")
+            self.print_benchmark_result(f"{search} query latency", latencies[search] * 1e3, "ms/query")
+        self.print_benchmark_result("hierarchy query speedup", latencies["dijkstra"] / latencies["hierarchy"], "x")
+
+    def benchmark_fare_tables(self, cities=100_000, flights_per_city=6, destinations=20, hubs=32,
+                              worker_counts=(1, 4)):
+        flights = generate_geographic_flights(cities, flights_per_city)
+        algo_jet = AlgoJet()
+        algo_jet.initialize_flight_graph(flights)
+        rng = random.Random(cities)
+        source = rng.choice(flights).source
+
+        # today: one get_cheapest_flight per destination shown on the page
+        pairs = [(source, rng.choice(flights).destination) for _ in range(destinations)]
+        latency = time_queries(algo_jet.get_cheapest_flight, pairs)
+        self.print_benchmark_result("get_cheapest_flight per destination", latency * 1e3, "us/destination")
+
+        start = time.perf_counter()
+        fares = algo_jet.get_cheapest_flights_from(source)
+        self.print_benchmark_result("get_cheapest_flights_from per destination",
+                                    (time.perf_counter() - start) / len(fares) * 1e6, "us/destination")
+
+        hub_cities = [f"CITY{city:07d}" for city in range(0, cities, 1000)][:hubs]
+        for workers in worker_counts:
+            # every run starts from an empty cache
+            algo_jet.fare_tables = {}
+            start = time.perf_counter()
+            fare_table = algo_jet.build_fare_table(hub_cities, workers)
+            elapsed = time.perf_counter() - start
+            entries = sum(len(fares) for fares in fare_table.values())
+            self.print_benchmark_result(f"build_fare_table {len(hub_cities)} hubs {workers} workers", elapsed, "s")
+            self.print_benchmark_result(f"build_fare_table {workers} workers per destination", elapsed / entries * 1e6,
+                                        "us/destination")
+
+        start = time.perf_counter()
+        algo_jet.build_fare_table(hub_cities)
+        self.print_benchmark_result("cached build_fare_table", (time.perf_counter() - start) * 1e3, "ms")
+
+    def benchmark_query_cache(self, cities=20_000, flights_per_city=6, queries=5_000, uncached_queries=200,
+                              cache_size=1_000, hot_source_cache_size=64):
+        flights = generate_geographic_flights(cities, flights_per_city)
+        query_log = generate_zipf_query_log(flights, queries)
+
+        # without a cache every query searches, so a prefix of the log is enough to measure it
+        algo_jet = AlgoJet()
+        algo_jet.initialize_flight_graph(flights)
+        self.print_benchmark_result("uncached query latency",
+                                    time_queries(algo_jet.get_cheapest_flight, query_log[:uncached_queries]),
+                                    "ms/query")
+
+        for label, sizes in [("small price cache", (cache_size // 10, 0)), ("price cache", (cache_size, 0)),
+                             ("price and hot source caches", (cache_size, hot_source_cache_size))]:
+            algo_jet = AlgoJet(*sizes)
+            algo_jet.initialize_flight_graph(flights)
+            self.print_benchmark_result(f"{label} query latency",
+                                        time_queries(algo_jet.get_cheapest_flight, query_log), "ms/query")
+            self.print_benchmark_result(f"{label} hit rate", algo_jet.get_cache_hit_rate() * 100, "%")
+            self.print_benchmark_result(f"{label} misses", algo_jet.cache_misses, "queries")
+            self.print_benchmark_result(f"{label} evictions", algo_jet.cache_evictions, "entries")
+
+
+if __name__ == '__main__':
+    benchmark_runner = BenchmarkAlgoJet()
+    benchmark_runner.run_benchmarks(sys.argv[1:])